@@ -0,0 +1,253 @@
+"""
+Per-user activity log and dashboard counters.
+
+Generation endpoints append an event (analysis, script, keyword research, ...)
+to an in-memory ring buffer; a background task writes the buffer to a local
+SQLite file in batches, so the request path never touches the database.
+
+Dashboard counters are maintained incrementally: every flush adds the batch's
+counts to an (owner, day, kind) aggregate table in the same transaction and
+reads back the few aggregate rows of the owners it touched; events not yet
+flushed are counted in memory on top of that. /api/stats therefore never scans
+the event table. Aggregates read by a worker are re-read after COUNTS_TTL
+seconds so flushes from other workers show up. Owner "*" holds the totals
+across all users.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+ACTIVITY_DB_PATH = os.getenv(
+    "ACTIVITY_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "activity.sqlite3")
+)
+# Unflushed events kept in memory; the oldest are dropped if the flusher falls behind
+RING_SIZE = int(os.getenv("ACTIVITY_RING_SIZE", "10000"))
+SERIES_DAYS = int(os.getenv("ACTIVITY_SERIES_DAYS", "30"))
+# How long a worker serves persisted aggregates before re-reading them
+COUNTS_TTL = float(os.getenv("ACTIVITY_COUNTS_TTL", "30"))
+ALL_USERS = "*"
+
+# kind -> key used by the dashboard
+KINDS = {
+    "thumbnail": "thumbnails",
+    "script": "scripts",
+    "keyword": "keywords",
+    "ideas": "ideas",
+    "social": "posts",
+}
+
+
+def _day(ts: float) -> str:
+    return date.fromtimestamp(ts).isoformat()
+
+
+def _event_key(event: dict) -> tuple:
+    """Identity of an event; the same whether it is read from memory or from the table."""
+    return event["ts"], event["user"], event["kind"], event["action"], event["item"]
+
+
+def relative_time(ts: float, now: Optional[float] = None) -> str:
+    """Compact "2 hours ago" style label, as shown by RecentActivity."""
+    seconds = max(0, int((now or time.time()) - ts))
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= size:
+            n = seconds // size
+            return f"{n} {unit}{'s' if n > 1 else ''} ago"
+    return "just now"
+
+
+class ActivityLog:
+    def __init__(self, db_path: str = ACTIVITY_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._pending = deque(maxlen=RING_SIZE)
+        self.dropped = 0
+        # Counts of pending events: owner -> day -> kind -> n
+        self._unflushed = defaultdict(lambda: defaultdict(Counter))
+        # Batch being written by flush(), still served by reads until it is committed
+        self._in_flush: List[dict] = []
+        self._in_flush_counts: Dict[str, Dict[str, Counter]] = {}
+        self._flushes = 0  # batches taken by flush(), to spot reads racing a flush
+        # Persisted aggregates for the owners seen by this worker, refreshed on
+        # flush and after COUNTS_TTL; owner -> (loaded at, counts)
+        self._persisted: Dict[str, tuple] = {}
+        self._db_ready = False
+
+    def record(self, user: Optional[str], kind: str, action: str, item: str) -> dict:
+        event = {
+            "ts": time.time(),
+            "user": user or "anonymous",
+            "kind": kind,
+            "action": action,
+            "item": (item or "")[:200],
+        }
+        day = _day(event["ts"])
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                old = self._pending[0]
+                self.dropped += 1
+                for owner in (old["user"], ALL_USERS):
+                    self._unflushed[owner][_day(old["ts"])][old["kind"]] -= 1
+            self._pending.append(event)
+            for owner in (event["user"], ALL_USERS):
+                self._unflushed[owner][day][kind] += 1
+        return event
+
+    # ---------------- persistence ----------------
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        if not self._db_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS activity ("
+                " ts REAL, user TEXT, kind TEXT, action TEXT, item TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS activity_user_ts ON activity (user, ts)")
+            conn.execute("CREATE INDEX IF NOT EXISTS activity_ts ON activity (ts)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS activity_counts ("
+                " owner TEXT, day TEXT, kind TEXT, n INTEGER NOT NULL,"
+                " PRIMARY KEY (owner, day, kind))"
+            )
+            self._db_ready = True
+        return conn
+
+    def _load_counts(self, conn, owners) -> Dict[str, Dict[str, Counter]]:
+        counts = {owner: defaultdict(Counter) for owner in owners}
+        for owner in owners:
+            for day, kind, n in conn.execute(
+                "SELECT day, kind, n FROM activity_counts WHERE owner = ?", (owner,)
+            ):
+                counts[owner][day][kind] = n
+        return counts
+
+    def flush(self) -> int:
+        """Write pending events and their counts in one transaction; returns how many were written."""
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch = list(self._pending)
+            self._pending.clear()
+            unflushed, self._unflushed = self._unflushed, defaultdict(lambda: defaultdict(Counter))
+            self._flushes += 1
+            self._in_flush, self._in_flush_counts = batch, unflushed
+        increments = [
+            (owner, day, kind, n)
+            for owner, days in unflushed.items()
+            for day, kinds in days.items()
+            for kind, n in kinds.items() if n
+        ]
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO activity VALUES (:ts, :user, :kind, :action, :item)", batch
+                )
+                conn.executemany(
+                    "INSERT INTO activity_counts (owner, day, kind, n) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(owner, day, kind) DO UPDATE SET n = n + excluded.n",
+                    increments,
+                )
+            persisted = self._load_counts(conn, set(unflushed) | {ALL_USERS})
+            conn.close()
+        except Exception as e:
+            print(f"[ERROR] Failed to flush {len(batch)} activity events: {e}")
+            with self._lock:
+                self._pending.extendleft(reversed(batch))
+                for owner, days in unflushed.items():
+                    for day, kinds in days.items():
+                        self._unflushed[owner][day].update(kinds)
+                self._in_flush, self._in_flush_counts = [], {}
+            return 0
+        loaded_at = time.monotonic()
+        with self._lock:
+            self._persisted.update((owner, (loaded_at, counts)) for owner, counts in persisted.items())
+            self._in_flush, self._in_flush_counts = [], {}
+        return len(batch)
+
+    def _persisted_for(self, owner: str) -> Dict[str, Counter]:
+        cached = self._persisted.get(owner)
+        if cached is not None and time.monotonic() - cached[0] < COUNTS_TTL:
+            return cached[1]
+        # Not loaded yet on this worker, or other workers may have flushed since
+        with self._lock:
+            flushes, flushing = self._flushes, bool(self._in_flush)
+        if flushing and cached is not None:
+            return cached[1]
+        try:
+            conn = self._connect()
+            counts = self._load_counts(conn, [owner])[owner]
+            conn.close()
+        except Exception as e:
+            print(f"[ERROR] Failed to read activity counts: {e}")
+            return cached[1] if cached is not None else defaultdict(Counter)
+        with self._lock:
+            # If a flush ran meanwhile, the read may already include its batch
+            # while it is still counted as in flight; keep the flush's own read
+            if not flushing and flushes == self._flushes and not self._in_flush:
+                self._persisted[owner] = (time.monotonic(), counts)
+            elif owner in self._persisted:
+                counts = self._persisted[owner][1]
+        return counts
+
+    # ---------------- reads ----------------
+    def stats(self, user: Optional[str] = None) -> dict:
+        owner = user or ALL_USERS
+        persisted = self._persisted_for(owner)
+        today = date.today()
+        days = [(today - timedelta(days=i)).isoformat() for i in range(SERIES_DAYS - 1, -1, -1)]
+        with self._lock:
+            # A flush may have committed (and cleared _in_flush) since the lookup above
+            persisted = self._persisted.get(owner, (0, persisted))[1]
+            sources = (persisted, self._in_flush_counts.get(owner, {}), self._unflushed.get(owner, {}))
+            totals = Counter()
+            for source in sources:
+                for kinds in source.values():
+                    totals.update(kinds)
+            daily = []
+            for day in days:
+                counts = Counter()
+                for source in sources:
+                    counts.update(source.get(day, {}))
+                daily.append({"date": day, **{key: counts.get(kind, 0) for kind, key in KINDS.items()}})
+        return {
+            **{key: totals.get(kind, 0) for kind, key in KINDS.items()},
+            "daily": daily,
+        }
+
+    def recent(self, user: Optional[str] = None, limit: int = 20) -> List[dict]:
+        """
+        Latest events (newest first), unflushed ones included. The table is read
+        without the lock, so a flush committing in between can put an event in
+        both reads; duplicates are dropped by event identity.
+        """
+        with self._lock:
+            events = [e for e in (*self._in_flush, *self._pending) if user is None or e["user"] == user][-limit:]
+        try:
+            conn = self._connect()
+            if user is None:
+                rows = conn.execute(
+                    "SELECT ts, user, kind, action, item FROM activity ORDER BY ts DESC LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT ts, user, kind, action, item FROM activity WHERE user = ? ORDER BY ts DESC LIMIT ?",
+                    (user, limit),
+                ).fetchall()
+            conn.close()
+            events += [dict(zip(("ts", "user", "kind", "action", "item"), row)) for row in rows]
+        except Exception as e:
+            print(f"[ERROR] Failed to read activity log: {e}")
+        events = list({_event_key(e): e for e in events}.values())
+        events.sort(key=lambda e: e["ts"], reverse=True)
+        now = time.time()
+        return [
+            {"action": e["action"], "item": e["item"], "time": relative_time(e["ts"], now),
+             "kind": e["kind"], "ts": e["ts"]}
+            for e in events[:limit]
+        ]
@@ -0,0 +1,327 @@
+"""
+Priority-aware admission control for the generation endpoints.
+
+Each worker admits at most ADMISSION_MAX_CONCURRENCY requests into upstream
+models at a time. Requests that can't start immediately wait in a per-tier
+priority queue (pro ahead of trial). When the queue is saturated, trial traffic
+is shed first with 429 + Retry-After. Per-user concurrency caps, per-user
+request rates and per-user token budgets (the last two shared across workers
+via the state backend) are enforced before a request is queued. Backend calls
+run in worker threads so the event loop never waits on them.
+
+Callers are identified by auth.Authenticator before they reach the controller
+(tier is "pro" or "trial"; anything else is treated as trial).
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+# Lower number = served first. "prefetch" is internal background work and never queues.
+TIER_PRIORITY = {"pro": 0, "trial": 1, "prefetch": 2}
+CLIENT_TIERS = ("pro", "trial")
+DEFAULT_TIER = "trial"
+
+MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "8"))
+MAX_QUEUE = {
+    "pro": int(os.getenv("ADMISSION_MAX_QUEUE_PRO", "32")),
+    "trial": int(os.getenv("ADMISSION_MAX_QUEUE_TRIAL", "8")),
+}
+MAX_WAIT = {
+    "pro": float(os.getenv("ADMISSION_MAX_WAIT_PRO", "30")),
+    "trial": float(os.getenv("ADMISSION_MAX_WAIT_TRIAL", "10")),
+}
+USER_CONCURRENCY = {
+    "pro": int(os.getenv("ADMISSION_USER_CONCURRENCY_PRO", "4")),
+    "trial": int(os.getenv("ADMISSION_USER_CONCURRENCY_TRIAL", "2")),
+}
+# Upstream tokens each user may spend per QUOTA_WINDOW seconds
+TOKEN_BUDGET = {
+    "pro": int(os.getenv("ADMISSION_TOKEN_BUDGET_PRO", "200000")),
+    "trial": int(os.getenv("ADMISSION_TOKEN_BUDGET_TRIAL", "20000")),
+}
+QUOTA_WINDOW = int(os.getenv("ADMISSION_QUOTA_WINDOW", "3600"))
+# Requests each user may start per minute (token bucket, bursts up to RATE_BURST); 0 disables
+RATE_PER_MINUTE = {
+    "pro": float(os.getenv("ADMISSION_RATE_PER_MINUTE_PRO", "120")),
+    "trial": float(os.getenv("ADMISSION_RATE_PER_MINUTE_TRIAL", "30")),
+}
+RATE_BURST = {
+    "pro": float(os.getenv("ADMISSION_RATE_BURST_PRO", "20")),
+    "trial": float(os.getenv("ADMISSION_RATE_BURST_TRIAL", "10")),
+}
+# Background work is only admitted while fewer than this share of slots are busy
+PREFETCH_IDLE_FRACTION = float(os.getenv("ADMISSION_PREFETCH_IDLE_FRACTION", "0.5"))
+# Upstream tokens speculative prefetch may spend per user per QUOTA_WINDOW (also charged to TOKEN_BUDGET)
+PREFETCH_TOKEN_BUDGET = int(os.getenv("ADMISSION_PREFETCH_TOKEN_BUDGET", "10000"))
+
+_WAIT_SAMPLES = 500
+
+# Ticket of the request being served, for code that needs the caller's route/user
+current_ticket: contextvars.ContextVar = contextvars.ContextVar("admission_ticket", default=None)
+
+
+class Ticket:
+    """An admitted request; must be released exactly once."""
+
+    def __init__(self, user: str, tier: str, route: str, tokens: int):
+        self.user = user
+        self.tier = tier
+        self.route = route
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.released = False
+        self.used_tokens = 0  # actual upstream tokens, filled in by usage accounting
+
+
+def _log_failed_write(future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        print(f"[ERROR] Failed to update token budget: {future.exception()}")
+
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+    )
+
+
+class AdmissionController:
+    def __init__(self, state_getter: Callable, capacity: int = MAX_CONCURRENCY):
+        self._state_getter = state_getter
+        self.capacity = capacity
+        self.in_flight = 0
+        self._queue = []  # heap of (priority, seq, ticket, future)
+        self._seq = itertools.count()
+        self._user_active: Dict[str, int] = defaultdict(int)
+        self._avg_service = 2.0  # EWMA of seconds a slot is held, used for Retry-After
+        self.wait_samples = {tier: deque(maxlen=_WAIT_SAMPLES) for tier in TIER_PRIORITY}
+        self.admitted = defaultdict(int)
+        self.shed = defaultdict(lambda: defaultdict(int))
+
+    # ---------------- admission ----------------
+    def _queued(self, tier: Optional[str] = None) -> int:
+        return sum(1 for _, _, t, fut in self._queue if not fut.done() and (tier is None or t.tier == tier))
+
+    def _retry_after(self) -> float:
+        return self._avg_service * (1 + self._queued()) / max(1, self.capacity)
+
+    def _reject(self, ticket: Ticket, reason: str, detail: str, retry_after: float):
+        self.shed[ticket.tier][reason] += 1
+        print(f"[ADMISSION] Rejected {ticket.tier} user {ticket.user} on {ticket.route}: {reason}")
+        raise _too_many(detail, retry_after)
+
+    def _check_limits(self, ticket: Ticket):
+        """
+        Take a rate-limit token and charge the token estimate to the budget.
+        Blocking; returns (reason, retry_after) when the request must be
+        rejected, else (None, 0).
+        """
+        state = self._state_getter()
+        per_minute = RATE_PER_MINUTE[ticket.tier]
+        if per_minute > 0:
+            wait = state.take_token(f"rate:{ticket.user}", per_minute / 60.0, RATE_BURST[ticket.tier])
+            if wait > 0:
+                return "rate", wait
+        window = int(time.time() // QUOTA_WINDOW)
+        key = f"quota:{ticket.user}:{window}"
+        used = state.incr(key, ticket.tokens, ttl=QUOTA_WINDOW)
+        if used > TOKEN_BUDGET[ticket.tier]:
+            state.incr(key, -ticket.tokens)
+            return "quota", (window + 1) * QUOTA_WINDOW - time.time()
+        return None, 0.0
+
+    def charge_tokens(self, user: str, tokens: int) -> None:
+        """
+        Adjust the user's budget by tokens (negative values refund an
+        over-estimate). The write happens in a worker thread when called from
+        the event loop.
+        """
+        self._incr_later(f"quota:{user}:{int(time.time() // QUOTA_WINDOW)}", tokens)
+
+    def _incr_later(self, key: str, tokens: int) -> None:
+        if not tokens:
+            return
+        state = self._state_getter()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            state.incr(key, tokens, ttl=QUOTA_WINDOW)
+            return
+        loop.run_in_executor(None, state.incr, key, tokens, QUOTA_WINDOW).add_done_callback(_log_failed_write)
+
+    def _evict_lower_priority(self, tier: str) -> bool:
+        """Shed the most recently queued waiter of a lower-priority tier to make room."""
+        priority = TIER_PRIORITY[tier]
+        candidates = [entry for entry in self._queue if entry[0] > priority and not entry[3].done()]
+        if not candidates:
+            return False
+        victim = max(candidates, key=lambda entry: (entry[0], entry[1]))
+        victim[3].set_exception(_too_many("Server busy, please retry shortly", self._retry_after()))
+        self.shed[victim[2].tier]["evicted"] += 1
+        return True
+
+    async def acquire(self, user: str, tier: str, route: str, tokens: int) -> Ticket:
+        if tier not in CLIENT_TIERS:
+            tier = DEFAULT_TIER
+        ticket = Ticket(user, tier, route, tokens)
+
+        if self._user_active.get(user, 0) >= USER_CONCURRENCY[tier]:
+            self._reject(ticket, "user_concurrency", "Too many concurrent requests for this user", self._avg_service)
+        # Counted as active while the shared limits are checked, so concurrent
+        # requests of the same user can't all slip under the cap meanwhile
+        self._user_active[user] += 1
+        check = asyncio.ensure_future(asyncio.to_thread(self._check_limits, ticket))
+        try:
+            reason, retry_after = await asyncio.shield(check)
+        except asyncio.CancelledError:
+            # Client went away; the check still finishes, so hand back what it charged
+            self._dec_user(user)
+
+            def refund_if_charged(done):
+                if not done.cancelled() and done.exception() is None and done.result()[0] is None:
+                    self._refund(ticket)
+            check.add_done_callback(refund_if_charged)
+            raise
+        except BaseException:
+            self._dec_user(user)
+            raise
+        self._dec_user(user)
+        if reason == "rate":
+            self._reject(ticket, "rate", "Too many requests, please slow down", retry_after)
+        if reason == "quota":
+            self._reject(ticket, "quota", "Token budget exhausted for this period", retry_after)
+
+        if self.in_flight < self.capacity and not self._queued():
+            return self._start(ticket)
+
+        if self._queued(tier) >= MAX_QUEUE[tier] and not self._evict_lower_priority(tier):
+            self._refund(ticket)
+            self._reject(ticket, "queue_full", "Server busy, please retry shortly", self._retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (TIER_PRIORITY[tier], next(self._seq), ticket, future))
+        self._user_active[user] += 1  # count queued requests against the per-user cap
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=MAX_WAIT[tier])
+        except asyncio.TimeoutError:
+            self._dec_user(user)
+            if future.done() and not future.exception():
+                # Granted a slot just as the wait timed out; hand it on
+                self._release_slot()
+            else:
+                future.cancel()
+            self._refund(ticket)
+            self._reject(ticket, "timeout", "Server busy, please retry shortly", self._retry_after())
+        except HTTPException:
+            self._dec_user(user)
+            self._refund(ticket)
+            raise
+        except asyncio.CancelledError:
+            # Client went away while queued
+            self._dec_user(user)
+            if future.done() and not future.cancelled() and not future.exception():
+                self._release_slot()
+            else:
+                future.cancel()
+            self._refund(ticket)
+            raise
+        self._dec_user(user)
+        return self._start(ticket, already_counted=True)
+
+    def prefetch_allowed(self, user: str, tier: str) -> bool:
+        """
+        Whether the user has budget left for speculative work: under both
+        PREFETCH_TOKEN_BUDGET and their tier's TOKEN_BUDGET this window. Blocking.
+        """
+        window = int(time.time() // QUOTA_WINDOW)
+        state = self._state_getter()
+        if (state.get(f"prefetch_quota:{user}:{window}") or 0) >= PREFETCH_TOKEN_BUDGET:
+            return False
+        return (state.get(f"quota:{user}:{window}") or 0) < TOKEN_BUDGET.get(tier, TOKEN_BUDGET[DEFAULT_TIER])
+
+    def try_acquire_idle(self, user: str, route: str) -> Optional[Ticket]:
+        """
+        Admit background work only while the worker is mostly idle. Never queues
+        and is not counted against the user's concurrency cap; the tokens it
+        actually uses are charged to the user on release.
+        """
+        if self._queued() or self.in_flight >= self.capacity * PREFETCH_IDLE_FRACTION:
+            return None
+        return self._start(Ticket(user, "prefetch", route, 0))
+
+    def _dec_user(self, user: str) -> None:
+        self._user_active[user] -= 1
+        if self._user_active[user] <= 0:
+            del self._user_active[user]
+
+    def _refund(self, ticket: Ticket) -> None:
+        self.charge_tokens(ticket.user, -ticket.tokens)
+
+    def _start(self, ticket: Ticket, already_counted: bool = False) -> Ticket:
+        if not already_counted:
+            self.in_flight += 1
+        if ticket.tier in CLIENT_TIERS:
+            self._user_active[ticket.user] += 1
+        ticket.started_at = time.monotonic()
+        self.wait_samples[ticket.tier].append(ticket.started_at - ticket.enqueued_at)
+        self.admitted[ticket.tier] += 1
+        return ticket
+
+    def _release_slot(self) -> None:
+        """Hand the freed slot to the highest-priority live waiter, or return it to the pool."""
+        while self._queue:
+            _, _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(True)  # slot ownership moves to the waiter
+                return
+        self.in_flight -= 1
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.tier in CLIENT_TIERS:
+            self._dec_user(ticket.user)
+            # Replace the admission estimate with what the request really used
+            self.charge_tokens(ticket.user, ticket.used_tokens - ticket.tokens)
+        elif ticket.tier == "prefetch":
+            # Speculative work is paid from the user's budget at its actual cost
+            self.charge_tokens(ticket.user, ticket.used_tokens)
+            self._incr_later(f"prefetch_quota:{ticket.user}:{int(time.time() // QUOTA_WINDOW)}", ticket.used_tokens)
+        held = time.monotonic() - (ticket.started_at or ticket.enqueued_at)
+        self._avg_service = 0.9 * self._avg_service + 0.1 * held
+        self._release_slot()
+
+    # ---------------- metrics ----------------
+    def metrics(self) -> dict:
+        tiers = {}
+        for tier, samples in self.wait_samples.items():
+            ordered = sorted(samples)
+            n = len(ordered)
+            tiers[tier] = {
+                "admitted": self.admitted[tier],
+                "queued": self._queued(tier),
+                "shed": dict(self.shed[tier]),
+                "queue_wait_ms": {
+                    "samples": n,
+                    "mean": round(1000 * sum(ordered) / n, 2) if n else 0.0,
+                    "p50": round(1000 * ordered[n // 2], 2) if n else 0.0,
+                    "p95": round(1000 * ordered[min(n - 1, int(n * 0.95))], 2) if n else 0.0,
+                    "max": round(1000 * ordered[-1], 2) if n else 0.0,
+                },
+            }
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "avg_service_seconds": round(self._avg_service, 3),
+            "tiers": tiers,
+        }
@@ -0,0 +1,216 @@
+"""
+Caller identity for admission, budgets and the dashboard endpoints.
+
+The frontend sends the Supabase session's access token as
+``Authorization: Bearer <token>``. The token is verified server-side: locally
+against SUPABASE_JWT_SECRET for HS256 project keys, otherwise by asking the
+Supabase auth server (results cached until shortly before the token expires).
+The tier comes from the same source the trial-status function uses: a row in
+``subscriptions`` with status "active" makes the user pro, everyone else is
+trial. Tiers are cached in the shared state backend for TIER_CACHE_TTL seconds.
+
+Requests without a token are anonymous trial traffic keyed by client address.
+X-Forwarded-For is only honoured when the direct peer is in TRUSTED_PROXIES
+(comma-separated addresses or CIDR blocks).
+
+Operator endpoints (/admin/*) are separate from user sessions: they need an
+X-Admin-Token header matching ADMIN_TOKEN and are disabled when it is unset.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import time
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Request
+
+SUPABASE_URL = (os.getenv("SUPABASE_URL") or "").rstrip("/")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+TIER_CACHE_TTL = int(os.getenv("AUTH_TIER_CACHE_TTL", "300"))
+# Upper bound on how long a remotely verified token is trusted without re-checking
+TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+AUTH_TIMEOUT = 5.0
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+DEFAULT_TIER = "trial"
+
+
+def _parse_proxies(raw: str) -> list:
+    networks = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            print(f"[WARNING] Ignoring invalid TRUSTED_PROXIES entry: {item!r}")
+    return networks
+
+
+TRUSTED_PROXIES = _parse_proxies(os.getenv("TRUSTED_PROXIES", ""))
+
+
+class Identity:
+    """Who a request is served for. authenticated is False for anonymous callers."""
+
+    def __init__(self, user: str, tier: str, authenticated: bool):
+        self.user = user
+        self.tier = tier
+        self.authenticated = authenticated
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _is_trusted(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> str:
+    """Client address, taken from X-Forwarded-For only behind a trusted proxy."""
+    host = request.client.host if request.client else "unknown"
+    if not _is_trusted(host):
+        return host
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    # Walk back from the nearest hop; the first untrusted address is the client
+    for hop in reversed(hops):
+        if not _is_trusted(hop):
+            return hop
+    return hops[0] if hops else host
+
+
+def bearer_token(request: Request) -> Optional[str]:
+    scheme, _, token = (request.headers.get("authorization") or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+def check_admin_token(request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("x-admin-token") or ""
+    if not hmac.compare_digest(supplied.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def _unauthorized() -> HTTPException:
+    return HTTPException(status_code=401, detail="Invalid or expired session",
+                         headers={"WWW-Authenticate": "Bearer"})
+
+
+def verify_hs256(token: str, secret: str) -> Optional[dict]:
+    """Claims of a valid, unexpired HS256 token signed with secret, else None."""
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        if header.get("alg") != "HS256":
+            return None
+        expected = hmac.new(secret.encode("utf-8"), f"{header_b64}.{payload_b64}".encode("ascii"),
+                            hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature_b64)):
+            return None
+        claims = json.loads(_b64decode(payload_b64))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) <= time.time():
+        return None
+    return claims
+
+
+class Authenticator:
+    def __init__(self, state_getter: Callable, http_getter: Callable):
+        self._state_getter = state_getter
+        self._http_getter = http_getter
+        if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+            print("[WARNING] SUPABASE_URL/SUPABASE_SERVICE_ROLE_KEY not set: every caller is treated as trial")
+
+    def _supabase_headers(self, token: str) -> dict:
+        return {"apikey": SUPABASE_SERVICE_ROLE_KEY or "", "Authorization": f"Bearer {token}"}
+
+    async def _verify(self, token: str) -> str:
+        """User id of a valid access token; raises 401 otherwise."""
+        try:
+            header = json.loads(_b64decode(token.split(".")[0]))
+        except (ValueError, UnicodeError, IndexError):
+            raise _unauthorized()
+        if header.get("alg") == "HS256" and SUPABASE_JWT_SECRET:
+            claims = verify_hs256(token, SUPABASE_JWT_SECRET)
+            if claims is None or not claims.get("sub") or claims.get("role") != "authenticated":
+                raise _unauthorized()
+            return claims["sub"]
+        return await self._verify_remote(token)
+
+    async def _verify_remote(self, token: str) -> str:
+        if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+            raise _unauthorized()
+        state = self._state_getter()
+        key = "auth:token:" + hashlib.sha256(token.encode("utf-8")).hexdigest()
+        cached = await asyncio.to_thread(state.get, key)
+        if cached:
+            return cached
+        try:
+            resp = await self._http_getter().get(
+                f"{SUPABASE_URL}/auth/v1/user", headers=self._supabase_headers(token), timeout=AUTH_TIMEOUT
+            )
+        except Exception as e:
+            print(f"[AUTH ERROR] Session check failed: {e}")
+            raise HTTPException(status_code=503, detail="Authentication service unavailable")
+        if resp.status_code in (401, 403):
+            raise _unauthorized()
+        if resp.status_code != 200:
+            print(f"[AUTH ERROR] Session check returned {resp.status_code}")
+            raise HTTPException(status_code=503, detail="Authentication service unavailable")
+        user = resp.json().get("id")
+        if not user:
+            raise _unauthorized()
+        ttl = TOKEN_CACHE_TTL
+        try:
+            claims = json.loads(_b64decode(token.split(".")[1]))
+            ttl = max(1, min(ttl, int(claims.get("exp", 0) - time.time())))
+        except (ValueError, UnicodeError, IndexError, TypeError):
+            pass
+        await asyncio.to_thread(state.set, key, user, ttl)
+        return user
+
+    async def tier_for(self, user: str) -> str:
+        """Tier of user: pro while they have an active subscription, else trial."""
+        if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+            return DEFAULT_TIER
+        state = self._state_getter()
+        key = f"auth:tier:{user}"
+        cached = await asyncio.to_thread(state.get, key)
+        if cached:
+            return cached
+        try:
+            resp = await self._http_getter().get(
+                f"{SUPABASE_URL}/rest/v1/subscriptions",
+                params={"select": "status", "user_id": f"eq.{user}", "status": "eq.active", "limit": "1"},
+                headers=self._supabase_headers(SUPABASE_SERVICE_ROLE_KEY),
+                timeout=AUTH_TIMEOUT,
+            )
+            resp.raise_for_status()
+            tier = "pro" if resp.json() else "trial"
+        except Exception as e:
+            # Not cached, so the next request retries the lookup
+            print(f"[AUTH ERROR] Subscription lookup failed for {user}: {e}")
+            return DEFAULT_TIER
+        await asyncio.to_thread(state.set, key, tier, TIER_CACHE_TTL)
+        return tier
+
+    async def identify(self, request: Request) -> Identity:
+        token = bearer_token(request)
+        if token is None:
+            return Identity(f"anon:{client_ip(request)}", DEFAULT_TIER, False)
+        user = await self._verify(token)
+        return Identity(user, await self.tier_for(user), True)
@@ -0,0 +1,84 @@
+"""
+Startup benchmark: measures how long `import main` takes with `python -X importtime`
+and fails if it exceeds the import-time budget or pulls in heavy modules that
+should only load on first use.
+
+Usage (from the backend directory):
+    python bench_startup.py [--runs 5] [--budget-ms 800]
+
+tests/test_bench_startup.py runs the lazy-module check on every test run; the
+wall-clock budget is only asserted there with STARTUP_BUDGET_TEST=1.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "800"))
+# Modules that must stay out of the import path of main.py
+LAZY_MODULES = ("pandas", "pytrends", "numpy", "PIL", "httpx")
+
+
+def measure_once(backend_dir: str):
+    """Import main in a fresh interpreter; return (cumulative_us, {module: cumulative_us})."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=backend_dir,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, rest = line.split(":", 1)
+        _self_us, cumulative_us, name = (part.strip() for part in rest.split("|"))
+        modules[name] = int(cumulative_us)
+    if "main" not in modules:
+        raise RuntimeError("could not find 'main' in -X importtime output")
+    return modules["main"], modules
+
+
+def leaked_modules(modules: dict) -> list:
+    """LAZY_MODULES (by top-level package) that an import of main pulled in."""
+    return sorted({m.split(".")[0] for m in modules if m.split(".")[0] in LAZY_MODULES})
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    args = parser.parse_args()
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    modules = {}
+    for _ in range(args.runs):
+        total_us, modules = measure_once(backend_dir)
+        timings.append(total_us / 1000.0)
+
+    median_ms = statistics.median(timings)
+    print(f"[BENCH] import main: median {median_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(timings):.1f}, max {max(timings):.1f}, budget {args.budget_ms:.0f} ms)")
+    heaviest = sorted(((us, name) for name, us in modules.items() if "." not in name and name != "main"), reverse=True)[:10]
+    for us, name in heaviest:
+        print(f"[BENCH]   {name:<24} {us / 1000.0:8.1f} ms")
+
+    failed = False
+    leaked_roots = leaked_modules(modules)
+    if leaked_roots:
+        print(f"[BENCH] FAIL: heavy modules imported at startup: {', '.join(leaked_roots)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"[BENCH] FAIL: import time {median_ms:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("[BENCH] OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
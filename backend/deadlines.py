@@ -0,0 +1,244 @@
+"""
+Per-request deadlines and upstream cancellation.
+
+Every admitted request gets a deadline: the client's X-Request-Timeout header
+(seconds) if present, otherwise the route default, never more than
+DEADLINE_MAX_SECONDS. Upstream calls made while serving the request cap their
+own timeouts to the time that is left, and calls awaited through ``guard``
+are cancelled as soon as the client disconnects or the deadline passes, so
+the worker's capacity goes back to live requests.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from typing import Awaitable, Optional
+
+from fastapi import HTTPException, Request
+
+DEADLINE_HEADER = "x-request-timeout"
+DEADLINE_MAX_SECONDS = float(os.getenv("DEADLINE_MAX_SECONDS", "120"))
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("DEADLINE_DEFAULT_SECONDS", "60"))
+# Route defaults in seconds; override individual routes with DEADLINES_JSON='{"ideas": 20}'
+ROUTE_DEADLINES = {
+    "ideas": 45.0,
+    "generate_script": 60.0,
+    "analyze_keyword": 60.0,
+    "generate_tweet": 45.0,
+    "upload_and_query": 45.0,
+    "thumbnail_compare": 45.0,
+}
+DISCONNECT_POLL_INTERVAL = 0.25
+# Largest request body accepted (uploads included); larger ones get 413
+MAX_REQUEST_BODY_BYTES = int(float(os.getenv("MAX_REQUEST_BODY_MB", "25")) * 1024 * 1024)
+# ASGI scope key holding the asyncio.Event set by DisconnectListener
+DISCONNECT_SCOPE_KEY = "thumbnail_analyzer.disconnected"
+
+
+def _load_route_deadlines() -> dict:
+    deadlines = dict(ROUTE_DEADLINES)
+    raw = os.getenv("DEADLINES_JSON")
+    if raw:
+        try:
+            deadlines.update({route: float(seconds) for route, seconds in json.loads(raw).items()})
+        except Exception as e:
+            print(f"[WARNING] Ignoring invalid DEADLINES_JSON: {e}")
+    return deadlines
+
+
+_route_deadlines = _load_route_deadlines()
+
+# Scope of the request being served; None for background work
+current_scope: contextvars.ContextVar = contextvars.ContextVar("request_scope", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=504, detail="Request deadline exceeded")
+
+
+class ClientDisconnected(HTTPException):
+    def __init__(self):
+        # Nobody reads this response; 499 keeps it apart from real errors in the logs
+        super().__init__(status_code=499, detail="Client closed request")
+
+
+class DisconnectListener:
+    """
+    Pure ASGI middleware that notices client disconnects even while the app
+    isn't reading and even below middlewares that wrap ``receive``
+    (BaseHTTPMiddleware swallows the message for ``request.is_disconnected()``).
+    Body chunks are passed straight through as the app asks for them, so uploads
+    keep their backpressure, and bodies over MAX_REQUEST_BODY_BYTES are refused
+    with 413. Once the body is complete the only message left is
+    http.disconnect, and a background task waits for it and sets an event
+    (a body the app never reads leaves the request covered by its deadline only).
+    Must be the outermost middleware.
+    """
+
+    def __init__(self, app, max_body_bytes: Optional[int] = None):
+        self.app = app
+        self.max_body_bytes = max_body_bytes if max_body_bytes is not None else MAX_REQUEST_BODY_BYTES
+
+    async def _reject_too_large(self, send) -> None:
+        body = json.dumps({"detail": "Request body too large"}).encode("utf-8")
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode("ascii"))]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        declared = headers.get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > self.max_body_bytes:
+            await self._reject_too_large(send)
+            return
+        has_body = (declared.isdigit() and int(declared) > 0) or b"transfer-encoding" in headers
+
+        disconnected = asyncio.Event()
+        # Holds at most the one message that can follow a complete body
+        messages: asyncio.Queue = asyncio.Queue(maxsize=1)
+        scope[DISCONNECT_SCOPE_KEY] = disconnected
+        listener: Optional[asyncio.Task] = None
+        received = 0
+
+        async def listen():
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            await messages.put(message)
+
+        def start_listening():
+            nonlocal listener
+            listener = asyncio.create_task(listen())
+
+        async def app_receive():
+            nonlocal received
+            if listener is None:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return message
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+                if not message.get("more_body", False):
+                    start_listening()
+                return message
+            if disconnected.is_set() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        if not has_body:
+            # Nothing to pass through; the app's empty http.request is handed over from the queue
+            async def read_empty_body():
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                else:
+                    await listen()
+
+            listener = asyncio.create_task(read_empty_body())
+        try:
+            await self.app(scope, app_receive, send)
+        finally:
+            if listener is not None:
+                listener.cancel()
+
+
+class RequestScope:
+    def __init__(self, request: Optional[Request], seconds: float):
+        self.request = request
+        self.disconnected: Optional[asyncio.Event] = (
+            request.scope.get(DISCONNECT_SCOPE_KEY) if request is not None else None
+        )
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.cancelled_upstream = 0
+
+    @classmethod
+    def for_request(cls, request: Request, route: str) -> "RequestScope":
+        seconds = _route_deadlines.get(route, DEFAULT_DEADLINE_SECONDS)
+        raw = request.headers.get(DEADLINE_HEADER)
+        if raw:
+            try:
+                seconds = float(raw)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid {DEADLINE_HEADER} header: {raw!r}")
+            if seconds <= 0:
+                raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER} must be positive")
+        return cls(request, min(seconds, DEADLINE_MAX_SECONDS))
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def timeout(self, cap: float) -> float:
+        """Upstream timeout for a call that would normally allow cap seconds."""
+        if self.disconnected is not None and self.disconnected.is_set():
+            raise ClientDisconnected()
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return min(cap, remaining)
+
+    async def _wait_disconnect(self) -> None:
+        if self.disconnected is not None:
+            await self.disconnected.wait()
+            return
+        # Not behind DisconnectListener (e.g. a bare router in tests): poll instead
+        try:
+            while not await self.request.is_disconnected():
+                await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+        except Exception as e:
+            print(f"[WARNING] Disconnect watch failed, relying on the deadline only: {e}")
+            await asyncio.get_running_loop().create_future()
+
+    async def guard(self, awaitable: Awaitable):
+        """Await an upstream call, cancelling it on client disconnect or deadline."""
+        upstream = asyncio.ensure_future(awaitable)
+        watchers = {upstream}
+        watcher = None
+        if self.request is not None:
+            watcher = asyncio.ensure_future(self._wait_disconnect())
+            watchers.add(watcher)
+        try:
+            done, _ = await asyncio.wait(watchers, timeout=max(0.0, self.remaining()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            upstream.cancel()
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+        if upstream in done:
+            return upstream.result()
+        upstream.cancel()
+        self.cancelled_upstream += 1
+        if watcher is not None and watcher in done:
+            print("[INFO] Client disconnected; cancelled upstream call")
+            raise ClientDisconnected()
+        print(f"[INFO] Deadline of {self.seconds:.1f}s exceeded; cancelled upstream call")
+        raise DeadlineExceeded()
+
+
+def upstream_timeout(cap: float) -> float:
+    """
+    cap, shortened to the current request's remaining time. Raises once the
+    deadline has passed or the client has gone, so blocking code in worker
+    threads can stop between steps. Safe to call from worker threads.
+    """
+    scope = current_scope.get()
+    return scope.timeout(cap) if scope is not None else cap
+
+
+async def guard(awaitable: Awaitable):
+    """Await an upstream call under the current request's deadline and disconnect watch."""
+    scope = current_scope.get()
+    if scope is None:
+        return await awaitable
+    return await scope.guard(awaitable)
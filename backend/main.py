@@ -1,42 +1,253 @@
-from fastapi import FastAPI, Query, HTTPException, Form, UploadFile, File as FastAPIFile, Request, Body
-from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse
+from fastapi import APIRouter, Depends, FastAPI, Query, HTTPException, Form, UploadFile, File as FastAPIFile, Request, Body
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import os
 import io
+import re
 import base64
 import random
 import requests
 import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-from PIL import Image
 from typing import Optional, Dict, Any, List
-from pytrends.request import TrendReq
+from uuid import uuid4
 import time
+import asyncio
+import threading
+
+# pytrends/pandas, NumPy and PIL are imported on first use so a cold start only
+# pays for FastAPI itself; bench_startup.py enforces the import-time budget.
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 
-app = FastAPI(title="Thumbnail Analyzer API")
+def require_admin(request: Request):
+    """Dependency for operator endpoints; see auth.check_admin_token."""
+    from auth import check_admin_token
+    check_admin_token(request)
 
-# CORS Middleware - Allow all origins for development
+router = APIRouter()
+# /admin/* metrics: only reachable with the operator's ADMIN_TOKEN
+admin_router = APIRouter(dependencies=[Depends(require_admin)])
+
+# CORS - Allow all origins for development
 origins = ["*"]  # In production, replace with specific origins
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,  # Allows all localhost and 127.0.0.1 origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-print(f"[INFO] CORS middleware enabled for: {origins}")
-
-_groq = os.getenv('GROQ_API_KEY')
-if _groq:
-    print(f"[DEBUG] GROQ_API_KEY loaded: {_groq[:8]}...{_groq[-4:]}")
-else:
-    print("[DEBUG] GROQ_API_KEY is NOT loaded!")
-
-# # Print DeepSeek API key at startup for debug
-# print("[DEBUG] DEEPSEEK_API_KEY (startup):", os.getenv("DEEPSEEK_API_KEY"))
+
+class _Resources:
+    """Process-wide clients. Created in the app lifespan or on first use, never at import time."""
+    http = None          # httpx.AsyncClient shared by upstream calls
+    pytrends = None      # pytrends TrendReq (contacts Google when constructed)
+    trends_store = None  # local Google Trends store
+    shared_state = None  # cross-worker caches, rate limits and circuit breakers
+    counters = None      # statistics counters batched into shared_state
+    admission = None     # per-worker admission controller for generation endpoints
+    auth = None          # Supabase session verification and tier lookup
+    usage = None         # token/cost accounting for upstream completions
+    activity = None      # write-behind activity log and dashboard counters
+    responses = None     # near-duplicate cache for text generation responses
+    youtube = None       # YouTube Data API client with id batching and ETag cache
+    thumbnails = None    # on-disk cache of fetched thumbnails
+    trending = None      # background-refreshed trending keyword digest
+
+resources = _Resources()
+
+def get_shared_state():
+    if resources.shared_state is None:
+        import shared_state
+        resources.shared_state = shared_state.from_url()
+    return resources.shared_state
+
+def get_counters():
+    if resources.counters is None:
+        from shared_state import CounterBuffer
+        resources.counters = CounterBuffer(get_shared_state)
+    return resources.counters
+
+def get_breaker(name: str):
+    from shared_state import CircuitBreaker
+    return CircuitBreaker(get_shared_state(), name)
+
+def get_admission():
+    if resources.admission is None:
+        from admission import AdmissionController
+        resources.admission = AdmissionController(get_shared_state)
+    return resources.admission
+
+def get_auth():
+    if resources.auth is None:
+        from auth import Authenticator
+        resources.auth = Authenticator(get_shared_state, get_http_client)
+    return resources.auth
+
+async def current_identity(request: Request):
+    """Verified identity of the caller, resolved once per request."""
+    identity = getattr(request.state, "identity", None)
+    if identity is None:
+        identity = await get_auth().identify(request)
+        request.state.identity = identity
+    return identity
+
+def admit(route: str, tokens: int):
+    """
+    Dependency for generation endpoints: waits for an admission slot (pro before
+    trial) and holds it for the rest of the request. tokens is the upstream
+    token estimate charged against the caller's budget.
+    """
+    async def dependency(request: Request):
+        from admission import current_ticket
+        from deadlines import RequestScope, current_scope
+        scope = RequestScope.for_request(request, route)
+        identity = await current_identity(request)
+        controller = get_admission()
+        ticket = await controller.acquire(identity.user, identity.tier, route, tokens)
+        current_ticket.set(ticket)
+        current_scope.set(scope)
+        try:
+            # Don't start upstream work for a request that spent its whole deadline queued
+            scope.timeout(0)
+            yield ticket
+        finally:
+            controller.release(ticket)
+    return Depends(dependency)
+
+async def _post_upstream(url: str, timeout: float, **kwargs):
+    """
+    POST to an upstream API through the shared client. timeout is capped to the
+    request's remaining deadline, and the call is cancelled if the client
+    disconnects or the deadline passes first.
+    """
+    from deadlines import guard, upstream_timeout
+    return await guard(get_http_client().post(url, timeout=upstream_timeout(timeout), **kwargs))
+
+def get_youtube():
+    if resources.youtube is None:
+        from youtube_api import YouTubeClient
+        resources.youtube = YouTubeClient(get_http_client())
+    return resources.youtube
+
+def get_thumbnail_cache():
+    if resources.thumbnails is None:
+        from thumbnail_fetch import ThumbnailCache
+        resources.thumbnails = ThumbnailCache()
+    return resources.thumbnails
+
+def get_usage():
+    if resources.usage is None:
+        from usage import UsageTracker
+        resources.usage = UsageTracker()
+    return resources.usage
+
+def _track_completion(model: str, response, started: float):
+    """
+    Record token usage and latency of one upstream completion against the
+    current route/user. Works with both requests and httpx responses.
+    """
+    try:
+        latency_ms = (time.time() - started) * 1000
+        ok = response.status_code == 200
+        usage_block = None
+        if ok:
+            data = response.json()
+            usage_block = data.get("usage")
+            model = data.get("model") or model
+        route = user = None
+        ticket = None
+        if resources.admission is not None:
+            from admission import current_ticket
+            ticket = current_ticket.get()
+        if ticket is not None:
+            route, user = ticket.route, ticket.user
+        record = get_usage().record(route, model, user, usage_block, latency_ms, ok=ok)
+        if ticket is not None:
+            ticket.used_tokens += record["total_tokens"]
+    except Exception as e:
+        print(f"[WARNING] Failed to record usage: {e}")
+
+def get_activity():
+    if resources.activity is None:
+        from activity import ActivityLog
+        resources.activity = ActivityLog()
+    return resources.activity
+
+def get_response_cache():
+    if resources.responses is None:
+        from response_cache import ResponseCache
+        resources.responses = ResponseCache(get_shared_state, get_counters)
+    return resources.responses
+
+def _record_activity(kind: str, action: str, item: str):
+    """Append a dashboard activity event for the current caller (buffered, never blocks on disk)."""
+    try:
+        from admission import current_ticket
+        ticket = current_ticket.get()
+        get_activity().record(ticket.user if ticket else None, kind, action, item)
+    except Exception as e:
+        print(f"[WARNING] Failed to record activity: {e}")
+
+async def _flush_buffers():
+    for buffer in (resources.usage, resources.activity, resources.counters):
+        if buffer is not None:
+            await asyncio.to_thread(buffer.flush)
+
+async def _usage_flush_loop():
+    from usage import FLUSH_INTERVAL
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await _flush_buffers()
+
+def get_http_client():
+    if resources.http is None:
+        import httpx
+        resources.http = httpx.AsyncClient(timeout=30.0)
+    return resources.http
+
+def _new_pytrends():
+    from pytrends.request import TrendReq
+    return TrendReq(hl='en-US', tz=360, timeout=(10,25), retries=2, backoff_factor=0.1)
+
+def get_pytrends():
+    if resources.pytrends is None:
+        resources.pytrends = _new_pytrends()
+    return resources.pytrends
+
+def get_trends_store():
+    if resources.trends_store is None:
+        from trends_store import TrendsStore
+        resources.trends_store = TrendsStore()
+    return resources.trends_store
+
+def get_trending():
+    if resources.trending is None:
+        from trending import TrendingDigest
+        # Own TrendReq: the digest refreshes from a worker thread
+        resources.trending = TrendingDigest(get_shared_state, _new_pytrends, get_trends_store,
+                                            lambda: get_breaker("google_trends"), _trends_pace)
+    return resources.trending
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _groq = os.getenv('GROQ_API_KEY')
+    if _groq:
+        print(f"[DEBUG] GROQ_API_KEY loaded: {_groq[:8]}...{_groq[-4:]}")
+    else:
+        print("[DEBUG] GROQ_API_KEY is NOT loaded!")
+    get_http_client()
+    get_shared_state()
+    flusher = asyncio.create_task(_usage_flush_loop())
+    trending_task = None
+    if os.getenv("TRENDING_DIGEST_ENABLED", "1") != "0":
+        trending_task = asyncio.create_task(get_trending().run())
+    yield
+    flusher.cancel()
+    if trending_task is not None:
+        trending_task.cancel()
+    await _flush_buffers()
+    if resources.http is not None:
+        await resources.http.aclose()
+        resources.http = None
+    resources.youtube = None
+    resources.pytrends = None
 
 # Global exception handler for all uncaught exceptions
 def setup_global_exception_handler(app):
@@ -44,10 +255,8 @@ def setup_global_exception_handler(app):
     async def global_exception_handler(request: Request, exc: Exception):
         print(f"[GLOBAL ERROR] {repr(exc)}")
         return JSONResponse(status_code=500, content={"error": str(exc)})
-setup_global_exception_handler(app)
 
 # ---------------- Video Ideas Endpoint ----------------
-from uuid import uuid4
 
 async def _call_groq_for_ideas(title: str, description: str, n: int = 5) -> list:
     """Call Groq API to generate n video ideas."""
@@ -76,7 +285,9 @@ async def _call_groq_for_ideas(title: str, description: str, n: int = 5) -> list
         "max_tokens": 512,
         "temperature": 0.8,
     }
-    resp = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload, timeout=60)
+    started = time.time()
+    resp = await _post_upstream("https://api.groq.com/openai/v1/chat/completions", 60, headers=headers, json=payload)
+    _track_completion(payload["model"], resp, started)
     if resp.status_code != 200:
         raise RuntimeError(f"Groq API error {resp.status_code}: {resp.text}")
     try:
@@ -106,8 +317,8 @@ async def _call_groq_for_ideas(title: str, description: str, n: int = 5) -> list
         print(f"[ERROR] Failed to parse Groq response: {e}\nRaw: {resp.text}")
         raise RuntimeError("Failed to parse Groq response")
 
-@app.post("/ideas")
-async def generate_video_ideas(body: dict = Body(...)):
+@router.post("/ideas")
+async def generate_video_ideas(body: dict = Body(...), ticket=admit("ideas", 512)):
     """Generate video ideas from Groq AI.
     Expects {"title": "...", "description": "..."}
     Returns {"ideas": [ ... ]}
@@ -117,18 +328,29 @@ async def generate_video_ideas(body: dict = Body(...)):
     if not title:
         raise HTTPException(status_code=400, detail="title is required")
     try:
-        ideas = await _call_groq_for_ideas(title, description)
+        cache = get_response_cache()
+        cache_text = f"{title}\n{description}"
+        ideas = await asyncio.to_thread(cache.lookup, "ideas", {"n": 5}, cache_text, fresh=bool(body.get("fresh")))
+        if ideas is not None:
+            ideas = [dict(idea, id=str(uuid4())) for idea in ideas]
+        else:
+            started = time.time()
+            ideas = await _call_groq_for_ideas(title, description)
+            await asyncio.to_thread(cache.store, "ideas", {"n": 5}, cache_text, ideas, (time.time() - started) * 1000)
+        _record_activity("ideas", "Ideas Generated", title)
         return {"ideas": ideas}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[IDEAS ERROR] {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.options("/upload_and_query")
+@router.options("/upload_and_query")
 async def options_upload_and_query():
     # For CORS preflight
     return PlainTextResponse("OK", status_code=200)
 
-@app.get("/")
+@router.get("/")
 async def root():
     return HTMLResponse("""
         <html>
@@ -140,8 +362,51 @@ async def root():
         </html>
     """)
 
-@app.post("/generate_script")
-async def generate_script(request: Request, body: dict = Body(...)):
+# Section-wise script generation: each enabled section gets its own short
+# prompt and output budget, and all sections are generated concurrently.
+SCRIPT_SECTIONS = {
+    "Hook": ("Write the opening hook slide: 1-3 punchy sentences that make viewers stay past the first 5 seconds.", 200),
+    "SEO Tips": ("Write the SEO tips slide: 3-5 concise, actionable tips for the title, description and tags of this video.", 350),
+    "Call to Action": ("Write the closing call-to-action slide: 1-2 sentences asking viewers to like, subscribe or comment.", 150),
+}
+SCRIPT_SECTION_RETRIES = int(os.getenv("SCRIPT_SECTION_RETRIES", "1"))
+# "single" keeps the one-completion path; requests can pick either with body["mode"]
+SCRIPT_GENERATION_MODE = os.getenv("SCRIPT_GENERATION_MODE", "single")
+
+async def _generate_script_section(section: str, context: list, headers: dict) -> str:
+    """Generate one slide, retrying just this section on failure."""
+    instruction, max_tokens = SCRIPT_SECTIONS[section]
+    prompt = "\n".join(context + [instruction, "Reply with only the slide text, no headings, labels or JSON."])
+    payload = {
+        "model": "meta-llama/llama-4-scout-17b-16e-instruct",
+        "messages": [
+            {"role": "user", "content": [{"type": "text", "text": prompt}]}
+        ],
+        "max_tokens": max_tokens
+    }
+    last_error = None
+    for attempt in range(1 + SCRIPT_SECTION_RETRIES):
+        try:
+            started = time.time()
+            resp = await _post_upstream("https://api.groq.com/openai/v1/chat/completions", 30, headers=headers, json=payload)
+            _track_completion(payload["model"], resp, started)
+            if resp.status_code != 200:
+                raise RuntimeError(f"Llama API error {resp.status_code}: {resp.text[:200]}")
+            content = resp.json()["choices"][0]["message"]["content"].strip()
+            if content.startswith("```"):
+                content = re.sub(r"^```[a-zA-Z]*", "", content).rstrip("`").strip()
+            if not content:
+                raise RuntimeError("empty completion")
+            return content
+        except HTTPException:
+            raise
+        except Exception as e:
+            last_error = e
+            print(f"[Llama ERROR] Section '{section}' attempt {attempt + 1} failed: {e}")
+    raise RuntimeError(f"Section '{section}' failed: {last_error}")
+
+@router.post("/generate_script")
+async def generate_script(request: Request, body: dict = Body(...), ticket=admit("generate_script", 1200)):
     try:
         topic = body.get('topic', '').strip()
         format_ = body.get('format', 'shorts')
@@ -196,7 +461,6 @@ async def generate_script(request: Request, body: dict = Body(...)):
             return JSONResponse(status_code=500, content={"error": "GEMINI_API_KEY not set"})
 
         # --- GROQ LLAMA SCRIPT GENERATION (REVERTED) ---
-        import json as _json
         groq_api_key = os.getenv("GROQ_API_KEY")
         if not groq_api_key:
             return JSONResponse(status_code=500, content={"error": "GROQ_API_KEY not set"})
@@ -205,6 +469,39 @@ async def generate_script(request: Request, body: dict = Body(...)):
             "Content-Type": "application/json",
             "Authorization": f"Bearer {groq_api_key}"
         }
+        from response_cache import canonical_terms
+        mode = body.get('mode') or SCRIPT_GENERATION_MODE
+        cache = get_response_cache()
+        cache_attrs = {
+            "format": str(format_).lower(),
+            "tone": tone_label,
+            "sections": slide_titles,
+            "keywords": canonical_terms(keywords),
+            "mode": mode,
+        }
+        cached = await asyncio.to_thread(cache.lookup, "script", cache_attrs, topic, fresh=bool(body.get('fresh')))
+        if cached is not None:
+            _record_activity("script", "Script Generated", topic)
+            return cached
+        started = time.time()
+        if mode == "sections" and slide_titles:
+            context = prompt_parts[:5]
+            if keywords:
+                context.append(f"Incorporate these keywords naturally: {', '.join(keywords)}.")
+            results = await asyncio.gather(
+                *(_generate_script_section(title, context, llama_headers) for title in slide_titles),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, HTTPException):
+                    raise result
+            failed = [title for title, result in zip(slide_titles, results) if isinstance(result, BaseException)]
+            if failed:
+                return JSONResponse(status_code=500, content={"error": "Llama API error", "failed_sections": failed})
+            result = {"outline": slide_titles, "script": list(results)}
+            await asyncio.to_thread(cache.store, "script", cache_attrs, topic, result, (time.time() - started) * 1000)
+            _record_activity("script", "Script Generated", topic)
+            return result
         # Compose llama_payload for Groq Llama API
         llama_payload = {
             "model": "meta-llama/llama-4-scout-17b-16e-instruct",
@@ -213,12 +510,14 @@ async def generate_script(request: Request, body: dict = Body(...)):
             ],
             "max_tokens": 1200
         }
-        llama_response = requests.post(
+        started = time.time()
+        llama_response = await _post_upstream(
             llama_url,
+            60,
             headers=llama_headers,
-            json=llama_payload,
-            timeout=60
+            json=llama_payload
         )
+        _track_completion(llama_payload["model"], llama_response, started)
         if llama_response.status_code != 200:
             print("[Llama ERROR]", llama_response.status_code, llama_response.text)
             return JSONResponse(status_code=500, content={"error": "Llama API error", "status": llama_response.status_code, "text": llama_response.text})
@@ -228,77 +527,89 @@ async def generate_script(request: Request, body: dict = Body(...)):
             return JSONResponse(status_code=500, content={"error": "Failed to parse Llama API response", "details": str(e), "text": llama_response.text})
         outline = script = ''
         try:
-            parsed = _json.loads(content)
+            parsed = json.loads(content)
             outline = parsed.get('outline', '')
             script = parsed.get('script', '')
         except Exception:
             script = content
             outline = ''
-        return {"outline": outline, "script": script}
+        result = {"outline": outline, "script": script}
+        await asyncio.to_thread(cache.store, "script", cache_attrs, topic, result, (time.time() - started) * 1000)
+        _record_activity("script", "Script Generated", topic)
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.middleware.cors import CORSMiddleware
-import os
-from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional
-import json
-from fastapi.responses import JSONResponse
-from fastapi import FastAPI, Query
-import requests
-import random
-import time
-from datetime import datetime, timedelta
-from pytrends.request import TrendReq
-import asyncio
-
-# Initialize Google Trends
-pytrends = TrendReq(hl='en-US', tz=360, timeout=(10,25), retries=2, backoff_factor=0.1)
-
-# Cache for storing recent keyword results to avoid repeated calculations
-keyword_cache = {}
+# Keyword results are cached in the shared state backend so all workers share them
 CACHE_EXPIRY = 3600  # 1 hour cache expiry
 
-# Rate limiting
-last_request_time = 0
+# Rate limiting (shared across workers through the state backend)
 REQUEST_COOLDOWN = 1  # seconds between requests to respect rate limits
 
+# Batched Trends lookups: build_payload takes up to 5 terms, one slot is the shared anchor
+TRENDS_ANCHOR_TERM = os.getenv("TRENDS_ANCHOR_TERM", "tutorial")
+TRENDS_BATCH_GROUP_SIZE = 4
+TRENDS_BATCH_MAX_KEYWORDS = 100
+
+async def _trends_cooldown():
+    """Wait for this worker's slot so all workers together respect REQUEST_COOLDOWN"""
+    wait = await asyncio.to_thread(get_shared_state().reserve_slot, "ratelimit:google_trends", REQUEST_COOLDOWN)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+# build_payload and the fetch that follows must not interleave on the shared TrendReq
+_pytrends_lock = threading.Lock()
+
+def _fetch_interest_over_time(terms: List[str], timeframe: str):
+    """interest_over_time for terms on the shared TrendReq. Blocking; run it in a worker thread."""
+    from deadlines import upstream_timeout
+    with _pytrends_lock:
+        pytrends = get_pytrends()
+        pytrends.timeout = (upstream_timeout(10), upstream_timeout(25))
+        pytrends.build_payload(terms, cat=0, timeframe=timeframe, geo='', gprop='youtube')
+        return pytrends.interest_over_time()
+
+def _trends_pace():
+    """Blocking _trends_cooldown for Trends calls made from worker threads"""
+    wait = get_shared_state().reserve_slot("ratelimit:google_trends", REQUEST_COOLDOWN)
+    if wait > 0:
+        time.sleep(wait)
+
 async def get_trends_data(keyword: str) -> dict:
-    """Get keyword data from Google Trends with rate limiting"""
-    global last_request_time
-    
-    # Rate limiting
-    now = time.time()
-    time_since_last = now - last_request_time
-    if time_since_last < REQUEST_COOLDOWN:
-        await asyncio.sleep(REQUEST_COOLDOWN - time_since_last)
-    
-    try:
-        last_request_time = time.time()
-        
-        # Get interest over time
-        pytrends.build_payload([keyword], cat=0, timeframe='today 3-m', geo='', gprop='youtube')
-        interest_over_time = pytrends.interest_over_time()
-        
-        if not interest_over_time.empty:
-            values = interest_over_time[keyword].values
-            avg_interest = int(values.mean())
-            
-            # Calculate trend
-            if len(values) > 1:
-                trend = 'up' if values[-1] > values[0] * 1.1 else 'down' if values[-1] < values[0] * 0.9 else 'stable'
+    """Get keyword data from Google Trends, fetching only the days missing from the local store"""
+    from deadlines import ClientDisconnected, DeadlineExceeded, guard
+    from trends_store import frame_to_series
+    trends_store = get_trends_store()
+    # The store reads and writes .npy/.json files; keep that off the event loop
+    missing = await asyncio.to_thread(trends_store.missing_range, keyword)
+    breaker = get_breaker("google_trends")
+    if missing is not None and await breaker.allow_async():
+        await _trends_cooldown()
+        try:
+            start, end = missing
+            timeframe = f"{start.isoformat()} {end.isoformat()}"
+            print(f"[DEBUG] Refreshing Google Trends series for '{keyword}' ({timeframe})")
+
+            # Get interest over time for the missing window only
+            interest_over_time = await guard(asyncio.to_thread(_fetch_interest_over_time, [keyword], timeframe))
+            days, values = frame_to_series(interest_over_time, keyword)
+            if len(days):
+                await asyncio.to_thread(trends_store.merge, keyword, days, values)
             else:
-                trend = 'stable'
-                
-            return {
-                'avg_interest': avg_interest,
-                'trend': trend,
-                'timeframe': 'last 3 months'
-            }
-    except Exception as e:
-        print(f"Google Trends error for '{keyword}': {str(e)}")
-    
+                await asyncio.to_thread(trends_store.mark_checked, keyword)
+            await breaker.record_success_async()
+        except (ClientDisconnected, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"Google Trends error for '{keyword}': {str(e)}")
+            await breaker.record_failure_async()
+
+    summary = await asyncio.to_thread(trends_store.summary, keyword)
+    if summary:
+        return summary
+
     # Fallback values if API fails
     return {
         'avg_interest': random.randint(20, 80),
@@ -307,6 +618,95 @@ async def get_trends_data(keyword: str) -> dict:
         'cached': False
     }
 
+def _store_batch_group(trends_store, frame, group: List[str], anchor: str) -> None:
+    """Store the series and anchor ratios of one batch payload. Blocking; run it in a worker thread."""
+    from trends_store import frame_to_series
+    _, anchor_values = frame_to_series(frame, anchor)
+    for kw in group:
+        days, values = frame_to_series(frame, kw)
+        trends_store.merge_anchored(kw, anchor, days, values, anchor_values)
+
+async def get_trends_data_batch(keywords: List[str], anchor: str = TRENDS_ANCHOR_TERM) -> dict:
+    """
+    Get Google Trends data for many keywords with one request per four keywords.
+    Every payload carries the shared anchor term, and each keyword's interest is
+    reported relative to it (anchor average = 100) so values from different
+    payloads are comparable. Keywords with a fresh stored series are not refetched.
+    """
+    from deadlines import ClientDisconnected, DeadlineExceeded, guard
+    from trends_store import HISTORY_DAYS
+    trends_store = get_trends_store()
+    seen = set()
+    unique = []
+    for kw in keywords:
+        kw = (kw or "").strip()
+        if kw and kw.lower() not in seen:
+            seen.add(kw.lower())
+            unique.append(kw)
+
+    def needs_refresh(kw):
+        return trends_store.missing_range(kw) is not None or trends_store.anchor_ratio(kw, anchor) is None
+
+    candidates = [kw for kw in unique if kw.lower() != anchor.lower()]
+    refresh = await asyncio.to_thread(lambda: [needs_refresh(kw) for kw in candidates])
+    stale = [kw for kw, due in zip(candidates, refresh) if due]
+    end = date.today()
+    timeframe = f"{(end - timedelta(days=HISTORY_DAYS)).isoformat()} {end.isoformat()}"
+    requests_made = 0
+    breaker = get_breaker("google_trends")
+    for i in range(0, len(stale), TRENDS_BATCH_GROUP_SIZE):
+        group = stale[i:i + TRENDS_BATCH_GROUP_SIZE]
+        if not await breaker.allow_async():
+            print("[WARNING] Google Trends circuit open, serving remaining keywords from the local store")
+            break
+        await _trends_cooldown()
+        try:
+            requests_made += 1
+            print(f"[DEBUG] Google Trends batch {group} + anchor '{anchor}' ({timeframe})")
+            frame = await guard(asyncio.to_thread(_fetch_interest_over_time, group + [anchor], timeframe))
+            await breaker.record_success_async()
+        except (ClientDisconnected, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"Google Trends batch error for {group}: {str(e)}")
+            await breaker.record_failure_async()
+            continue
+        await asyncio.to_thread(_store_batch_group, trends_store, frame, group, anchor)
+
+    def read_results():
+        ratios = {kw: 1.0 if kw.lower() == anchor.lower() else trends_store.anchor_ratio(kw, anchor) for kw in unique}
+        return trends_store.summarize_many(unique), ratios
+
+    summaries, ratios = await asyncio.to_thread(read_results)
+    results = {}
+    for kw in unique:
+        ratio = ratios[kw]
+        entry = dict(summaries.get(kw) or {'avg_interest': None, 'trend': 'unknown', 'cached': False})
+        entry['relative_interest'] = round(ratio * 100, 1) if ratio is not None else None
+        results[kw] = entry
+    return {
+        "anchor": anchor,
+        "requests_made": requests_made,
+        "results": results,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.post("/trends/batch")
+async def trends_batch(body: dict = Body(...)):
+    """
+    Score many keywords against Google Trends in as few requests as possible.
+    Expects {"keywords": ["...", ...], "anchor": optional term}
+    """
+    keywords = body.get("keywords") or []
+    if not isinstance(keywords, list) or not all(isinstance(kw, str) for kw in keywords):
+        raise HTTPException(status_code=400, detail="keywords must be a list of strings")
+    if not any(kw.strip() for kw in keywords):
+        raise HTTPException(status_code=400, detail="keywords is required")
+    if len(keywords) > TRENDS_BATCH_MAX_KEYWORDS:
+        raise HTTPException(status_code=400, detail=f"At most {TRENDS_BATCH_MAX_KEYWORDS} keywords per request")
+    anchor = (body.get("anchor") or TRENDS_ANCHOR_TERM).strip()
+    return await get_trends_data_batch(keywords, anchor)
+
 # Simple keyword difficulty estimator (faster than API calls)
 def estimate_keyword_metrics(keyword: str) -> dict:
     """Estimate keyword metrics without external API calls"""
@@ -382,8 +782,15 @@ def get_google_trends_keywords(query: str, max_results: int = 5) -> list:
     if not query or not query.strip():
         print("[WARNING] Empty query provided to get_google_trends_keywords")
         return []
+    trends_store = get_trends_store()
+    stored = trends_store.load_related(query)
+    if stored and stored.get("top"):
+        print(f"[DEBUG] Serving Google Trends related queries for '{query}' from local store ({stored['timeframe']})")
+        return [{"keyword": kw, "source": "google_trends"} for kw in stored["top"][:max_results]]
     print(f"[DEBUG] Fetching Google Trends data for: {query}")
+    from deadlines import ClientDisconnected, DeadlineExceeded, upstream_timeout
     try:
+        from pytrends.request import TrendReq
         # Custom user-agent and optional proxy from environment
         proxy_url = os.getenv('PYTRENDS_PROXY')
         requests_args = {
@@ -399,13 +806,15 @@ def get_google_trends_keywords(query: str, max_results: int = 5) -> list:
         else:
             print("[DEBUG] No proxy set for pytrends (PYTRENDS_PROXY not set)")
         pytrends = TrendReq(
-            hl='en-US', tz=360, timeout=(15, 30), retries=3, backoff_factor=0.3,
+            hl='en-US', tz=360, timeout=(upstream_timeout(15), upstream_timeout(30)), retries=3, backoff_factor=0.3,
             requests_args=requests_args
         )
         timeframes = ['now 7-d', 'today 1-m', 'today 3-m', 'today 12-m']
         for timeframe in timeframes:
             try:
                 print(f"[DEBUG] Trying timeframe: {timeframe}")
+                # Shrinks with the request's remaining time; raises once it is gone or the client left
+                pytrends.timeout = (upstream_timeout(15), upstream_timeout(30))
                 pytrends.build_payload([query], cat=0, timeframe=timeframe, geo='', gprop='youtube')
                 related_queries = pytrends.related_queries()
                 print(f"[DEBUG] pytrends related_queries raw: {related_queries}")
@@ -413,41 +822,38 @@ def get_google_trends_keywords(query: str, max_results: int = 5) -> list:
                     top_queries = related_queries[query].get('top')
                     if top_queries is not None and not top_queries.empty:
                         print(f"[DEBUG] Found {len(top_queries['query'])} keywords from Google Trends: {top_queries['query'].tolist()}")
+                        trends_store.save_related(query, timeframe, top_queries['query'].tolist())
                         keywords = top_queries['query'].head(max_results).tolist()
                         return [{"keyword": kw, "source": "google_trends"} for kw in keywords]
                 print(f"[DEBUG] No results for timeframe: {timeframe}")
+            except (ClientDisconnected, DeadlineExceeded):
+                raise
             except Exception as e:
                 print(f"[WARNING] Error with timeframe {timeframe}: {e}")
                 import traceback; traceback.print_exc()
                 continue
-        try:
-            print("[DEBUG] Trying alternative search method...")
-            pytrends.build_payload([query], cat=0, timeframe='now 7-d', geo='', gprop='youtube')
-            df = pytrends.trending_searches(pn='united_states')
-            print(f"[DEBUG] pytrends trending_searches raw: {df}")
-            if df is not None and not df.empty:
-                keywords = df[0].head(max_results).tolist()
-                print(f"[DEBUG] Trending searches keywords: {keywords}")
-                return [{"keyword": kw, "source": "google_trends"} for kw in keywords]
-        except Exception as e:
-            print(f"[WARNING] Fallback method failed: {e}")
-            import traceback
-            traceback.print_exc()
+        # No generic trending fallback here: unrelated terms would hide Groq's answer.
+        # The trending digest is tried last by _compute_keyword_analysis, matched on topic words.
         print("[WARNING] No keywords found in Google Trends")
         return []
+    except (ClientDisconnected, DeadlineExceeded):
+        raise
     except Exception as e:
         print(f"[ERROR] Google Trends API error: {e}")
         import traceback; traceback.print_exc()
         return []
 
-import re
-
-def get_groq_keywords(query: str, count: int) -> list:
+def get_groq_keywords(query: str, count: int, fresh: bool = False) -> list:
     """Fetch keywords from Groq AI, returning [{'keyword': ..., 'source': 'groq'}]."""
     groq_api_key = os.getenv("GROQ_API_KEY")
     if not groq_api_key:
         print("[ERROR] GROQ_API_KEY not set")
         return []
+    cache = get_response_cache()
+    cached = cache.lookup("groq_keywords", {"count": count}, query, fresh=fresh)
+    if cached is not None:
+        return cached
+    from deadlines import ClientDisconnected, DeadlineExceeded, upstream_timeout
     try:
         headers = {
             "Authorization": f"Bearer {groq_api_key}",
@@ -470,12 +876,14 @@ def get_groq_keywords(query: str, count: int) -> list:
             "temperature": 0.7
         }
         print(f"[DEBUG] Sending request to Groq API with prompt: {prompt[:100]}...")
+        started = time.time()
         response = requests.post(
             "https://api.groq.com/openai/v1/chat/completions",
             headers=headers,
             json=data,  # Fix: use json=data instead of json=payload
-            timeout=45
+            timeout=upstream_timeout(45)
         )
+        _track_completion(data["model"], response, started)
         response_text = response.text
         print(f"[DEBUG] Groq API response status: {response.status_code}")
         print(f"[DEBUG] Groq API response: {response_text[:200]}...")
@@ -512,6 +920,8 @@ def get_groq_keywords(query: str, count: int) -> list:
                 if len(filtered) >= count:
                     break
             print(f"[DEBUG] Got {len(filtered)} keywords from Groq")
+            if filtered:
+                cache.store("groq_keywords", {"count": count}, query, filtered, (time.time() - started) * 1000)
             return filtered
         except json.JSONDecodeError as je:
             print(f"[ERROR] Failed to parse Groq response as JSON: {je}")
@@ -520,14 +930,62 @@ def get_groq_keywords(query: str, count: int) -> list:
     except requests.exceptions.RequestException as re:
         print(f"[ERROR] Request to Groq API failed: {re}")
         return []
+    except (ClientDisconnected, DeadlineExceeded):
+        raise
     except Exception as e:
         print(f"[ERROR] Unexpected error in get_groq_keywords: {e}")
         import traceback
         traceback.print_exc()
         return []
 
-@app.get("/analyze_keyword")
-async def analyze_keyword(query: str = Query(..., min_length=2), suggest: int = Query(5, ge=1, le=10)):
+def _keyword_cache_key(query: str, suggest: int) -> str:
+    return f"keywords:{query.strip().lower()}:{suggest}"
+
+async def _compute_keyword_analysis(query: str, suggest: int, fresh: bool = False) -> dict:
+    """
+    Run the keyword analysis (OpenRouter, then Google Trends, Groq and the trending digest) and
+    store the result in the shared cache. Raises HTTPException if every source fails.
+    """
+    from deadlines import ClientDisconnected, DeadlineExceeded, guard
+    breaker = get_breaker("openrouter")
+    try:
+        if not await breaker.allow_async():
+            raise RuntimeError("OpenRouter circuit open")
+        try:
+            result = await get_openrouter_keywords(query, suggest)
+        except (ClientDisconnected, DeadlineExceeded):
+            # Our own cancellation, not an OpenRouter failure; no point in falling back either
+            raise
+        except Exception:
+            await breaker.record_failure_async()
+            raise
+        await breaker.record_success_async()
+        result["keywords"] = _augment_keyword_rows(result.get("keywords", []))
+        print(f"[SUCCESS] Retrieved {len(result['keywords'])} keywords for '{query}' from OpenRouter")
+    except (ClientDisconnected, DeadlineExceeded):
+        raise
+    except Exception as or_err:
+        print(f"[WARNING] OpenRouter keyword fetch failed: {or_err}. Falling back to other sources...")
+        # Sources that answer for this exact query first; the trending digest only
+        # matches on shared topic words, so it is the last resort
+        keywords = await guard(asyncio.to_thread(get_google_trends_keywords, query, suggest))
+        if not keywords:
+            keywords = await guard(asyncio.to_thread(get_groq_keywords, query, suggest, fresh))
+        if not keywords:
+            keywords = get_trending().keywords_for(query, suggest)
+        if not keywords:
+            raise HTTPException(status_code=502, detail="Failed to generate keywords from all sources.")
+        result = {"query": query, "keywords": _augment_keyword_rows(keywords), "timestamp": datetime.now().isoformat()}
+    await asyncio.to_thread(get_shared_state().set, _keyword_cache_key(query, suggest), result, ttl=CACHE_EXPIRY)
+    return result
+
+@router.get("/analyze_keyword")
+async def analyze_keyword(
+    query: str = Query(..., min_length=2),
+    suggest: int = Query(5, ge=1, le=10),
+    fresh: bool = Query(False),
+    ticket=admit("analyze_keyword", 2000),
+):
     """
     Get detailed, AI-powered keyword analysis using OpenRouter (GPT-3.5 Turbo or similar).
     """
@@ -537,20 +995,18 @@ async def analyze_keyword(query: str = Query(..., min_length=2), suggest: int =
             raise HTTPException(status_code=400, detail="Query cannot be empty")
         query = query.strip()
         suggest = min(max(suggest, 1), 10)
-        try:
-            result = await get_openrouter_keywords(query, suggest)
-            result["keywords"] = _augment_keyword_rows(result.get("keywords", []))
-            print(f"[SUCCESS] Retrieved {len(result['keywords'])} keywords for '{query}' from OpenRouter")
-            return result
-        except Exception as or_err:
-            print(f"[WARNING] OpenRouter keyword fetch failed: {or_err}. Falling back to other sources...")
-            keywords = get_google_trends_keywords(query, suggest)
-            if keywords:
-                return {"query": query, "keywords": _augment_keyword_rows(keywords), "timestamp": datetime.now().isoformat()}
-            groq_kw = get_groq_keywords(query, suggest)
-            if groq_kw:
-                return {"query": query, "keywords": _augment_keyword_rows(groq_kw), "timestamp": datetime.now().isoformat()}
-            raise HTTPException(status_code=502, detail="Failed to generate keywords from all sources.")
+        state = get_shared_state()
+        cache_key = _keyword_cache_key(query, suggest)
+        result = None if fresh else await asyncio.to_thread(state.get, cache_key)
+        if result:
+            print(f"[DEBUG] Serving keyword analysis for '{query}' from shared cache")
+            if await asyncio.to_thread(state.get, f"prefetched:{cache_key}") is not None:
+                await asyncio.to_thread(state.delete, f"prefetched:{cache_key}")
+                get_counters().incr("prefetch:stats:hits")
+        else:
+            result = await _compute_keyword_analysis(query, suggest, fresh)
+        _record_activity("keyword", "Keyword Research", query)
+        return result
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -560,17 +1016,88 @@ async def analyze_keyword(query: str = Query(..., min_length=2), suggest: int =
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=error_msg)
 
+# ---------------- Speculative keyword prefetch ----------------
+# After a thumbnail analysis, the extracted heading/hashtags are analyzed in the
+# background (only while upstream capacity is idle) so the follow-up
+# KeywordMatrix lookup is a cache hit.
+PREFETCH_MAX_TERMS = int(os.getenv("PREFETCH_MAX_TERMS", "5"))
+PREFETCH_SUGGEST = 5  # KeywordMatrix always asks for suggest=5
+_prefetch_tasks = set()
+
+def _prefetch_terms(heading: str, hashtags: str) -> list:
+    """Keyword candidates from an analysis: the heading, then each hashtag (camelCase split into words)."""
+    candidates = []
+    heading = re.sub(r'^[\s"\'*#]+|[\s"\'*.!]+$', '', heading or '')
+    if 2 <= len(heading) <= 80:
+        candidates.append(heading)
+    for tag in re.findall(r"#(\w+)", hashtags or ""):
+        candidates.append(re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", tag))
+    terms, seen = [], set()
+    for term in candidates:
+        if len(term) >= 2 and term.lower() not in seen:
+            seen.add(term.lower())
+            terms.append(term)
+    return terms[:PREFETCH_MAX_TERMS]
+
+async def _prefetch_keywords(user: str, tier: str, terms: list):
+    from admission import current_ticket
+    from deadlines import current_scope
+    # Background work must outlive the request that scheduled it
+    current_scope.set(None)
+    state = get_shared_state()
+    counters = get_counters()
+    controller = get_admission()
+    for term in terms:
+        cache_key = _keyword_cache_key(term, PREFETCH_SUGGEST)
+        if await asyncio.to_thread(state.get, cache_key):
+            counters.incr("prefetch:stats:already_cached")
+            continue
+        if not await asyncio.to_thread(controller.prefetch_allowed, user, tier):
+            # Prefetch spends the user's own budget; stop once its share is used up
+            counters.incr("prefetch:stats:skipped_budget", len(terms) - terms.index(term))
+            return
+        ticket = controller.try_acquire_idle(user, "prefetch_keywords")
+        if ticket is None:
+            # Upstream is busy with live requests; drop the rest of this prefetch
+            counters.incr("prefetch:stats:skipped_busy", len(terms) - terms.index(term))
+            return
+        current_ticket.set(ticket)
+        try:
+            await _compute_keyword_analysis(term, PREFETCH_SUGGEST)
+            await asyncio.to_thread(state.set, f"prefetched:{cache_key}", 1, ttl=CACHE_EXPIRY)
+            counters.incr("prefetch:stats:completed")
+        except Exception as e:
+            print(f"[WARNING] Keyword prefetch failed for '{term}': {e}")
+            counters.incr("prefetch:stats:failed")
+        finally:
+            controller.release(ticket)
+            current_ticket.set(None)
+
+def schedule_keyword_prefetch(user: str, tier: str, heading: str, hashtags: str):
+    """Start a detached low-priority task that warms the keyword cache for an analysis result."""
+    terms = _prefetch_terms(heading, hashtags)
+    if not terms:
+        return
+    get_counters().incr("prefetch:stats:scheduled", len(terms))
+    task = asyncio.create_task(_prefetch_keywords(user, tier, terms))
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
+
+@admin_router.get("/admin/prefetch")
+async def prefetch_metrics():
+    """Keyword prefetch counters (shared across workers) and the resulting hit rate."""
+    counters = get_counters()
+    names = ("scheduled", "completed", "already_cached", "skipped_busy", "skipped_budget", "failed", "hits")
+    values = await asyncio.to_thread(lambda: [counters.get(f"prefetch:stats:{name}") for name in names])
+    stats = dict(zip(names, values))
+    stats["hit_rate"] = round(stats["hits"] / stats["completed"], 3) if stats["completed"] else 0.0
+    stats["in_progress"] = len(_prefetch_tasks)
+    return stats
+
 async def get_openrouter_keywords(query: str, count: int = 5) -> dict:
     """
     Get related keywords using OpenRouter API with DeepSeek model
     """
-    # Debug: Print all environment variables
-    print("\n[DEBUG] Checking environment variables...")
-    for key, value in os.environ.items():
-        if 'API' in key or 'KEY' in key or 'OPENROUTER' in key.upper():
-            masked_value = value[:4] + '*' * (len(value) - 8) + value[-4:] if len(value) > 8 else '***'
-            print(f"[DEBUG] {key}: {masked_value}")
-    
     openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
     if not openrouter_api_key:
         error_msg = "OPENROUTER_API_KEY environment variable not set"
@@ -621,18 +1148,18 @@ List {count} highly relevant YouTube keywords for "{query}" as a JSON array of o
     
     try:
         import httpx
-        import json
-        from datetime import datetime
         
         print(f"[DEBUG] Sending request to OpenRouter API...")
         
         # Make the API request
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload
-            )
+        started = time.time()
+        response = await _post_upstream(
+            "https://openrouter.ai/api/v1/chat/completions",
+            30.0,
+            headers=headers,
+            json=payload
+        )
+        _track_completion(payload["model"], response, started)
         
         # Log response details
         print(f"[DEBUG] Response status: {response.status_code}")
@@ -664,8 +1191,6 @@ List {count} highly relevant YouTube keywords for "{query}" as a JSON array of o
         
         # Parse the JSON response
         try:
-            import re
-            import json
             # Try to extract all JSON objects for keywords using regex
             keyword_objs = re.findall(r'\{[^{}]*?"keyword"[^{}]*?\}', content, re.DOTALL)
             valid_keywords = []
@@ -690,12 +1215,14 @@ List {count} highly relevant YouTube keywords for "{query}" as a JSON array of o
             if len(valid_keywords) < count:
                 print(f"[INFO] Got only {len(valid_keywords)} keywords, retrying once to get more...")
                 # Make a second API call with the same payload
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response2 = await client.post(
-                        "https://openrouter.ai/api/v1/chat/completions",
-                        headers=headers,
-                        json=payload
-                    )
+                started = time.time()
+                response2 = await _post_upstream(
+                    "https://openrouter.ai/api/v1/chat/completions",
+                    30.0,
+                    headers=headers,
+                    json=payload
+                )
+                _track_completion(payload["model"], response2, started)
                 response2.raise_for_status()
                 result2 = response2.json()
                 content2 = result2['choices'][0]['message']['content'].strip()
@@ -759,31 +1286,50 @@ List {count} highly relevant YouTube keywords for "{query}" as a JSON array of o
         traceback.print_exc()
         raise
 
-@app.post("/generate_tweet")
-async def generate_tweet(request: Request, image: UploadFile = FastAPIFile(None), topic: str = Form(None)):
+async def _fetch_remote_image(video_id: Optional[str] = None, image_url: Optional[str] = None) -> bytes:
+    """Fetch an image by YouTube video id (or video URL) or by image URL through the thumbnail cache."""
+    from thumbnail_fetch import ThumbnailFetchError
+    cache = get_thumbnail_cache()
+    try:
+        if video_id and video_id.strip():
+            contents, url = await cache.fetch_video_thumbnail(get_http_client(), video_id)
+            print(f"[DEBUG] Using thumbnail {url}")
+            return contents
+        return await cache.fetch_url(get_http_client(), image_url)
+    except ThumbnailFetchError as e:
+        print(f"[ERROR] Thumbnail fetch failed: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@router.post("/generate_tweet")
+async def generate_tweet(
+    request: Request,
+    image: UploadFile = FastAPIFile(None),
+    topic: str = Form(None),
+    video_id: str = Form(None),
+    image_url: str = Form(None),
+    ticket=admit("generate_tweet", 1600),
+):
     try:
-        # Accept either image or topic
-        if not image and not (topic and topic.strip()):
+        has_remote_image = bool((video_id and video_id.strip()) or (image_url and image_url.strip()))
+        # Accept an image (uploaded or fetched by video id / URL) or a topic
+        if not image and not has_remote_image and not (topic and topic.strip()):
             return JSONResponse(status_code=400, content={"error": "Please upload an image or enter a topic."})
         img_str = None
-        if image:
-            contents = await image.read()
+        if image or has_remote_image:
+            contents = await image.read() if image else await _fetch_remote_image(video_id, image_url)
             try:
-                img_obj = Image.open(io.BytesIO(contents))
+                img_str = await asyncio.to_thread(_encode_jpeg_base64, contents)
             except Exception as e:
                 print(f"[ERROR] Invalid image: {str(e)}")
                 raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
-            buffered = io.BytesIO()
-            img_obj.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
 
         groq_api_key = os.getenv("GROQ_API_KEY")
 
         tweet_prompt = "Generate 3 creative, viral tweets (each max 280 chars, no hashtags) for a YouTube/Instagram post based on this {}. Output each tweet on a separate line, no extra text.".format(
-            "image" if image else "topic"
+            "image" if img_str else "topic"
         )
         ig_prompt = "Write 3 engaging Instagram posts (each max 300 chars, friendly tone, emoji ok, no hashtags) for a YouTube/Instagram post based on this {}. Output each post on a separate line, no extra text.".format(
-            "image" if image else "topic"
+            "image" if img_str else "topic"
         )
         # Compose messages for Groq
         def groq_messages(prompt):
@@ -800,7 +1346,7 @@ async def generate_tweet(request: Request, image: UploadFile = FastAPIFile(None)
                         {"type": "text", "text": f"{prompt}\nTopic: {topic}"}
                     ]}
                 ]
-        def call_groq(prompt):
+        async def call_groq(prompt):
             headers = {"Authorization": f"Bearer {groq_api_key}", "Content-Type": "application/json"}
             payload = {
                 "model": "meta-llama/llama-4-scout-17b-16e-instruct",
@@ -808,46 +1354,102 @@ async def generate_tweet(request: Request, image: UploadFile = FastAPIFile(None)
                 "max_tokens": 800
             }
             try:
-                resp = requests.post("https://api.groq.com/openai/v1/chat/completions", json=payload, headers=headers, timeout=30)
+                started = time.time()
+                resp = await _post_upstream("https://api.groq.com/openai/v1/chat/completions", 30, json=payload, headers=headers)
+                _track_completion(payload["model"], resp, started)
                 if resp.status_code == 200:
                     return resp.json()["choices"][0]["message"]["content"].strip()
                 else:
                     print(f"[GROQ ERROR] {resp.status_code}: {resp.text}")
                     return None
+            except HTTPException:
+                raise
             except Exception as e:
                 print(f"[GROQ EXCEPTION] {str(e)}")
                 return None
         # Generate content using Groq
-        tweet = call_groq(tweet_prompt)
-        ig = call_groq(ig_prompt)
+        tweet, ig = await asyncio.gather(call_groq(tweet_prompt), call_groq(ig_prompt))
         if not tweet and not ig:
             return JSONResponse(status_code=500, content={"error": "Groq failed to generate content."})
         # Split into lists, remove empty lines
         tweet_list = [t.strip() for t in (tweet or '').split('\n') if t.strip()]
         ig_list = [t.strip() for t in (ig or '').split('\n') if t.strip()]
+        _record_activity("social", "Social Posts Generated", topic if not img_str and topic else "image")
         return {"tweets": tweet_list, "igs": ig_list}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[TWEET GENERATOR ERROR] {str(e)}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.post("/upload_and_query")
-async def upload_and_query(request: Request, image: UploadFile = FastAPIFile(...), query: str = Form(...)):
+async def _groq_vision_request(prompt: str, encoded_image: str, max_tokens: int = 1000):
+    """Send one prompt plus a base64 JPEG to the Groq multimodal model and return the raw response."""
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}}
+            ]
+        }
+    ]
+    model = "meta-llama/llama-4-scout-17b-16e-instruct"
+    started = time.time()
+    response = await _post_upstream(
+        "https://api.groq.com/openai/v1/chat/completions",
+        30,
+        json={
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens
+        },
+        headers={
+            "Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}",
+            "Content-Type": "application/json"
+        }
+    )
+    _track_completion(model, response, started)
+    return response
+
+def _encode_jpeg_base64(contents: bytes) -> str:
+    """Re-encode arbitrary image bytes as a base64 JPEG for the vision model."""
+    from PIL import Image
+    img_obj = Image.open(io.BytesIO(contents)).convert("RGB")
+    buffered = io.BytesIO()
+    img_obj.save(buffered, format="JPEG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+@router.post("/upload_and_query")
+async def upload_and_query(
+    request: Request,
+    image: UploadFile = FastAPIFile(None),
+    query: str = Form(...),
+    video_id: str = Form(None),
+    image_url: str = Form(None),
+    ticket=admit("upload_and_query", 3000),
+):
+    """
+    Analyze a thumbnail: either an uploaded image, or one fetched server-side by
+    YouTube video id (or video URL) or image URL.
+    """
     print(f"[REQUEST] /upload_and_query from {request.client.host}")
     try:
-        if not image.content_type.startswith("image/"):
-            print("[ERROR] File is not an image.")
-            raise HTTPException(status_code=400, detail="File must be an image")
-        contents = await image.read()
+        if image is not None:
+            if not image.content_type.startswith("image/"):
+                print("[ERROR] File is not an image.")
+                raise HTTPException(status_code=400, detail="File must be an image")
+            contents = await image.read()
+        elif (video_id and video_id.strip()) or (image_url and image_url.strip()):
+            contents = await _fetch_remote_image(video_id, image_url)
+        else:
+            raise HTTPException(status_code=400, detail="Upload an image or provide a video_id or image_url")
         try:
-            img_obj = Image.open(io.BytesIO(contents))
+            # RGBA/palette uploads (PNG, GIF) are flattened to RGB before JPEG encoding
+            img_str = await asyncio.to_thread(_encode_jpeg_base64, contents)
         except Exception as e:
             print(f"[ERROR] Invalid image: {str(e)}")
             raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
 
-        buffered = io.BytesIO()
-        img_obj.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-
         groq_api_key = os.getenv("GROQ_API_KEY")
         if not groq_api_key:
             print("[ERROR] GROQ_API_KEY not set")
@@ -866,35 +1468,12 @@ async def upload_and_query(request: Request, image: UploadFile = FastAPIFile(...
             "Return them in a single line, separated by spaces, each starting with the # symbol."
         )
 
-        def make_api_request(prompt, encoded_image):
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}}
-                    ]
-                }
-            ]
-            response = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                json={
-                    "model": "meta-llama/llama-4-scout-17b-16e-instruct",
-                    "messages": messages,
-                    "max_tokens": 1000
-                },
-                headers={
-                    "Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}",
-                    "Content-Type": "application/json"
-                },
-                timeout=30
-            )
-            return response
-
         # Make requests to the multimodal model for heading, description and hashtags
-        heading_response = make_api_request(heading_prompt, img_str)
-        desc_response = make_api_request(desc_prompt, img_str)
-        hash_response = make_api_request(hash_prompt, img_str)
+        heading_response, desc_response, hash_response = await asyncio.gather(
+            _groq_vision_request(heading_prompt, img_str),
+            _groq_vision_request(desc_prompt, img_str),
+            _groq_vision_request(hash_prompt, img_str),
+        )
 
         print("[DEBUG] Got Groq API responses for heading, description and hashtags...")
         if any(r.status_code != 200 for r in [heading_response, desc_response, hash_response]):
@@ -927,6 +1506,8 @@ async def upload_and_query(request: Request, image: UploadFile = FastAPIFile(...
             print(f"[ERROR] Failed to parse hashtag response: {str(e)}")
             hashtags = ""
         print("[SUCCESS] Returning heading, description and hashtags.")
+        schedule_keyword_prefetch(ticket.user, ticket.tier, heading, hashtags)
+        _record_activity("thumbnail", "Thumbnail Analyzed", image.filename if image is not None else (video_id or image_url))
         return {
             "heading": heading,
             "description": description,
@@ -940,6 +1521,92 @@ async def upload_and_query(request: Request, image: UploadFile = FastAPIFile(...
         print(f"[UNEXPECTED ERROR] {str(e)}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@router.post("/thumbnail/compare")
+async def compare_thumbnails(
+    request: Request,
+    images: List[UploadFile] = FastAPIFile(None),
+    video_ids: List[str] = Form(None),
+    image_urls: List[str] = Form(None),
+    top_k: int = Form(0),
+    query: str = Form(None),
+    ticket=admit("thumbnail_compare", 1500),
+):
+    """
+    Rank several thumbnail variants in one pass.
+    Variants can be uploaded or fetched server-side by video id / image URL
+    (e.g. for competitor analysis). All images are decoded in a worker pool
+    and scored together on local quality metrics; only the top_k finalists
+    (if any) go to the vision model.
+    """
+    import thumbnail_metrics
+    images = images or []
+    video_ids = [v for v in (video_ids or []) if v and v.strip()]
+    image_urls = [u for u in (image_urls or []) if u and u.strip()]
+    total = len(images) + len(video_ids) + len(image_urls)
+    print(f"[REQUEST] /thumbnail/compare from {request.client.host} ({total} images, top_k={top_k})")
+    if total < 2:
+        raise HTTPException(status_code=400, detail="Provide at least two images to compare")
+    if total > thumbnail_metrics.MAX_COMPARE_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {thumbnail_metrics.MAX_COMPARE_IMAGES} images can be compared at once")
+    for upload in images:
+        if not (upload.content_type or "").startswith("image/"):
+            raise HTTPException(status_code=400, detail=f"File '{upload.filename}' must be an image")
+
+    names = [upload.filename for upload in images] + video_ids + image_urls
+    blobs = [await upload.read() for upload in images]
+    blobs += await asyncio.gather(
+        *(_fetch_remote_image(video_id=v) for v in video_ids),
+        *(_fetch_remote_image(image_url=u) for u in image_urls),
+    )
+    batch, errors = await asyncio.to_thread(thumbnail_metrics.decode_batch, blobs)
+    if errors:
+        bad = ", ".join(f"'{names[i]}': {err}" for i, err in errors.items())
+        raise HTTPException(status_code=400, detail=f"Invalid image(s): {bad}")
+
+    order, metrics, scores = thumbnail_metrics.rank_batch(batch)
+    ranking = []
+    for rank, idx in enumerate(order.tolist(), start=1):
+        ranking.append({
+            "index": idx,
+            "filename": names[idx],
+            "rank": rank,
+            "score": round(float(scores[idx]), 2),
+            "metrics": {name: round(float(values[idx]), 4) for name, values in metrics.items()},
+        })
+
+    top_k = max(0, min(top_k, len(ranking)))
+    if top_k:
+        if not os.getenv("GROQ_API_KEY"):
+            raise HTTPException(status_code=500, detail="GROQ_API_KEY not set")
+        prompt = (
+            "You are reviewing a YouTube thumbnail that is competing against other variants. "
+            "In 2-3 sentences, describe its strongest and weakest points for click-through rate."
+        )
+        if query and query.strip():
+            prompt += f" The video is about: {query.strip()}."
+
+        async def _review(entry):
+            try:
+                encoded = await asyncio.to_thread(_encode_jpeg_base64, blobs[entry["index"]])
+                resp = await _groq_vision_request(prompt, encoded, max_tokens=300)
+                if resp.status_code != 200:
+                    print(f"[GROQ ERROR] {resp.status_code}: {resp.text}")
+                    return None
+                return resp.json()["choices"][0]["message"]["content"].strip()
+            except HTTPException:
+                raise
+            except Exception as e:
+                print(f"[GROQ EXCEPTION] {str(e)}")
+                return None
+
+        finalists = ranking[:top_k]
+        reviews = await asyncio.gather(*(_review(entry) for entry in finalists))
+        for entry, review in zip(finalists, reviews):
+            entry["analysis"] = review
+
+    _record_activity("thumbnail", "Thumbnails Compared", f"{len(ranking)} thumbnails")
+    return {"count": len(ranking), "top_k": top_k, "ranking": ranking}
+
 def get_keyword_metrics(keyword: str) -> dict:
     """
     Get metrics for a single keyword with safe fallbacks.
@@ -987,7 +1654,6 @@ def _augment_keyword_rows(keyword_rows: list) -> list:
         augmented.append(base)
     return augmented
 
-@app.middleware("http")
 async def enrich_keywords_response(request, call_next):
     response = await call_next(request)
     try:
@@ -1000,3 +1666,112 @@ async def enrich_keywords_response(request, call_next):
     except Exception:
         pass
     return response
+
+@admin_router.get("/admin/admission")
+async def admission_metrics():
+    """Admission-control counters and queue wait per tier for this worker."""
+    return get_admission().metrics()
+
+@router.get("/youtube/search")
+async def youtube_search(q: str = Query(..., min_length=1), max_results: int = Query(12, ge=1, le=50)):
+    """
+    Search YouTube and return videos with statistics and channel subscriber
+    counts, in the same shape as searchYouTubeVideos() in youtubeService.ts.
+    """
+    from youtube_api import YouTubeAPIError
+    try:
+        videos = await get_youtube().search_videos(q.strip(), max_results)
+    except YouTubeAPIError as e:
+        print(f"[YOUTUBE ERROR] {e}")
+        raise HTTPException(status_code=500 if e.status_code == 500 else 502, detail=str(e))
+    return {"query": q, "videos": videos}
+
+@router.get("/trending")
+async def trending(request: Request, seed: Optional[str] = Query(None)):
+    """
+    Current trending-keyword digest, served from memory. The snapshot version
+    doubles as an ETag so pollers get a 304 until the next refresh.
+    """
+    digest = get_trending()
+    snapshot = digest.snapshot
+    etag = f'"trending-{snapshot["version"]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    if seed is not None:
+        body = {
+            "version": snapshot["version"],
+            "refreshed_at": snapshot["refreshed_at"],
+            "seed": seed,
+            "related": digest.related_for(seed),
+        }
+    else:
+        body = snapshot
+    return JSONResponse(content=body, headers={"ETag": etag})
+
+@admin_router.get("/admin/youtube")
+async def youtube_metrics():
+    """YouTube proxy cache counters for this worker."""
+    return get_youtube().stats
+
+@admin_router.get("/admin/thumbnails")
+async def thumbnail_cache_metrics():
+    """Thumbnail fetch cache counters for this worker."""
+    return get_thumbnail_cache().stats
+
+async def _signed_in_user(request: Request) -> str:
+    identity = await current_identity(request)
+    if not identity.authenticated:
+        raise HTTPException(status_code=401, detail="Sign in to see your activity",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return identity.user
+
+@router.get("/api/activity")
+async def recent_activity(request: Request, limit: int = Query(20, ge=1, le=100)):
+    """Latest activity of the signed-in caller."""
+    user = await _signed_in_user(request)
+    return await asyncio.to_thread(get_activity().recent, user, limit)
+
+@router.get("/api/stats")
+async def dashboard_stats(request: Request):
+    """Dashboard counters and per-day series of the signed-in caller, maintained incrementally by the activity log."""
+    user = await _signed_in_user(request)
+    return await asyncio.to_thread(get_activity().stats, user)
+
+@admin_router.get("/admin/response_cache")
+async def response_cache_metrics():
+    """Near-duplicate response cache hit ratio and upstream latency saved (shared across workers)."""
+    return await asyncio.to_thread(get_response_cache().report)
+
+@admin_router.get("/admin/usage")
+async def usage_report(top_users: int = Query(10, ge=1, le=100)):
+    """
+    Upstream token usage: tokens/sec, cost and latency per route and model, and
+    the heaviest users. In-memory figures are for this worker; "persisted" sums
+    the local usage store across workers.
+    """
+    tracker = get_usage()
+    report = tracker.report(top_users=top_users)
+    report["persisted"] = await asyncio.to_thread(tracker.persisted_by_route)
+    return report
+
+def create_app() -> FastAPI:
+    """Build the FastAPI application; resources are opened in the lifespan, not at import."""
+    app = FastAPI(title="Thumbnail Analyzer API", lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,  # Allows all localhost and 127.0.0.1 origins
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    print(f"[INFO] CORS middleware enabled for: {origins}")
+    setup_global_exception_handler(app)
+    app.middleware("http")(enrich_keywords_response)
+    from deadlines import DisconnectListener
+    # Added last so it is the outermost layer and sees the server's receive channel
+    app.add_middleware(DisconnectListener)
+    app.include_router(router)
+    app.include_router(admin_router)
+    return app
+
+app = create_app()
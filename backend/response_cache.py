@@ -0,0 +1,175 @@
+"""
+Near-duplicate response cache for the text generation endpoints.
+
+Requests are reduced to a canonical form (lowercased, punctuation and extra
+whitespace removed, keyword lists sorted, tone bucketed by the caller) and
+cached in the shared state backend under a hash of that form, so inputs that
+only differ cosmetically are exact hits.
+
+On an exact miss, a MinHash/LSH index over word shingles of the request text
+finds similar earlier requests with the same structured attributes; the best
+candidate is served if its Jaccard similarity reaches RESPONSE_CACHE_SIMILARITY.
+The index is per worker (entries themselves live in the shared backend), so a
+worker only finds near-duplicates of requests it has seen itself. lookup and
+store talk to the backend and hash shingles; call them off the event loop.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, List, Optional
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+# Minimum Jaccard similarity of request shingles for serving a near-duplicate; >1 disables it
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.85"))
+INDEX_SIZE = int(os.getenv("RESPONSE_CACHE_INDEX_SIZE", "5000"))
+NUM_PERM = 64
+BANDS = 16  # 16 bands x 4 rows
+_ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+
+_rng = random.Random(0x5EED)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_STATS = ("lookups", "exact_hits", "similar_hits", "misses", "bypassed", "saved_latency_ms")
+
+
+def canonical_text(text: Optional[str]) -> str:
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+
+def canonical_terms(terms: Optional[Iterable[str]]) -> List[str]:
+    return sorted({canonical_text(t) for t in terms or [] if canonical_text(t)})
+
+
+def shingles(text: str) -> set:
+    """Word unigrams and bigrams of canonical text."""
+    words = text.split()
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def minhash(tokens: set) -> List[int]:
+    hashes = [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "big") for t in tokens]
+    if not hashes:
+        return [0] * NUM_PERM
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class ResponseCache:
+    def __init__(self, state_getter: Callable, counters_getter: Callable,
+                 threshold: float = RESPONSE_CACHE_SIMILARITY, ttl: int = RESPONSE_CACHE_TTL):
+        self._state_getter = state_getter
+        self._counters_getter = counters_getter
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (group, shingles, band keys), oldest first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bands = {}  # (group, band, band hash) -> set of keys
+
+    @staticmethod
+    def _group(namespace: str, attrs: dict) -> str:
+        return f"{namespace}:" + hashlib.sha1(json.dumps(attrs, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _key(group: str, text: str) -> str:
+        return f"rcache:{group}:" + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _stat(self, name: str, amount: int = 1) -> None:
+        self._counters_getter().incr(f"rcache:stats:{name}", amount)
+
+    # ---------------- LSH index ----------------
+    def _index(self, key: str, group: str, tokens: set) -> None:
+        signature = minhash(tokens)
+        bands = [(group, i, hash(tuple(signature[i * _ROWS:(i + 1) * _ROWS]))) for i in range(BANDS)]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (group, tokens, bands)
+            for band in bands:
+                self._bands.setdefault(band, set()).add(key)
+            while len(self._entries) > INDEX_SIZE:
+                self._unindex(next(iter(self._entries)))
+
+    def _unindex(self, key: str) -> None:
+        _, _, bands = self._entries.pop(key)
+        for band in bands:
+            keys = self._bands.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band]
+
+    def _similar(self, group: str, tokens: set) -> List[tuple]:
+        """Indexed keys in group whose similarity reaches the threshold, best first."""
+        signature = minhash(tokens)
+        with self._lock:
+            candidates = set()
+            for i in range(BANDS):
+                candidates |= self._bands.get((group, i, hash(tuple(signature[i * _ROWS:(i + 1) * _ROWS]))), set())
+            scored = [(jaccard(tokens, self._entries[key][1]), key) for key in candidates]
+        return sorted((s for s in scored if s[0] >= self.threshold), reverse=True)
+
+    # ---------------- public API ----------------
+    def lookup(self, namespace: str, attrs: dict, text: str, fresh: bool = False) -> Optional[Any]:
+        """
+        Cached response for a request, or None. attrs must match exactly; text
+        may be a near-duplicate. fresh=True skips the cache (the new result is
+        still stored by the caller).
+        """
+        if fresh:
+            self._stat("bypassed")
+            return None
+        self._stat("lookups")
+        state = self._state_getter()
+        group = self._group(namespace, attrs)
+        text = canonical_text(text)
+        entry = state.get(self._key(group, text))
+        if entry is not None:
+            if self.threshold <= 1:
+                # May have been stored by another worker
+                self._index(self._key(group, text), group, shingles(text))
+            self._stat("exact_hits")
+            self._stat("saved_latency_ms", int(entry.get("latency_ms", 0)))
+            return entry["response"]
+        for similarity, key in self._similar(group, shingles(text)):
+            entry = state.get(key)
+            if entry is None:
+                # Expired in the shared backend
+                with self._lock:
+                    if key in self._entries:
+                        self._unindex(key)
+                continue
+            print(f"[DEBUG] Serving near-duplicate {namespace} response (similarity {similarity:.2f})")
+            self._stat("similar_hits")
+            self._stat("saved_latency_ms", int(entry.get("latency_ms", 0)))
+            return entry["response"]
+        self._stat("misses")
+        return None
+
+    def store(self, namespace: str, attrs: dict, text: str, response: Any, latency_ms: float) -> None:
+        group = self._group(namespace, attrs)
+        text = canonical_text(text)
+        key = self._key(group, text)
+        self._state_getter().set(key, {"response": response, "latency_ms": latency_ms}, ttl=self.ttl)
+        if self.threshold <= 1:
+            self._index(key, group, shingles(text))
+
+    def report(self) -> dict:
+        counters = self._counters_getter()
+        stats = {name: counters.get(f"rcache:stats:{name}") for name in _STATS}
+        hits = stats["exact_hits"] + stats["similar_hits"]
+        stats["hit_ratio"] = round(hits / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["similarity_threshold"] = self.threshold
+        with self._lock:
+            stats["indexed"] = len(self._entries)
+        return stats
@@ -0,0 +1,423 @@
+"""
+Shared state for caches, rate-limit buckets and circuit breakers.
+
+Everything that has to agree across uvicorn workers goes through a
+``StateBackend``. Pick one with ``SHARED_STATE_URL``:
+
+    sqlite:///path/to/state.sqlite3   single host, any number of workers (default)
+    redis://host:6379/0               multi-host; needs the optional ``redis`` package
+    memory://                         single process only (development)
+
+Values must be JSON-serializable. Backend calls block (SQLite file, Redis
+socket); from async code run them with asyncio.to_thread, or buffer hot
+statistics counters in a ``CounterBuffer``.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, Callable, Optional
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "shared_state.sqlite3")
+
+
+class StateBackend(ABC):
+    """Interface shared by all backends. Every method must be atomic across workers."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add amount to an integer counter; ttl only applies when the counter is created."""
+
+    @abstractmethod
+    def reserve_slot(self, key: str, interval: float) -> float:
+        """
+        Reserve the next free slot of a fixed-interval rate limit and return how
+        many seconds the caller must wait before using it.
+        """
+
+    @abstractmethod
+    def take_token(self, key: str, rate: float, capacity: float) -> float:
+        """
+        Token bucket: take one token if available and return 0, otherwise leave
+        the bucket untouched and return the seconds until a token is available.
+        """
+
+
+def _next_slot(stored: Optional[float], now: float, interval: float):
+    """Return (wait, new_stored_value) for reserve_slot."""
+    slot = max(now, stored or 0.0)
+    return slot - now, slot + interval
+
+
+def _bucket_take(stored: Optional[dict], now: float, rate: float, capacity: float):
+    """Return (wait, new_bucket_state) for take_token."""
+    if stored:
+        tokens = min(capacity, stored["tokens"] + (now - stored["ts"]) * rate)
+    else:
+        tokens = capacity
+    if tokens >= 1:
+        return 0.0, {"tokens": tokens - 1, "ts": now}
+    return (1 - tokens) / rate, {"tokens": tokens, "ts": now}
+
+
+class MemoryBackend(StateBackend):
+    """Process-local backend; only correct with a single worker."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    def _set(self, key, value, ttl):
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            current = self._get(key)
+            if current is None:
+                self._set(key, amount, ttl)
+                return amount
+            value, expires_at = self._data[key]
+            self._data[key] = (value + amount, expires_at)
+            return value + amount
+
+    def reserve_slot(self, key, interval):
+        with self._lock:
+            wait, slot = _next_slot(self._get(key), time.time(), interval)
+            self._set(key, slot, None)
+            return wait
+
+    def take_token(self, key, rate, capacity):
+        with self._lock:
+            wait, bucket = _bucket_take(self._get(key), time.time(), rate, capacity)
+            self._set(key, bucket, None)
+            return wait
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Single-host backend shared by all worker processes through one SQLite file
+    in WAL mode. Read-modify-write operations run inside BEGIN IMMEDIATE so they
+    are serialized across processes.
+    """
+
+    _PURGE_EVERY = 500  # writes between sweeps of expired rows
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly where needed
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=10000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _read(self, conn, key, now):
+        row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def _write(self, conn, key, value, expires_at):
+        conn.execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, json.dumps(value), expires_at),
+        )
+        self._writes += 1
+        if self._writes % self._PURGE_EVERY == 0:
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def _atomic(self, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, time.time())
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def get(self, key):
+        return self._read(self._conn(), key, time.time())[0]
+
+    def set(self, key, value, ttl=None):
+        conn = self._conn()
+        self._write(conn, key, value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        def op(conn, now):
+            current, expires_at = self._read(conn, key, now)
+            if current is None:
+                current, expires_at = 0, (now + ttl if ttl else None)
+            self._write(conn, key, current + amount, expires_at)
+            return current + amount
+        return self._atomic(op)
+
+    def reserve_slot(self, key, interval):
+        def op(conn, now):
+            wait, slot = _next_slot(self._read(conn, key, now)[0], now, interval)
+            self._write(conn, key, slot, None)
+            return wait
+        return self._atomic(op)
+
+    def take_token(self, key, rate, capacity):
+        def op(conn, now):
+            wait, bucket = _bucket_take(self._read(conn, key, now)[0], now, rate, capacity)
+            self._write(conn, key, bucket, None)
+            return wait
+        return self._atomic(op)
+
+
+class RedisBackend(StateBackend):
+    """
+    Backend for any Redis-compatible server. Takes a redis-py style client, so a
+    local stand-in such as ``fakeredis.FakeRedis()`` can be passed in directly.
+    Read-modify-write operations use WATCH/MULTI optimistic transactions.
+    """
+
+    def __init__(self, client, prefix: str = "thumbnail-analyzer:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("SHARED_STATE_URL points at Redis but the 'redis' package is not installed") from e
+        return cls(redis.Redis.from_url(url))
+
+    def _k(self, key):
+        return self.prefix + key
+
+    def get(self, key):
+        raw = self.client.get(self._k(key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        px = int(ttl * 1000) if ttl else None
+        self.client.set(self._k(key), json.dumps(value), px=px)
+
+    def delete(self, key):
+        self.client.delete(self._k(key))
+
+    def incr(self, key, amount=1, ttl=None):
+        # INCRBY stores integers as plain strings, which json.loads reads back fine
+        if not ttl:
+            return int(self.client.incrby(self._k(key), amount))
+        # Create the counter with its expiry (NX leaves an existing one and its TTL alone) and
+        # add to it in one MULTI, so no other client sees a counter without a TTL
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(self._k(key), 0, px=int(ttl * 1000), nx=True)
+            pipe.incrby(self._k(key), amount)
+            _, value = pipe.execute()
+        return int(value)
+
+    def _transact(self, key, update):
+        """Run update(stored_value, now) -> (result, new_value) under WATCH until it commits."""
+        from redis.exceptions import WatchError
+        full_key = self._k(key)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(full_key)
+                    raw = pipe.get(full_key)
+                    result, new_value = update(json.loads(raw) if raw is not None else None, time.time())
+                    pipe.multi()
+                    pipe.set(full_key, json.dumps(new_value))
+                    pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+
+    def reserve_slot(self, key, interval):
+        return self._transact(key, lambda stored, now: _next_slot(stored, now, interval))
+
+    def take_token(self, key, rate, capacity):
+        return self._transact(key, lambda stored, now: _bucket_take(stored, now, rate, capacity))
+
+
+class CounterBuffer:
+    """
+    Statistics counters kept in memory and added to the backend in batches by
+    flush(), so request paths never wait on the backend to count something.
+    Only for counters that are reported, not for ones that gate requests.
+    """
+
+    def __init__(self, state_getter: Callable):
+        self._state_getter = state_getter
+        self._lock = threading.Lock()
+        self._pending = Counter()
+
+    def incr(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self._pending[key] += amount
+
+    def flush(self) -> int:
+        """Add the pending deltas to the backend (blocking); returns how many counters were written."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        state = self._state_getter()
+        items = [(key, amount) for key, amount in pending.items() if amount]
+        for i, (key, amount) in enumerate(items):
+            try:
+                state.incr(key, amount)
+            except Exception as e:
+                print(f"[ERROR] Failed to flush {len(items) - i} counters: {e}")
+                with self._lock:
+                    self._pending.update(dict(items[i:]))
+                return i
+        return len(items)
+
+    def get(self, key: str) -> int:
+        """Total across workers as of their last flush, plus this worker's pending part (blocking)."""
+        with self._lock:
+            pending = self._pending.get(key, 0)
+        return (self._state_getter().get(key) or 0) + pending
+
+
+class CircuitBreaker:
+    """
+    Shared circuit breaker for an upstream dependency. After failure_threshold
+    consecutive failures the circuit opens for reset_timeout seconds and callers
+    should go straight to their fallback. After that it is half-open: one caller
+    per reset_timeout is let through as a trial. A success closes the circuit, a
+    failure opens it again straight away.
+    """
+
+    def __init__(self, backend: StateBackend, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.backend = backend
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    @property
+    def _failures_key(self):
+        return f"breaker:{self.name}:failures"
+
+    @property
+    def _open_key(self):
+        return f"breaker:{self.name}:open"
+
+    @property
+    def _tripped_key(self):
+        # Present from opening until the next success; open key gone + this = half-open
+        return f"breaker:{self.name}:tripped"
+
+    @property
+    def _trial_key(self):
+        return f"breaker:{self.name}:trial"
+
+    def state(self) -> str:
+        if self.backend.get(self._open_key) is not None:
+            return "open"
+        return "half_open" if self.backend.get(self._tripped_key) is not None else "closed"
+
+    def allow(self) -> bool:
+        state = self.state()
+        if state == "half_open":
+            # One trial per reset_timeout, also if its caller never reports back
+            return self.backend.incr(self._trial_key, ttl=self.reset_timeout) == 1
+        return state == "closed"
+
+    def record_success(self) -> None:
+        self.backend.delete(self._failures_key)
+        if self.backend.get(self._tripped_key) is not None:
+            print(f"[INFO] Circuit '{self.name}' closed after a successful trial")
+            self.backend.delete(self._tripped_key)
+            self.backend.delete(self._trial_key)
+
+    def _open(self) -> None:
+        self.backend.set(self._open_key, time.time(), ttl=self.reset_timeout)
+        # Outlives the open period so the breaker goes half-open, not closed
+        self.backend.set(self._tripped_key, time.time(), ttl=self.reset_timeout * 20)
+        self.backend.delete(self._failures_key)
+        self.backend.delete(self._trial_key)
+
+    def record_failure(self) -> None:
+        if self.backend.get(self._open_key) is not None:
+            return  # a call that started before the circuit opened
+        if self.backend.get(self._tripped_key) is not None:
+            print(f"[WARNING] Circuit '{self.name}' trial failed, reopening")
+            self._open()
+            return
+        failures = self.backend.incr(self._failures_key, ttl=self.reset_timeout * 4)
+        if failures >= self.failure_threshold:
+            print(f"[WARNING] Circuit '{self.name}' opened after {failures} consecutive failures")
+            self._open()
+
+    # Awaitable versions for async callers; the backend calls above block
+    async def allow_async(self) -> bool:
+        return await asyncio.to_thread(self.allow)
+
+    async def record_success_async(self) -> None:
+        await asyncio.to_thread(self.record_success)
+
+    async def record_failure_async(self) -> None:
+        await asyncio.to_thread(self.record_failure)
+
+
+def from_url(url: Optional[str] = None) -> StateBackend:
+    """Build the backend selected by url (defaults to SHARED_STATE_URL, then the local SQLite file)."""
+    url = url or os.getenv("SHARED_STATE_URL") or f"sqlite:///{DEFAULT_SQLITE_PATH}"
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(url)
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# Keep every test off the network and out of backend/data
+_tmp = tempfile.mkdtemp(prefix="thumbnail-analyzer-tests-")
+os.environ.setdefault("SHARED_STATE_URL", "memory://")
+os.environ.setdefault("TRENDING_DIGEST_ENABLED", "0")
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+os.environ.setdefault("USAGE_DB_PATH", os.path.join(_tmp, "usage.sqlite3"))
+os.environ.setdefault("ACTIVITY_DB_PATH", os.path.join(_tmp, "activity.sqlite3"))
+os.environ.setdefault("THUMBNAIL_CACHE_DIR", os.path.join(_tmp, "thumbnails"))
+os.environ.setdefault("TRENDS_STORE_DIR", os.path.join(_tmp, "trends"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
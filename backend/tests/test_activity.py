@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import activity
+import auth
+import main
+from activity import ActivityLog
+from test_auth import SECRET, make_token
+
+
+def test_counts_flushed_by_another_worker_show_up_after_ttl(tmp_path, monkeypatch):
+    db = str(tmp_path / "activity.sqlite3")
+    writer, reader = ActivityLog(db), ActivityLog(db)
+    writer.record("alice", "script", "Script Generated", "a")
+    writer.flush()
+    assert reader.stats("alice")["scripts"] == 1
+
+    writer.record("alice", "script", "Script Generated", "b")
+    writer.flush()
+    # Still within the TTL: the reader serves its cached aggregates
+    assert reader.stats("alice")["scripts"] == 1
+    monkeypatch.setattr(activity, "COUNTS_TTL", 0)
+    assert reader.stats("alice")["scripts"] == 2
+
+
+def test_own_flush_is_not_double_counted(tmp_path, monkeypatch):
+    monkeypatch.setattr(activity, "COUNTS_TTL", 0)
+    log = ActivityLog(str(tmp_path / "activity.sqlite3"))
+    for _ in range(3):
+        log.record("bob", "thumbnail", "Thumbnail Analyzed", "x.png")
+    assert log.stats("bob")["thumbnails"] == 3
+    log.flush()
+    log.record("bob", "thumbnail", "Thumbnail Analyzed", "y.png")
+    assert log.stats("bob")["thumbnails"] == 4
+
+
+def test_recent_does_not_repeat_events_flushed_during_the_read(tmp_path, monkeypatch):
+    log = ActivityLog(str(tmp_path / "activity.sqlite3"))
+    log.record("carol", "script", "Script Generated", "older")
+    log.flush()
+    log.record("carol", "script", "Script Generated", "newer")
+    real_connect = log._connect
+    raced = []
+
+    def connect_after_a_flush():
+        # The memory snapshot is taken; another thread's flush commits before the table is read
+        if not raced:
+            raced.append(1)
+            log.flush()
+        return real_connect()
+
+    monkeypatch.setattr(log, "_connect", connect_after_a_flush)
+    assert [e["item"] for e in log.recent("carol")] == ["newer", "older"]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", SECRET)
+    monkeypatch.setattr(main.resources, "activity", ActivityLog(str(tmp_path / "activity.sqlite3")))
+    main.resources.activity.record("user-1", "keyword", "Keyword Research", "minecraft")
+    main.resources.activity.record("user-2", "keyword", "Keyword Research", "private query")
+    return TestClient(main.app)
+
+
+def test_dashboard_endpoints_require_a_session(client):
+    assert client.get("/api/activity").status_code == 401
+    assert client.get("/api/stats", headers={"X-User-Id": "user-2"}).status_code == 401
+
+
+def test_dashboard_endpoints_only_show_the_callers_data(client):
+    token = make_token({"sub": "user-1", "role": "authenticated", "exp": time.time() + 60})
+    headers = {"Authorization": f"Bearer {token}"}
+    items = client.get("/api/activity?scope=all", headers=headers).json()
+    assert [item["item"] for item in items] == ["minecraft"]
+    assert client.get("/api/stats?scope=all", headers=headers).json()["keywords"] == 1
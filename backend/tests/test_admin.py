@@ -0,0 +1,36 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import main
+
+ADMIN_PATHS = [
+    "/admin/usage", "/admin/admission", "/admin/prefetch",
+    "/admin/youtube", "/admin/thumbnails", "/admin/response_cache",
+]
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def test_every_admin_route_is_behind_the_admin_router():
+    admin_routes = {route.path for route in main.admin_router.routes}
+    public_admin_routes = {route.path for route in main.router.routes if route.path.startswith("/admin")}
+    assert admin_routes == set(ADMIN_PATHS)
+    assert public_admin_routes == set()
+
+
+@pytest.mark.parametrize("path", ADMIN_PATHS)
+def test_admin_routes_are_disabled_without_a_configured_token(client, monkeypatch, path):
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", None)
+    assert client.get(path, headers={"X-Admin-Token": ""}).status_code == 404
+
+
+@pytest.mark.parametrize("path", ADMIN_PATHS)
+def test_admin_routes_require_the_token(client, monkeypatch, path):
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", "s3cret")
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get(path, headers={"X-Admin-Token": "s3cret"}).status_code == 200
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import admission
+from admission import AdmissionController, QUOTA_WINDOW
+from shared_state import MemoryBackend
+
+
+def _quota(state, user):
+    return state.get(f"quota:{user}:{int(time.time() // QUOTA_WINDOW)}") or 0
+
+
+def test_requests_over_the_rate_limit_are_shed(monkeypatch):
+    monkeypatch.setitem(admission.RATE_PER_MINUTE, "trial", 6)
+    monkeypatch.setitem(admission.RATE_BURST, "trial", 3)
+    state = MemoryBackend()
+    controller = AdmissionController(lambda: state)
+
+    async def run():
+        for _ in range(3):
+            controller.release(await controller.acquire("u1", "trial", "ideas", 10))
+        with pytest.raises(HTTPException) as exc:
+            await controller.acquire("u1", "trial", "ideas", 10)
+        # Other users have their own bucket
+        controller.release(await controller.acquire("u2", "trial", "ideas", 10))
+        return exc.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert 1 <= int(error.headers["Retry-After"]) <= 10
+    assert controller.shed["trial"]["rate"] == 1
+
+
+def test_concurrent_requests_of_one_user_respect_the_cap():
+    state = MemoryBackend()
+    controller = AdmissionController(lambda: state, capacity=10)
+
+    async def run():
+        results = await asyncio.gather(
+            *(controller.acquire("u1", "trial", "ideas", 10) for _ in range(5)), return_exceptions=True
+        )
+        admitted = [r for r in results if not isinstance(r, BaseException)]
+        rejected = [r for r in results if isinstance(r, HTTPException)]
+        for ticket in admitted:
+            controller.release(ticket)
+        await asyncio.sleep(0.05)  # let the background budget refunds land
+        return admitted, rejected
+
+    admitted, rejected = asyncio.run(run())
+    assert len(admitted) == admission.USER_CONCURRENCY["trial"]
+    assert len(rejected) == 5 - len(admitted)
+    assert _quota(state, "u1") == 0
+
+
+def test_cancelled_acquire_refunds_the_budget():
+    class SlowBackend(MemoryBackend):
+        def take_token(self, key, rate, capacity):
+            time.sleep(0.1)
+            return super().take_token(key, rate, capacity)
+
+    state = SlowBackend()
+    controller = AdmissionController(lambda: state)
+
+    async def run():
+        task = asyncio.ensure_future(controller.acquire("u1", "trial", "ideas", 500))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.3)
+
+    asyncio.run(run())
+    assert _quota(state, "u1") == 0
+    assert controller._user_active.get("u1", 0) == 0
+
+
+def test_prefetch_is_charged_to_the_user_and_capped(monkeypatch):
+    monkeypatch.setattr(admission, "PREFETCH_TOKEN_BUDGET", 1000)
+    state = MemoryBackend()
+    controller = AdmissionController(lambda: state)
+
+    async def run():
+        assert controller.prefetch_allowed("u1", "trial")
+        ticket = controller.try_acquire_idle("u1", "prefetch_keywords")
+        ticket.used_tokens = 1200  # filled in by usage accounting
+        controller.release(ticket)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert _quota(state, "u1") == 1200
+    assert not controller.prefetch_allowed("u1", "trial")
+    assert controller.prefetch_allowed("u2", "trial")
+
+
+def test_prefetch_stops_when_the_user_budget_is_spent(monkeypatch):
+    state = MemoryBackend()
+    controller = AdmissionController(lambda: state)
+    controller.charge_tokens("u1", admission.TOKEN_BUDGET["trial"])
+    assert not controller.prefetch_allowed("u1", "trial")
+    assert controller.prefetch_allowed("u1", "pro")
@@ -0,0 +1,101 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import auth
+import shared_state
+
+SECRET = "test-jwt-secret"
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def make_token(claims: dict, secret: str = SECRET) -> str:
+    header = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    payload = _b64(json.dumps(claims).encode())
+    signature = hmac.new(secret.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{_b64(signature)}"
+
+
+def make_request(headers=(), client=("203.0.113.7", 1234)) -> Request:
+    return Request({
+        "type": "http", "method": "GET", "path": "/", "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers], "client": client,
+    })
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path == "/rest/v1/subscriptions":
+            assert request.headers["authorization"] == "Bearer service-key"
+            user = request.url.params["user_id"].removeprefix("eq.")
+            return httpx.Response(200, json=[{"status": "active"}] if user == "pro-user" else [])
+        return httpx.Response(404)
+
+    monkeypatch.setattr(auth, "SUPABASE_URL", "https://project.supabase.co")
+    monkeypatch.setattr(auth, "SUPABASE_SERVICE_ROLE_KEY", "service-key")
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", SECRET)
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    state = shared_state.MemoryBackend()
+    return auth.Authenticator(lambda: state, lambda: http), calls
+
+
+def _session(sub: str, **extra) -> dict:
+    return {"sub": sub, "role": "authenticated", "exp": time.time() + 3600, **extra}
+
+
+def test_tier_comes_from_subscriptions_not_client_headers(supabase):
+    authenticator, calls = supabase
+    token = make_token(_session("trial-user"))
+    request = make_request([("Authorization", f"Bearer {token}"), ("X-User-Tier", "pro"), ("X-User-Id", "someone")])
+    identity = asyncio.run(authenticator.identify(request))
+    assert (identity.user, identity.tier, identity.authenticated) == ("trial-user", "trial", True)
+
+    pro = make_request([("Authorization", f"Bearer {make_token(_session('pro-user'))}")])
+    assert asyncio.run(authenticator.identify(pro)).tier == "pro"
+    # Cached in shared state
+    asyncio.run(authenticator.identify(pro))
+    assert calls.count("/rest/v1/subscriptions") == 2
+
+
+@pytest.mark.parametrize("token", [
+    make_token(_session("u"), secret="wrong-secret"),
+    make_token({"sub": "u", "role": "authenticated", "exp": time.time() - 1}),
+    make_token({"role": "anon", "exp": time.time() + 3600}),
+    "not-a-jwt",
+])
+def test_invalid_tokens_are_rejected(supabase, token):
+    authenticator, _ = supabase
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(authenticator.identify(make_request([("Authorization", f"Bearer {token}")])))
+    assert exc.value.status_code == 401
+
+
+def test_anonymous_callers_are_trial_keyed_by_address(supabase):
+    authenticator, _ = supabase
+    identity = asyncio.run(authenticator.identify(make_request([("X-User-Tier", "pro")])))
+    assert (identity.user, identity.tier, identity.authenticated) == ("anon:203.0.113.7", "trial", False)
+
+
+def test_forwarded_for_only_trusted_from_configured_proxies(monkeypatch):
+    forwarded = [("X-Forwarded-For", "198.51.100.1, 198.51.100.2, 10.0.0.5")]
+    monkeypatch.setattr(auth, "TRUSTED_PROXIES", [])
+    assert auth.client_ip(make_request(forwarded, client=("10.0.0.9", 1))) == "10.0.0.9"
+    monkeypatch.setattr(auth, "TRUSTED_PROXIES", auth._parse_proxies("10.0.0.0/8"))
+    # Spoofed leftmost entries are ignored: the nearest untrusted hop is the client
+    assert auth.client_ip(make_request(forwarded, client=("10.0.0.9", 1))) == "198.51.100.2"
+    assert auth.client_ip(make_request(forwarded, client=("203.0.113.7", 1))) == "203.0.113.7"
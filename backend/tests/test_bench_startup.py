@@ -0,0 +1,26 @@
+import os
+import statistics
+
+import pytest
+
+import bench_startup
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_main_does_not_load_lazy_modules():
+    _, modules = bench_startup.measure_once(BACKEND_DIR)
+    assert "main" in modules
+    assert bench_startup.leaked_modules(modules) == []
+
+
+@pytest.mark.skipif(not os.getenv("STARTUP_BUDGET_TEST"),
+                    reason="wall-clock budget; set STARTUP_BUDGET_TEST=1 on a quiet machine")
+def test_import_main_within_budget():
+    timings = [bench_startup.measure_once(BACKEND_DIR)[0] / 1000.0 for _ in range(3)]
+    assert statistics.median(timings) <= bench_startup.DEFAULT_BUDGET_MS
+
+
+def test_leaked_modules_reports_top_level_packages():
+    modules = {"main": 1, "fastapi": 1, "numpy.core": 1, "PIL.Image": 1, "httpx": 1, "pandasx": 1}
+    assert bench_startup.leaked_modules(modules) == ["PIL", "httpx", "numpy"]
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+import main
+
+
+async def _call_app(app, scope, receive):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent
+
+
+def _post_ideas_scope(extra_headers=()):
+    body = json.dumps({"title": "disconnect test"}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    headers += list(extra_headers)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/ideas", "raw_path": b"/ideas", "query_string": b"",
+        "root_path": "", "headers": headers, "client": ("10.0.0.1", 5000), "server": ("testserver", 80),
+    }
+    return scope, body
+
+
+def test_client_disconnect_cancels_upstream_through_full_middleware_stack():
+    cancelled = []
+
+    async def hanging_upstream(request):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(request.url.host)
+            raise
+        return httpx.Response(200, json={})
+
+    async def run():
+        main.resources.http = httpx.AsyncClient(transport=httpx.MockTransport(hanging_upstream))
+        scope, body = _post_ideas_scope()
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.sleep(0.3)
+            return {"type": "http.disconnect"}
+
+        started = time.monotonic()
+        try:
+            sent = await _call_app(main.app, scope, receive)
+        finally:
+            await main.resources.http.aclose()
+            main.resources.http = None
+        return sent, time.monotonic() - started
+
+    sent, elapsed = asyncio.run(run())
+    assert elapsed < 2
+    assert cancelled == ["api.groq.com"]
+    start = next(m for m in sent if m["type"] == "http.response.start")
+    assert start["status"] == 499
+
+
+def test_deadline_header_cancels_upstream():
+    async def slow_upstream(request):
+        await asyncio.sleep(5)
+        return httpx.Response(200, json={})
+
+    async def run():
+        main.resources.http = httpx.AsyncClient(transport=httpx.MockTransport(slow_upstream))
+        scope, body = _post_ideas_scope([(b"x-request-timeout", b"0.3")])
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.sleep(10)
+            return {"type": "http.disconnect"}
+
+        started = time.monotonic()
+        try:
+            sent = await _call_app(main.app, scope, receive)
+        finally:
+            await main.resources.http.aclose()
+            main.resources.http = None
+        return sent, time.monotonic() - started
+
+    sent, elapsed = asyncio.run(run())
+    assert elapsed < 2
+    start = next(m for m in sent if m["type"] == "http.response.start")
+    assert start["status"] == 504
+
+
+async def _noop_send(message):
+    pass
+
+
+def _listener_scope(headers):
+    return {"type": "http", "method": "POST", "path": "/", "headers": headers}
+
+
+def test_listener_passes_body_through_without_reading_ahead():
+    from deadlines import DISCONNECT_SCOPE_KEY, DisconnectListener
+
+    chunks = [{"type": "http.request", "body": b"x" * 10, "more_body": i < 4} for i in range(5)]
+    pulled = []
+
+    async def receive():
+        if len(pulled) < len(chunks):
+            pulled.append(1)
+            return chunks[len(pulled) - 1]
+        await asyncio.sleep(0.05)
+        return {"type": "http.disconnect"}
+
+    async def app(scope, receive, send):
+        await receive()
+        await asyncio.sleep(0.1)
+        # The server was not drained while the app was busy
+        assert len(pulled) == 1
+        while (await receive()).get("more_body"):
+            pass
+        await asyncio.wait_for(scope[DISCONNECT_SCOPE_KEY].wait(), 1)
+
+    headers = [(b"transfer-encoding", b"chunked")]
+    asyncio.run(DisconnectListener(app)(_listener_scope(headers), receive, _noop_send))
+
+
+def test_listener_notices_disconnect_on_requests_without_a_body():
+    from deadlines import DISCONNECT_SCOPE_KEY, DisconnectListener
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}]
+
+    async def receive():
+        await asyncio.sleep(0.01)
+        return messages.pop(0)
+
+    async def app(scope, receive, send):
+        # Never reads the (empty) body
+        await asyncio.wait_for(scope[DISCONNECT_SCOPE_KEY].wait(), 1)
+
+    asyncio.run(DisconnectListener(app)({"type": "http", "headers": []}, receive, _noop_send))
+
+
+def test_oversized_bodies_are_refused():
+    from deadlines import DisconnectListener
+    from fastapi import FastAPI, Request
+
+    inner = FastAPI()
+
+    @inner.post("/")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    app = DisconnectListener(inner, max_body_bytes=100)
+
+    async def run(headers, chunks):
+        async def receive():
+            if chunks:
+                return chunks.pop(0)
+            await asyncio.sleep(1)
+            return {"type": "http.disconnect"}
+        scope = dict(_post_ideas_scope()[0], path="/", raw_path=b"/", headers=headers)
+        return await _call_app(app, scope, receive)
+
+    declared = asyncio.run(run([(b"content-length", b"1000")], []))
+    assert declared[0]["status"] == 413
+    streamed = asyncio.run(run([(b"transfer-encoding", b"chunked")],
+                               [{"type": "http.request", "body": b"x" * 60, "more_body": True}] * 2))
+    assert streamed[0]["status"] == 413
+    small = asyncio.run(run([(b"content-length", b"60")],
+                            [{"type": "http.request", "body": b"x" * 60, "more_body": False}]))
+    assert small[0]["status"] == 200
+
+
+def test_keyword_fallbacks_stop_at_the_request_deadline(monkeypatch):
+    from deadlines import DeadlineExceeded, RequestScope, current_scope
+
+    async def no_openrouter(query, count):
+        raise RuntimeError("unavailable")
+
+    monkeypatch.setattr(main, "get_openrouter_keywords", no_openrouter)
+    monkeypatch.setattr(main, "get_google_trends_keywords", lambda q, n: time.sleep(2) or [])
+
+    async def run():
+        current_scope.set(RequestScope(None, 0.3))
+        started = time.monotonic()
+        try:
+            await main._compute_keyword_analysis("slow query", 5)
+        except DeadlineExceeded:
+            return time.monotonic() - started
+
+    elapsed = asyncio.run(run())
+    assert elapsed is not None and elapsed < 1
+
+
+def test_upstream_timeout_raises_in_worker_threads_once_the_client_left():
+    from deadlines import ClientDisconnected, RequestScope, current_scope, upstream_timeout
+
+    class FakeRequest:
+        scope = {}
+
+    async def run():
+        scope = RequestScope(FakeRequest(), 30)
+        scope.disconnected = asyncio.Event()
+        current_scope.set(scope)
+        assert await asyncio.to_thread(upstream_timeout, 15) == 15
+        scope.disconnected.set()
+        try:
+            await asyncio.to_thread(upstream_timeout, 15)
+        except ClientDisconnected:
+            return True
+
+    assert asyncio.run(run())
@@ -0,0 +1,90 @@
+import pytest
+
+from response_cache import ResponseCache, canonical_terms, canonical_text, jaccard, shingles
+from shared_state import CounterBuffer, MemoryBackend
+
+BASE = "beginner guide to baking sourdough bread at home with a simple starter and no special equipment needed today"
+
+
+def _cache(threshold=0.85):
+    state = MemoryBackend()
+    counters = CounterBuffer(lambda: state)
+    return ResponseCache(lambda: state, lambda: counters, threshold=threshold)
+
+
+@pytest.fixture
+def cache():
+    return _cache()
+
+
+def test_canonical_text_ignores_case_punctuation_and_spacing():
+    assert canonical_text("  How To:  Bake BREAD!!! ") == "how to bake bread"
+    assert canonical_text(None) == ""
+
+
+def test_canonical_terms_ignore_order_case_and_duplicates():
+    assert canonical_terms(["Bread", "sourdough!", "bread", "  "]) == canonical_terms(["SOURDOUGH", "bread"])
+    assert canonical_terms(None) == []
+
+
+def test_cosmetic_differences_are_exact_hits(cache):
+    attrs = {"tone": "Balanced", "keywords": canonical_terms(["yeast", "Flour"])}
+    cache.store("script", attrs, "Bake Sourdough, at home!", {"script": ["a"]}, 1200)
+    same_attrs = {"keywords": canonical_terms(["flour", "YEAST"]), "tone": "Balanced"}
+    assert cache.lookup("script", same_attrs, "bake sourdough at home") == {"script": ["a"]}
+    assert cache.report()["exact_hits"] == 1
+
+
+def test_near_duplicate_above_the_threshold_is_served(cache):
+    similar = BASE.replace("today", "tonight")
+    assert jaccard(shingles(BASE), shingles(similar)) >= 0.85
+    cache.store("ideas", {}, BASE, ["idea"], 800)
+    assert cache.lookup("ideas", {}, similar) == ["idea"]
+    assert cache.report()["similar_hits"] == 1
+
+
+def test_near_duplicate_below_the_threshold_is_a_miss(cache):
+    different = BASE.replace("simple starter and no special equipment", "rye starter and a dutch oven")
+    assert jaccard(shingles(BASE), shingles(different)) < 0.85
+    cache.store("ideas", {}, BASE, ["idea"], 800)
+    assert cache.lookup("ideas", {}, different) is None
+    assert cache.report()["misses"] == 1
+
+
+def test_near_duplicates_need_the_same_attributes(cache):
+    cache.store("ideas", {"format": "shorts"}, BASE, ["idea"], 800)
+    assert cache.lookup("ideas", {"format": "long"}, BASE) is None
+    assert cache.lookup("groq_keywords", {"format": "shorts"}, BASE) is None
+
+
+def test_threshold_above_one_disables_near_duplicates():
+    cache = _cache(threshold=1.01)
+    cache.store("ideas", {}, BASE, ["idea"], 800)
+    assert cache.lookup("ideas", {}, BASE.replace("today", "tonight")) is None
+    assert cache.lookup("ideas", {}, BASE.upper()) == ["idea"]
+    assert cache.report()["indexed"] == 0
+
+
+def test_fresh_skips_the_cache_and_is_counted_separately(cache):
+    cache.store("ideas", {}, BASE, ["old"], 800)
+    assert cache.lookup("ideas", {}, BASE, fresh=True) is None
+    report = cache.report()
+    assert report["bypassed"] == 1 and report["lookups"] == 0
+    # The caller stores the fresh result, which later lookups get
+    cache.store("ideas", {}, BASE, ["new"], 900)
+    assert cache.lookup("ideas", {}, BASE) == ["new"]
+
+
+def test_report_counters(cache):
+    cache.store("ideas", {}, BASE, ["idea"], 800)
+    cache.lookup("ideas", {}, BASE)
+    cache.lookup("ideas", {}, BASE.replace("today", "tonight"))
+    cache.lookup("ideas", {}, "something else entirely")
+    cache.lookup("ideas", {}, BASE, fresh=True)
+    report = cache.report()
+    assert {k: report[k] for k in ("lookups", "exact_hits", "similar_hits", "misses", "bypassed")} == {
+        "lookups": 3, "exact_hits": 1, "similar_hits": 1, "misses": 1, "bypassed": 1,
+    }
+    assert report["saved_latency_ms"] == 1600
+    assert report["hit_ratio"] == round(2 / 3, 4)
+    assert report["similarity_threshold"] == 0.85 and report["indexed"] == 1
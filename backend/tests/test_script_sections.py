@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+INSTRUCTIONS = {title: instruction for title, (instruction, _) in main.SCRIPT_SECTIONS.items()}
+
+
+class FakeGroq:
+    """Answers section prompts after a short delay, failing chosen sections a number of times."""
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.attempts = {title: 0 for title in INSTRUCTIONS}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request):
+        prompt = json.loads(request.content)["messages"][0]["content"][0]["text"]
+        section = next(title for title, instruction in INSTRUCTIONS.items() if instruction in prompt)
+        self.attempts[section] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.1)
+        finally:
+            self.in_flight -= 1
+        if self.failures.get(section, 0) > 0:
+            self.failures[section] -= 1
+            return httpx.Response(503, text="overloaded")
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": f"{section} slide"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+        })
+
+
+@pytest.fixture
+def groq(monkeypatch):
+    def install(fake):
+        monkeypatch.setattr(main.resources, "http", httpx.AsyncClient(transport=httpx.MockTransport(fake)))
+        return fake
+    return install
+
+
+def _generate(**overrides):
+    body = {"topic": "sourdough for beginners", "mode": "sections", "fresh": True, **overrides}
+    return TestClient(main.app).post("/generate_script", json=body)
+
+
+def test_sections_are_generated_concurrently_and_keep_the_response_shape(groq):
+    fake = groq(FakeGroq())
+    resp = _generate()
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "outline": ["Hook", "SEO Tips", "Call to Action"],
+        "script": ["Hook slide", "SEO Tips slide", "Call to Action slide"],
+    }
+    assert fake.max_in_flight == 3
+
+
+def test_only_the_failed_section_is_retried(groq):
+    fake = groq(FakeGroq(failures={"SEO Tips": 1}))
+    resp = _generate(topic="retry topic")
+    assert resp.status_code == 200
+    assert resp.json()["script"][1] == "SEO Tips slide"
+    assert fake.attempts == {"Hook": 1, "SEO Tips": 2, "Call to Action": 1}
+
+
+def test_sections_that_keep_failing_are_reported(groq):
+    fake = groq(FakeGroq(failures={"Call to Action": 5}))
+    resp = _generate(topic="failing topic", includeHooks=False)
+    assert resp.status_code == 500
+    assert resp.json()["failed_sections"] == ["Call to Action"]
+    assert fake.attempts == {"Hook": 0, "SEO Tips": 1, "Call to Action": 1 + main.SCRIPT_SECTION_RETRIES}
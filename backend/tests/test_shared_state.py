@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from shared_state import CircuitBreaker, CounterBuffer, MemoryBackend, RedisBackend, SQLiteBackend, StateBackend
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "state.sqlite3"))
+    return RedisBackend(fakeredis.FakeRedis())
+
+
+def test_backends_must_implement_the_whole_interface():
+    class GetOnly(StateBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        StateBackend()
+    with pytest.raises(TypeError, match="take_token"):
+        GetOnly()
+
+
+def test_get_set_delete_and_expiry(backend):
+    backend.set("a", {"x": [1, 2]})
+    backend.set("b", 1, ttl=0.1)
+    assert backend.get("a") == {"x": [1, 2]}
+    assert backend.get("b") == 1
+    time.sleep(0.15)
+    assert backend.get("b") is None
+    backend.delete("a")
+    assert backend.get("a") is None
+
+
+def test_incr_ttl_only_applies_when_the_counter_is_created(backend):
+    assert backend.incr("quota", 5, ttl=0.3) == 5
+    time.sleep(0.2)
+    # Back to the initial value: must not look like a new counter and restart the TTL
+    assert backend.incr("quota", -5, ttl=0.3) == 0
+    assert backend.incr("quota", 5, ttl=0.3) == 5
+    time.sleep(0.15)
+    assert backend.get("quota") is None
+    assert backend.incr("quota", 2, ttl=0.3) == 2
+
+
+def test_redis_counters_never_exist_without_their_ttl():
+    client = fakeredis.FakeRedis()
+    backend = RedisBackend(client)
+    for _ in range(3):
+        backend.incr("window", 7, ttl=60)
+        assert 0 < client.pttl("thumbnail-analyzer:window") <= 60000
+    assert backend.get("window") == 21
+    backend.incr("plain")
+    assert client.pttl("thumbnail-analyzer:plain") == -1
+
+
+def test_reserve_slot_spaces_callers(backend):
+    assert backend.reserve_slot("slot", 1.0) == 0
+    assert 0.9 < backend.reserve_slot("slot", 1.0) <= 1.0
+    assert 1.9 < backend.reserve_slot("slot", 1.0) <= 2.0
+
+
+def test_take_token_bucket(backend):
+    assert backend.take_token("bucket", rate=1.0, capacity=2) == 0
+    assert backend.take_token("bucket", rate=1.0, capacity=2) == 0
+    wait = backend.take_token("bucket", rate=1.0, capacity=2)
+    assert 0.9 < wait <= 1.0
+
+
+def test_breaker_half_opens_for_a_single_trial(backend):
+    breaker = CircuitBreaker(backend, "upstream", failure_threshold=2, reset_timeout=0.2)
+    other_worker = CircuitBreaker(backend, "upstream", failure_threshold=2, reset_timeout=0.2)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state() == "open" and not other_worker.allow()
+
+    time.sleep(0.25)
+    assert breaker.state() == "half_open"
+    assert breaker.allow()
+    assert not other_worker.allow()
+    # Failed trial: open again at once, without another failure_threshold failures
+    breaker.record_failure()
+    assert breaker.state() == "open"
+
+    time.sleep(0.25)
+    assert other_worker.allow()
+    other_worker.record_success()
+    assert breaker.state() == "closed"
+    assert breaker.allow() and other_worker.allow()
+
+
+def test_breaker_trial_is_retried_if_its_caller_never_reports(backend):
+    breaker = CircuitBreaker(backend, "upstream", failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    time.sleep(0.15)
+    assert breaker.allow()
+    assert not breaker.allow()
+    time.sleep(0.15)
+    assert breaker.allow()
+
+
+def test_breaker_async_helpers_run_off_the_event_loop():
+    calls = []
+
+    class Recording(MemoryBackend):
+        def get(self, key):
+            calls.append(threading.current_thread())
+            return super().get(key)
+
+    breaker = CircuitBreaker(Recording(), "upstream", failure_threshold=1, reset_timeout=30)
+
+    async def run():
+        assert await breaker.allow_async()
+        await breaker.record_failure_async()
+        assert not await breaker.allow_async()
+        await breaker.record_success_async()
+
+    asyncio.run(run())
+    assert calls and threading.main_thread() not in calls
+
+
+def test_counter_buffer_batches_increments(backend):
+    counters = CounterBuffer(lambda: backend)
+    for _ in range(5):
+        counters.incr("stats:hits")
+    counters.incr("stats:saved_ms", 250)
+    assert backend.get("stats:hits") is None
+    assert counters.get("stats:hits") == 5
+    assert counters.flush() == 2
+    assert backend.get("stats:hits") == 5 and backend.get("stats:saved_ms") == 250
+    counters.incr("stats:hits")
+    assert counters.get("stats:hits") == 6
+    assert counters.flush() == 1 and counters.flush() == 0
@@ -0,0 +1,146 @@
+import asyncio
+import base64
+import io
+
+import httpx
+import pytest
+
+import thumbnail_fetch
+from thumbnail_fetch import ThumbnailCache, ThumbnailFetchError
+
+PUBLIC_IMAGE = "http://93.184.216.34/thumb.png"
+
+
+def _fetch_url(tmp_path, handler, url):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            return await ThumbnailCache(root=str(tmp_path)).fetch_url(http, url)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/admin",
+    "http://10.1.2.3/img.png",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/img.png",
+    "http://[::ffff:127.0.0.1]/img.png",
+    "file:///etc/passwd",
+])
+def test_non_public_urls_are_refused_before_any_request(tmp_path, url):
+    requests = []
+    with pytest.raises(ThumbnailFetchError) as exc:
+        _fetch_url(tmp_path, lambda request: requests.append(request) or httpx.Response(200), url)
+    assert exc.value.status_code == 400
+    assert requests == []
+
+
+def test_redirects_are_checked_on_every_hop(tmp_path):
+    hops = []
+
+    def handler(request):
+        hops.append(str(request.url))
+        return httpx.Response(302, headers={"location": "http://169.254.169.254/latest/meta-data/"})
+
+    with pytest.raises(ThumbnailFetchError) as exc:
+        _fetch_url(tmp_path, handler, PUBLIC_IMAGE)
+    assert exc.value.status_code == 400
+    assert hops == [PUBLIC_IMAGE]
+
+
+def test_body_is_streamed_with_a_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnail_fetch, "MAX_IMAGE_BYTES", 1024)
+    sent = []
+
+    async def body():
+        for _ in range(100):
+            sent.append(1)
+            yield b"x" * 512
+
+    handler = lambda request: httpx.Response(200, headers={"content-type": "image/png"}, content=body())
+    with pytest.raises(ThumbnailFetchError, match="too large"):
+        _fetch_url(tmp_path, handler, PUBLIC_IMAGE)
+    assert len(sent) < 100
+
+
+def test_upstream_status_is_not_echoed(tmp_path):
+    with pytest.raises(ThumbnailFetchError) as exc:
+        _fetch_url(tmp_path, lambda request: httpx.Response(503, text="internal details"), PUBLIC_IMAGE)
+    assert exc.value.status_code == 502
+    assert "503" not in str(exc.value) and "93.184.216.34" not in str(exc.value)
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "P", "LA"])
+def test_encode_jpeg_accepts_alpha_and_palette_images(mode):
+    from PIL import Image
+
+    import main
+
+    buffered = io.BytesIO()
+    Image.new(mode, (8, 8)).save(buffered, format="PNG")
+    encoded = main._encode_jpeg_base64(buffered.getvalue())
+    assert Image.open(io.BytesIO(base64.b64decode(encoded))).format == "JPEG"
+
+
+def test_public_redirect_is_followed_and_cached(tmp_path):
+    def handler(request):
+        if request.url.path == "/thumb.png":
+            return httpx.Response(301, headers={"location": "http://93.184.216.35/final.png"})
+        return httpx.Response(200, headers={"content-type": "image/png", "etag": '"v1"'}, content=b"png-bytes")
+
+    assert _fetch_url(tmp_path, handler, PUBLIC_IMAGE) == b"png-bytes"
+    # Served from the cache without touching the network
+    assert _fetch_url(tmp_path, lambda request: httpx.Response(500), PUBLIC_IMAGE) == b"png-bytes"
+
+
+def test_connection_is_pinned_to_the_checked_address(tmp_path, monkeypatch):
+    answers = [["93.184.216.34"], ["127.0.0.1"]]
+    lookups = []
+
+    async def resolve(host, port):
+        lookups.append(host)
+        return answers[len(lookups) - 1]
+
+    monkeypatch.setattr(thumbnail_fetch, "_resolve", resolve)
+    seen = []
+
+    def handler(request):
+        seen.append((request.url.host, request.headers["host"], request.extensions.get("sni_hostname")))
+        return httpx.Response(200, headers={"content-type": "image/png"}, content=b"png")
+
+    assert _fetch_url(tmp_path, handler, "https://img.example.com/a.png") == b"png"
+    # One lookup, and the request went to the address that passed the check
+    assert lookups == ["img.example.com"]
+    assert seen == [("93.184.216.34", "img.example.com", "img.example.com")]
+
+
+def test_fetch_is_cancelled_at_the_request_deadline(tmp_path):
+    from deadlines import DeadlineExceeded, RequestScope, current_scope
+
+    async def handler(request):
+        await asyncio.sleep(5)
+        return httpx.Response(200, headers={"content-type": "image/png"}, content=b"png")
+
+    async def run():
+        current_scope.set(RequestScope(None, 0.2))
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            return await ThumbnailCache(root=str(tmp_path)).fetch_url(http, PUBLIC_IMAGE)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(asyncio.wait_for(run(), 2))
+
+
+def test_eviction_keeps_a_running_total_instead_of_listing_the_directory(tmp_path, monkeypatch):
+    cache = ThumbnailCache(root=str(tmp_path), max_bytes=250)
+    listings = []
+    real_listdir = thumbnail_fetch.os.listdir
+    monkeypatch.setattr(thumbnail_fetch.os, "listdir", lambda path: listings.append(path) or real_listdir(path))
+
+    for i in range(5):
+        cache._store(f"http://img/{i}", b"x" * 100, {"fetched_at": 0})
+    cache._hit("http://img/3")
+    cache._store("http://img/5", b"x" * 100, {"fetched_at": 0})
+
+    assert len(listings) == 1
+    stored = sorted(name for name in real_listdir(str(tmp_path)) if name.endswith(".img"))
+    assert stored == sorted(cache._paths(f"http://img/{i}")[0].rsplit("/", 1)[1] for i in (3, 5))
+    assert cache._total == 200 and cache.stats["evictions"] == 4
@@ -0,0 +1,100 @@
+import io
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+import thumbnail_metrics
+from thumbnail_metrics import COMPARE_SIZE, decode_batch, rank_batch
+
+
+def _png(pixels: np.ndarray) -> bytes:
+    buffered = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def _flat(value=128) -> bytes:
+    return _png(np.full((90, 160, 3), value))
+
+
+def _busy() -> bytes:
+    # Saturated colour blocks with hard edges: contrast, colour and sharpness all score high
+    rng = np.random.default_rng(0)
+    blocks = rng.integers(0, 2, size=(9, 16, 3)) * 255
+    return _png(np.kron(blocks, np.ones((10, 10, 1))))
+
+
+def test_decode_batch_maps_errors_to_input_indexes():
+    batch, errors = decode_batch([_flat(), b"not an image", _busy(), b""])
+    assert batch.shape == (2, COMPARE_SIZE[1], COMPARE_SIZE[0], 3)
+    assert batch.dtype == np.float32
+    assert set(errors) == {1, 3}
+    assert all(isinstance(message, str) and message for message in errors.values())
+
+
+def test_decode_batch_with_only_bad_images_returns_an_empty_batch():
+    batch, errors = decode_batch([b"x", b"y"])
+    assert batch.shape == (0, COMPARE_SIZE[1], COMPARE_SIZE[0], 3)
+    assert set(errors) == {0, 1}
+
+
+def test_decode_pool_is_created_on_first_use(monkeypatch):
+    monkeypatch.setattr(thumbnail_metrics, "_decode_pool", None)
+    decode_batch([_flat()])
+    pool = thumbnail_metrics._decode_pool
+    assert pool is not None
+    decode_batch([_flat()])
+    assert thumbnail_metrics._decode_pool is pool
+
+
+def test_rank_batch_puts_the_busier_thumbnail_first():
+    batch, _ = decode_batch([_flat(), _busy(), _flat(20)])
+    order, metrics, scores = rank_batch(batch)
+    assert order.tolist()[0] == 1
+    assert scores[1] > scores[0] > scores[2]
+    assert np.all((scores >= 0) & (scores <= 100))
+    assert set(metrics) == {"brightness", "contrast", "colorfulness", "sharpness", "edge_density"}
+
+
+def test_rank_batch_keeps_upload_order_for_ties():
+    batch, _ = decode_batch([_flat(), _flat(), _flat()])
+    order, _, _ = rank_batch(batch)
+    assert order.tolist() == [0, 1, 2]
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def _files(*blobs, content_type="image/png"):
+    return [("images", (f"{i}.png", blob, content_type)) for i, blob in enumerate(blobs)]
+
+
+def test_compare_ranks_uploads(client):
+    resp = client.post("/thumbnail/compare", files=_files(_flat(), _busy()))
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["count"] == 2 and body["top_k"] == 0
+    assert [entry["filename"] for entry in body["ranking"]] == ["1.png", "0.png"]
+
+
+@pytest.mark.parametrize("files, message", [
+    (_files(_flat()), "at least two images"),
+    (_files(_flat(), _flat(), content_type="text/plain"), "must be an image"),
+    (_files(_flat(), b"garbage"), "Invalid image(s): '1.png'"),
+])
+def test_compare_rejects_bad_input(client, files, message):
+    resp = client.post("/thumbnail/compare", files=files)
+    assert resp.status_code == 400
+    assert message in resp.json()["detail"]
+
+
+def test_compare_rejects_too_many_images(client, monkeypatch):
+    monkeypatch.setattr(thumbnail_metrics, "MAX_COMPARE_IMAGES", 2)
+    resp = client.post("/thumbnail/compare", files=_files(_flat(), _flat(), _flat()))
+    assert resp.status_code == 400
+    assert "At most 2 images" in resp.json()["detail"]
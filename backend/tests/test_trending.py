@@ -0,0 +1,132 @@
+import asyncio
+
+import pandas as pd
+
+import trending
+from shared_state import CircuitBreaker, MemoryBackend
+from trending import TrendingDigest
+
+
+class FakeTrendReq:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def trending_searches(self, pn):
+        self.calls.append("trending_searches")
+        if self.fail:
+            raise RuntimeError("429")
+        return pd.DataFrame({0: ["minecraft update", "gaming setup"]})
+
+    def build_payload(self, kw_list, **kwargs):
+        self.calls.append("build_payload")
+        if self.fail:
+            raise RuntimeError("429")
+        self.seed = kw_list[0]
+
+    def related_queries(self):
+        self.calls.append("related_queries")
+        return {self.seed: {"top": pd.DataFrame({"query": [f"{self.seed} tips"]})}}
+
+
+class NoStore:
+    def load_related(self, seed, max_age=None):
+        return None
+
+    def save_related(self, seed, timeframe, terms):
+        pass
+
+
+def _digest(state, clients, paced, seeds, fail=False):
+    def factory():
+        clients.append(FakeTrendReq(fail=fail))
+        return clients[-1]
+    return TrendingDigest(lambda: state, factory, NoStore, lambda: CircuitBreaker(state, "google_trends"),
+                          lambda: paced.append(1), seeds=seeds)
+
+
+def test_digest_uses_its_own_client_and_paces_every_call(monkeypatch):
+    monkeypatch.setattr(trending, "TRENDING_SEED_DELAY", 0)
+    state, clients, paced = MemoryBackend(), [], []
+    digest = _digest(state, clients, paced, ["gaming", "music"])
+    assert asyncio.run(digest.refresh())
+    assert len(clients) == 1
+    assert len(paced) == len(clients[0].calls) == 5
+    assert digest.related_for("music") == ["music tips"]
+    # The client is reused by later refreshes
+    digest._fetch()
+    assert len(clients) == 1
+
+
+def test_digest_stops_querying_while_the_shared_circuit_is_open(monkeypatch):
+    monkeypatch.setattr(trending, "TRENDING_SEED_DELAY", 0)
+    state, clients, paced = MemoryBackend(), [], []
+    digest = _digest(state, clients, paced, [f"seed {i}" for i in range(10)], fail=True)
+    assert not asyncio.run(digest.refresh())
+    failing = clients[0]
+    # Five failures open the breaker; the remaining seeds are not queried
+    assert failing.calls.count("build_payload") == 4
+    assert not CircuitBreaker(state, "google_trends").allow()
+
+
+def _snapshot_digest(trending_terms, related):
+    digest = TrendingDigest(lambda: MemoryBackend(), None, None, None, None, seeds=list(related))
+    digest.snapshot = dict(trending._empty_snapshot(), trending=trending_terms, related=related)
+    return digest
+
+
+def test_keywords_for_ignores_stop_word_overlap():
+    digest = _snapshot_digest(["how to watch the game", "best phones 2024"], {"cooking": ["easy recipes"]})
+    assert digest.keywords_for("how to knit the best scarf", 5) == []
+    assert [k["keyword"] for k in digest.keywords_for("new phones", 5)] == ["best phones 2024"]
+
+
+def test_keywords_for_matches_seed_terms_in_the_query():
+    digest = _snapshot_digest([], {"tech review": ["iphone review"], "cooking": ["easy recipes"]})
+    assert [k["keyword"] for k in digest.keywords_for("Cooking", 5)] == ["easy recipes"]
+    assert [k["keyword"] for k in digest.keywords_for("budget tech review 2024", 5)] == ["iphone review"]
+    # Half a seed is not the seed
+    assert digest.keywords_for("tech news", 5) == []
+
+
+def test_refresh_requeries_related_older_than_the_refresh_interval(tmp_path, monkeypatch):
+    from trends_store import TrendsStore
+    monkeypatch.setattr(trending, "TRENDING_SEED_DELAY", 0)
+    store = TrendsStore(str(tmp_path))
+    store.save_related("gaming", "now 7-d", ["old gaming query"])
+    meta = store._load_meta("gaming")
+    meta["related"]["fetched_at"] -= trending.TRENDING_REFRESH_INTERVAL
+    store._save_meta("gaming", meta)
+    # Still fresh for the store's own 24h TTL
+    assert store.load_related("gaming")
+
+    state, clients = MemoryBackend(), []
+    digest = TrendingDigest(lambda: state, lambda: clients.append(FakeTrendReq()) or clients[-1], lambda: store,
+                            lambda: CircuitBreaker(state, "google_trends"), lambda: None, seeds=["gaming"])
+    assert asyncio.run(digest.refresh())
+    assert clients[0].calls.count("related_queries") == 1
+    assert digest.related_for("gaming") == ["gaming tips"]
+
+
+def test_keyword_fallback_prefers_exact_sources_over_the_digest(monkeypatch):
+    import main
+
+    async def no_openrouter(query, count):
+        raise RuntimeError("OPENROUTER_API_KEY environment variable not set")
+
+    sources = []
+    digest = _snapshot_digest(["minecraft update"], {})
+    monkeypatch.setattr(main.resources, "trending", digest)
+    monkeypatch.setattr(main, "get_openrouter_keywords", no_openrouter)
+    monkeypatch.setattr(main, "get_google_trends_keywords",
+                        lambda q, n: sources.append("trends") or [{"keyword": "minecraft mods", "source": "google_trends"}])
+    monkeypatch.setattr(main, "get_groq_keywords", lambda q, n, fresh=False: sources.append("groq") or [])
+    result = asyncio.run(main._compute_keyword_analysis("minecraft mods", 5))
+    assert sources == ["trends"]
+    assert [k["keyword"] for k in result["keywords"]] == ["minecraft mods"]
+
+    # Digest only when the exact-query sources come up empty
+    monkeypatch.setattr(main, "get_google_trends_keywords", lambda q, n: sources.append("trends") or [])
+    result = asyncio.run(main._compute_keyword_analysis("minecraft mods", 5))
+    assert sources == ["trends", "trends", "groq"]
+    assert [k["source"] for k in result["keywords"]] == ["trending_digest"]
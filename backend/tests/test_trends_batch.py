@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+import main
+from trends_store import TrendsStore
+
+
+class SlowTrendReq:
+    """Blocks like the real client does while it talks to Google."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def build_payload(self, terms, **kwargs):
+        time.sleep(0.3)
+        self.payloads.append(list(terms))
+
+    def interest_over_time(self):
+        terms = self.payloads[-1]
+        index = pd.date_range(end=pd.Timestamp.today().normalize() - pd.Timedelta(days=1), periods=30, freq="D")
+        return pd.DataFrame({term: [50 + i] * len(index) for i, term in enumerate(terms)}, index=index)
+
+
+@pytest.fixture
+def fake_trends(tmp_path, monkeypatch):
+    client = SlowTrendReq()
+    monkeypatch.setattr(main.resources, "pytrends", client)
+    monkeypatch.setattr(main.resources, "trends_store", TrendsStore(root=str(tmp_path)))
+    return client
+
+
+def test_batch_fetch_does_not_block_the_event_loop(fake_trends):
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        result = await main.get_trends_data_batch(["alpha", "beta", "gamma", "delta"], anchor="tutorial")
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert result["requests_made"] == 1
+    assert fake_trends.payloads == [["alpha", "beta", "gamma", "delta", "tutorial"]]
+    assert result["results"]["alpha"]["relative_interest"] is not None
+    # The loop kept running while build_payload slept in a worker thread
+    assert ticks >= 8
+
+
+def test_single_keyword_fetch_does_not_block_the_event_loop(fake_trends):
+    async def run():
+        started = time.monotonic()
+        lag = []
+
+        async def probe():
+            await asyncio.sleep(0.05)
+            lag.append(time.monotonic() - started)
+
+        await asyncio.gather(main.get_trends_data("alpha"), probe())
+        return lag[0]
+
+    assert asyncio.run(run()) < 0.2
+    assert fake_trends.payloads[0] == ["alpha"]
+
+
+class ScaledTrendReq:
+    """Like Google: every payload is rescaled so its own peak term reads 100."""
+
+    TRUE_INTEREST = {"tutorial": 50, "alpha": 20, "beta": 80, "gamma": 30, "delta": 10, "epsilon": 20, "zeta": 5}
+
+    def __init__(self):
+        self.payloads = []
+
+    def build_payload(self, terms, **kwargs):
+        self.payloads.append(list(terms))
+
+    def interest_over_time(self):
+        terms = self.payloads[-1]
+        scale = 100.0 / max(self.TRUE_INTEREST[term] for term in terms)
+        index = pd.date_range(end=pd.Timestamp.today().normalize() - pd.Timedelta(days=1), periods=30, freq="D")
+        return pd.DataFrame({term: [self.TRUE_INTEREST[term] * scale] * len(index) for term in terms}, index=index)
+
+
+def test_values_from_different_batch_groups_agree_through_the_anchor(tmp_path, monkeypatch):
+    client = ScaledTrendReq()
+    monkeypatch.setattr(main.resources, "pytrends", client)
+    monkeypatch.setattr(main.resources, "trends_store", TrendsStore(root=str(tmp_path)))
+    keywords = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta"]
+
+    result = asyncio.run(main.get_trends_data_batch(keywords, anchor="tutorial"))
+    assert client.payloads == [["alpha", "beta", "gamma", "delta", "tutorial"], ["epsilon", "zeta", "tutorial"]]
+    relative = {kw: entry["relative_interest"] for kw, entry in result["results"].items()}
+    # alpha and epsilon share a true interest, but Google scaled their payloads differently
+    # (x1.25 with beta as the peak, x2 with the anchor as the peak); relative to the anchor they agree
+    assert relative["alpha"] == relative["epsilon"] == 40.0
+    assert relative["beta"] == 160.0
+    assert relative["zeta"] == 10.0
@@ -0,0 +1,102 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import trends_store
+from trends_store import HISTORY_DAYS, OVERLAP_DAYS, TrendsStore, day_number
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TrendsStore(root=str(tmp_path))
+
+
+def _days(start: date, count: int) -> np.ndarray:
+    return np.arange(day_number(start), day_number(start) + count, dtype="<i8")
+
+
+def _age_check(store, keyword, seconds):
+    meta = store._load_meta(keyword)
+    meta["checked_at"] = time.time() - seconds
+    store._save_meta(keyword, meta)
+
+
+def test_missing_range_for_an_unknown_keyword_is_the_full_history(store):
+    today = date(2024, 6, 1)
+    assert store.missing_range("new", today) == (today - timedelta(days=HISTORY_DAYS), today)
+
+
+def test_missing_range_is_none_while_recently_checked(store):
+    today = date.today()
+    store.merge("kw", _days(today - timedelta(days=40), 20), np.full(20, 50, dtype="<f4"))
+    assert store.missing_range("kw", today) is None
+
+
+def test_missing_range_refetches_from_before_the_last_stored_day(store):
+    today = date(2024, 6, 1)
+    last = today - timedelta(days=10)
+    store.merge("kw", _days(last - timedelta(days=19), 20), np.full(20, 50, dtype="<f4"))
+    _age_check(store, "kw", trends_store.REFRESH_INTERVAL + 1)
+    assert store.missing_range("kw", today) == (last - timedelta(days=OVERLAP_DAYS), today)
+    # Up to yesterday is as complete as Google gets, even when the check is old
+    store.merge("up to date", _days(today - timedelta(days=20), 20), np.full(20, 50, dtype="<f4"))
+    _age_check(store, "up to date", trends_store.REFRESH_INTERVAL + 1)
+    assert store.missing_range("up to date", today) is None
+
+
+def test_merge_rescales_the_new_window_by_the_median_overlap_ratio(store):
+    start = date(2024, 1, 1)
+    store.merge("kw", _days(start, 10), np.full(10, 40, dtype="<f4"))
+    # Google scaled the new request differently: the same days read 2x; one zero day is ignored
+    new_values = np.full(10, 80, dtype="<f4")
+    new_values[0] = 0
+    new_values[1] = 70
+    merged = store.merge("kw", _days(start + timedelta(days=5), 10), new_values)
+
+    assert merged["day"].tolist() == _days(start, 15).tolist()
+    # Stored days keep their values; appended days are brought onto the stored scale
+    assert merged["value"][:10].tolist() == [40] * 10
+    assert merged["value"][10:].tolist() == [40] * 5
+    assert store.load_series("kw")["value"].tolist() == merged["value"].tolist()
+
+
+def test_merge_without_overlap_appends_unscaled(store):
+    start = date(2024, 1, 1)
+    store.merge("kw", _days(start, 5), np.full(5, 40, dtype="<f4"))
+    merged = store.merge("kw", _days(start + timedelta(days=20), 5), np.full(5, 90, dtype="<f4"))
+    assert merged["value"].tolist() == [40] * 5 + [90] * 5
+
+
+def test_summarize_many_computes_mean_and_trend_per_keyword(store):
+    start = date(2024, 1, 1)
+    store.merge("rising", _days(start, 30), np.linspace(10, 90, 30).astype("<f4"))
+    store.merge("flat", _days(start, 10), np.full(10, 50, dtype="<f4"))
+    store.merge("falling", _days(start, 20), np.linspace(90, 10, 20).astype("<f4"))
+
+    summaries = store.summarize_many(["rising", "flat", "falling", "unknown"])
+    assert set(summaries) == {"rising", "flat", "falling"}
+    assert summaries["rising"]["trend"] == "up" and summaries["rising"]["avg_interest"] == 50
+    assert summaries["flat"]["trend"] == "stable" and summaries["flat"]["avg_interest"] == 50
+    assert summaries["falling"]["trend"] == "down"
+    assert summaries["flat"] == store.summary("flat")
+
+
+def test_summarize_many_only_looks_at_the_window(store):
+    start = date(2024, 1, 1)
+    values = np.concatenate([np.full(20, 100), np.full(10, 20)]).astype("<f4")
+    store.merge("kw", _days(start, 30), values)
+    assert store.summarize_many(["kw"], window_days=10)["kw"]["avg_interest"] == 20
+
+
+def test_concurrent_writes_of_one_keyword_from_threads(store):
+    def write(i):
+        store.merge("shared", _days(date(2024, 1, 1), 10), np.full(10, 50, dtype="<f4"))
+        store.save_related("shared", "now 7-d", [f"q{i}"])
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(write, range(40)))
+    assert len(store.load_series("shared")) == 10
+    assert store.load_related("shared")["top"][0].startswith("q")
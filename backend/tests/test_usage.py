@@ -0,0 +1,111 @@
+import sqlite3
+
+import pytest
+
+import usage
+from usage import UsageTracker
+
+SCOUT = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    return UsageTracker(db_path=str(tmp_path / "usage.sqlite3"))
+
+
+def _rows(tracker):
+    with sqlite3.connect(tracker.db_path) as conn:
+        return conn.execute("SELECT route, user, total_tokens, ok FROM usage ORDER BY ts").fetchall()
+
+
+def test_cost_uses_per_million_prompt_and_completion_prices(tracker):
+    assert tracker.cost(SCOUT, 1_000_000, 0) == pytest.approx(0.11)
+    assert tracker.cost(SCOUT, 2000, 1000) == pytest.approx((2000 * 0.11 + 1000 * 0.34) / 1_000_000)
+    assert tracker.cost("unknown-model", 5000, 5000) == 0.0
+
+
+def test_prices_can_be_overridden_from_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("USAGE_PRICES_JSON", '{"custom": [1.0, 2.0], "llama3-8b-8192": [0, 0]}')
+    tracker = UsageTracker(db_path=str(tmp_path / "usage.sqlite3"))
+    assert tracker.cost("custom", 1_000_000, 1_000_000) == pytest.approx(3.0)
+    assert tracker.cost("llama3-8b-8192", 1_000_000, 0) == 0.0
+    assert tracker.cost(SCOUT, 1_000_000, 0) == pytest.approx(0.11)
+
+
+def test_record_fills_in_defaults_and_totals(tracker):
+    record = tracker.record("ideas", SCOUT, None, {"prompt_tokens": 30, "completion_tokens": 12}, 250.0)
+    assert record["user"] == "anonymous"
+    assert record["total_tokens"] == 42
+    assert record["cost_usd"] == pytest.approx(tracker.cost(SCOUT, 30, 12))
+    empty = tracker.record("", "", "u1", None, 10.0, ok=False)
+    assert (empty["route"], empty["model"], empty["total_tokens"], empty["ok"]) == ("unknown", "unknown", 0, False)
+
+
+def test_report_aggregates_by_route_model_and_user(tracker):
+    tracker.record("ideas", SCOUT, "alice", {"prompt_tokens": 100, "completion_tokens": 50}, 500.0)
+    tracker.record("ideas", SCOUT, "bob", {"prompt_tokens": 10, "completion_tokens": 10}, 100.0, ok=False)
+    tracker.record("script", "llama3-8b-8192", "alice", {"total_tokens": 400, "completion_tokens": 300}, 1000.0)
+
+    report = tracker.report(top_users=1)
+    ideas = report["routes"]["ideas"]
+    assert (ideas["calls"], ideas["errors"], ideas["total_tokens"]) == (2, 1, 170)
+    assert ideas["avg_latency_ms"] == 300.0
+    assert ideas["avg_completion_tokens"] == 30.0
+    assert ideas["completion_tokens_per_second"] == 100.0
+    assert ideas["max_completion_tokens"] == 50
+    assert "latency_ms" not in ideas
+    assert report["models"]["llama3-8b-8192"]["total_tokens"] == 400
+    assert [u["user"] for u in report["top_users"]] == ["alice"]
+    assert report["top_users"][0]["total_tokens"] == 550
+    assert report["pending_flush"] == 3
+    assert report["tokens_per_second"] == round(570 / usage.THROUGHPUT_WINDOW, 2)
+
+
+def test_flush_writes_in_batches(tracker, monkeypatch):
+    monkeypatch.setattr(usage, "FLUSH_BATCH", 3)
+    for i in range(7):
+        tracker.record("ideas", SCOUT, f"user{i}", {"total_tokens": i}, 10.0)
+
+    batches = []
+    real_connect = tracker._connect
+
+    class Recording:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def __enter__(self):
+            return self.conn.__enter__()
+
+        def __exit__(self, *exc):
+            return self.conn.__exit__(*exc)
+
+        def executemany(self, sql, rows):
+            batches.append(len(rows))
+            return self.conn.executemany(sql, rows)
+
+        def close(self):
+            self.conn.close()
+
+    monkeypatch.setattr(tracker, "_connect", lambda: Recording(real_connect()))
+    assert tracker.flush() == 7
+    assert batches == [3, 3, 1]
+    assert [row[1] for row in _rows(tracker)] == [f"user{i}" for i in range(7)]
+    assert tracker.report()["pending_flush"] == 0
+    assert tracker.flush() == 0
+
+
+def test_failed_flush_keeps_records_in_order(tracker, tmp_path):
+    tracker.record("ideas", SCOUT, "a", {"total_tokens": 1}, 10.0)
+    tracker.record("ideas", SCOUT, "b", {"total_tokens": 2}, 10.0)
+    good_path = tracker.db_path
+    blocker = tmp_path / "not-a-dir"
+    blocker.write_text("")
+    tracker.db_path = str(blocker / "usage.sqlite3")
+    assert tracker.flush() == 0
+    assert tracker.report()["pending_flush"] == 2
+
+    tracker.db_path = good_path
+    tracker.record("ideas", SCOUT, "c", {"total_tokens": 3}, 10.0)
+    assert tracker.flush() == 3
+    assert [row[1] for row in _rows(tracker)] == ["a", "b", "c"]
+    assert tracker.persisted_by_route()["ideas"]["total_tokens"] == 6
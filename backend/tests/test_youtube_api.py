@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+import pytest
+
+from youtube_api import MAX_IDS_PER_CALL, YouTubeAPIError, YouTubeClient
+
+
+class FakeYouTube:
+    """Stand-in for the Data API: every search returns its own list of video ids."""
+
+    def __init__(self, searches):
+        self.searches = searches
+        self.calls = []
+
+    def __call__(self, request):
+        path = request.url.path.rsplit("/", 1)[-1]
+        params = request.url.params
+        self.calls.append((path, params.get("id", params.get("q")), request.headers.get("if-none-match")))
+        if path == "search":
+            if request.headers.get("if-none-match") == '"search-v1"':
+                return httpx.Response(304)
+            items = [{"id": {"videoId": vid}, "snippet": {"title": vid, "channelId": f"ch-{vid[-1]}"}}
+                     for vid in self.searches[params["q"]]]
+            return httpx.Response(200, json={"items": items}, headers={"etag": '"search-v1"'})
+        ids = params["id"].split(",")
+        if path == "videos":
+            items = [{"id": vid, "statistics": {"viewCount": "1500"}} for vid in ids]
+        else:
+            items = [{"id": cid, "statistics": {"subscriberCount": "2000000"}} for cid in ids]
+        return httpx.Response(200, json={"items": items})
+
+
+def _client(api):
+    return YouTubeClient(httpx.AsyncClient(transport=httpx.MockTransport(api)), api_key="test-key")
+
+
+def test_concurrent_searches_share_batched_id_lookups():
+    api = FakeYouTube({
+        "a": [f"video{i:06d}" for i in range(40)],
+        "b": [f"video{i:06d}" for i in range(20, 75)],
+    })
+    client = _client(api)
+
+    async def run():
+        return await asyncio.gather(client.search_videos("a", 50), client.search_videos("b", 50))
+
+    first, second = asyncio.run(run())
+    assert len(first) == 40 and len(second) == 55
+    assert first[0]["views"] == "1.5K" and first[0]["subscriberCount"] == "2.0M"
+    video_batches = [ids.split(",") for path, ids, _ in api.calls if path == "videos"]
+    requested = [vid for batch in video_batches for vid in batch]
+    # 75 distinct ids, each fetched once, in calls of at most 50
+    assert len(requested) == len(set(requested)) == 75
+    assert all(len(batch) <= MAX_IDS_PER_CALL for batch in video_batches)
+    assert len(video_batches) == 2
+    channel_batches = [path for path, _, _ in api.calls if path == "channels"]
+    assert len(channel_batches) == 1
+
+
+def test_stale_search_is_revalidated_with_its_etag():
+    api = FakeYouTube({"a": ["video000001"]})
+    client = _client(api)
+
+    async def run():
+        first = await client.search_videos("a")
+        for entry in client._responses.values():
+            entry["ts"] -= 3600  # expire everything
+        return first, await client.search_videos("a")
+
+    first, second = asyncio.run(run())
+    assert first == second
+    searches = [etag for path, _, etag in api.calls if path == "search"]
+    assert searches == [None, '"search-v1"']
+    assert client.stats["revalidated"] == 1
+
+
+@pytest.mark.parametrize("error", [httpx.ConnectError("refused"), httpx.ReadTimeout("slow")])
+def test_transport_errors_become_bad_gateway(error):
+    def handler(request):
+        raise error
+
+    with pytest.raises(YouTubeAPIError) as exc:
+        asyncio.run(_client(handler).search_videos("a"))
+    assert exc.value.status_code == 502
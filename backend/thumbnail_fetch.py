@@ -0,0 +1,335 @@
+"""
+Server-side thumbnail fetching for the analysis endpoints.
+
+Images are fetched by YouTube video id (maxresdefault with fallbacks) or by URL
+and kept in a bounded on-disk cache keyed by URL. Stale entries are
+revalidated with conditional GETs (If-None-Match / If-Modified-Since), so a
+re-analysis of the same thumbnail usually costs a 304 or nothing at all.
+
+Caller-supplied URLs may only reach public addresses: the host is resolved
+and checked before the request and again on every redirect hop, and the
+connection goes to the address that was checked (Host header and TLS name stay
+the original host), so a second DNS answer can't redirect it. Bodies are
+streamed and abandoned as soon as they exceed MAX_IMAGE_BYTES.
+
+Disk work runs in worker threads. The cache keeps a running size total and an
+LRU index instead of listing the directory on every download; the index is
+rebuilt from disk every RESCAN_EVERY stores to pick up other workers' files.
+"""
+import asyncio
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urljoin, urlparse
+
+from deadlines import ClientDisconnected, DeadlineExceeded, guard, upstream_timeout
+
+THUMBNAIL_CACHE_DIR = os.getenv(
+    "THUMBNAIL_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "thumbnails")
+)
+THUMBNAIL_CACHE_MAX_BYTES = int(float(os.getenv("THUMBNAIL_CACHE_MAX_MB", "200")) * 1024 * 1024)
+# Cached images younger than this are used without revalidation
+THUMBNAIL_FRESH_TTL = int(os.getenv("THUMBNAIL_FRESH_TTL", "3600"))
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_REDIRECTS = 5
+FETCH_TIMEOUT = 15.0
+RESCAN_EVERY = 100
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+YOUTUBE_THUMBNAIL_BASE = os.getenv("YOUTUBE_THUMBNAIL_BASE", "https://i.ytimg.com/vi").rstrip("/")
+# Best first; not every video has maxresdefault
+THUMBNAIL_VARIANTS = ("maxresdefault", "sddefault", "hqdefault", "mqdefault")
+
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+class ThumbnailFetchError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_video_id(value: str) -> str:
+    """Accept a bare video id or a youtube.com / youtu.be URL and return the id."""
+    value = (value or "").strip()
+    if _VIDEO_ID_RE.match(value):
+        return value
+    parsed = urlparse(value)
+    host = (parsed.hostname or "").lower()
+    candidate = None
+    if host.endswith("youtu.be"):
+        candidate = parsed.path.lstrip("/").split("/")[0]
+    elif host.endswith("youtube.com"):
+        if parsed.path == "/watch":
+            candidate = parse_qs(parsed.query).get("v", [None])[0]
+        elif parsed.path.startswith(("/shorts/", "/embed/", "/live/")):
+            candidate = parsed.path.split("/")[2]
+    if candidate and _VIDEO_ID_RE.match(candidate):
+        return candidate
+    raise ThumbnailFetchError(400, f"Invalid YouTube video id: {value!r}")
+
+
+def _parse_image_url(url: str):
+    parsed = urlparse((url or "").strip())
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ThumbnailFetchError(400, "Invalid image URL")
+    return parsed
+
+
+async def _resolve(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+async def ensure_public_url(url: str):
+    """
+    Resolve the URL's host and return the address to connect to. Rejects hosts
+    with any private, loopback, link-local or otherwise non-public address.
+    """
+    parsed = _parse_image_url(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        resolved = await _resolve(parsed.hostname, port)
+    except (OSError, UnicodeError):
+        raise ThumbnailFetchError(400, "Image host could not be resolved")
+    if not resolved:
+        raise ThumbnailFetchError(400, "Image host could not be resolved")
+    addresses = []
+    for raw in resolved:
+        address = ipaddress.ip_address(raw.split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            print(f"[WARNING] Refused image fetch from {parsed.hostname} ({address})")
+            raise ThumbnailFetchError(400, "Image URL must point to a public host")
+        addresses.append(address)
+    return addresses[0]
+
+
+def _pinned(url: str, address) -> Tuple[str, dict, dict]:
+    """
+    (request url, extra headers, request extensions) that connect to address
+    while still presenting the original host for Host, SNI and certificate checks.
+    """
+    parsed = urlparse(url)
+    host = f"[{address}]" if address.version == 6 else str(address)
+    netloc = host if parsed.port is None else f"{host}:{parsed.port}"
+    host_header = parsed.hostname if parsed.port is None else f"{parsed.hostname}:{parsed.port}"
+    extensions = {"sni_hostname": parsed.hostname} if parsed.scheme == "https" else {}
+    return parsed._replace(netloc=netloc).geturl(), {"Host": host_header}, extensions
+
+
+class ThumbnailCache:
+    def __init__(self, root: str = THUMBNAIL_CACHE_DIR, max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self.stats = {"fresh_hits": 0, "revalidated": 0, "downloads": 0, "evictions": 0}
+        self._missing = {}  # thumbnail url -> time it last returned 404
+        self._lock = threading.Lock()
+        # Image path -> size, least recently used first; built from disk on first use
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._total = 0
+        self._stores = 0
+
+    def _paths(self, url: str) -> Tuple[str, str]:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, f"{key}.img"), os.path.join(self.root, f"{key}.json")
+
+    def _load(self, url: str) -> Tuple[Optional[bytes], dict]:
+        img_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(img_path, "rb") as f:
+                return f.read(), meta
+        except (OSError, ValueError):
+            return None, {}
+
+    def _rescan(self) -> None:
+        """Rebuild the LRU index and size total from the directory. Call with _lock held."""
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".img"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, size, path in entries)
+        self._total = sum(self._index.values())
+
+    def _mark_used(self, img_path: str, size: Optional[int] = None) -> None:
+        """Move an image to the recent end of the index, recording its new size if given."""
+        with self._lock:
+            if self._index is None:
+                self._rescan()
+            if size is not None:
+                self._total += size - self._index.get(img_path, 0)
+                self._index[img_path] = size
+            elif img_path not in self._index:
+                return
+            self._index.move_to_end(img_path)
+
+    def _hit(self, url: str) -> None:
+        img_path = self._paths(url)[0]
+        try:
+            os.utime(img_path)
+        except OSError:
+            pass
+        self._mark_used(img_path)
+
+    def _store(self, url: str, data: bytes, meta: dict) -> None:
+        img_path, meta_path = self._paths(url)
+        for path, payload in ((img_path, data), (meta_path, json.dumps(meta).encode("utf-8"))):
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        self._mark_used(img_path, len(data))
+        self._evict()
+
+    def _touch(self, url: str, meta: dict) -> None:
+        img_path, meta_path = self._paths(url)
+        tmp = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+        self._hit(url)
+
+    def _evict(self) -> None:
+        """Drop least recently used images until the cache fits in max_bytes."""
+        victims = []
+        with self._lock:
+            self._stores += 1
+            if self._stores % RESCAN_EVERY == 0:
+                # Other workers share the directory; resync with what is really there
+                self._rescan()
+            while self._total > self.max_bytes and len(self._index) > 1:
+                path, size = self._index.popitem(last=False)
+                self._total -= size
+                victims.append(path)
+        for path in victims:
+            for victim in (path, path[:-len(".img")] + ".json"):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            self.stats["evictions"] += 1
+
+    async def fetch(self, http, url: str, public_only: bool = False) -> bytes:
+        """
+        Return the image at url, from cache when fresh, revalidating when stale.
+        public_only restricts the request and its redirects to public addresses.
+        The download is cancelled if the request's deadline passes or its client leaves.
+        """
+        data, meta = await asyncio.to_thread(self._load, url)
+        now = time.time()
+        if data is not None and now - meta.get("fetched_at", 0) < THUMBNAIL_FRESH_TTL:
+            self.stats["fresh_hits"] += 1
+            await asyncio.to_thread(self._hit, url)
+            return data
+
+        headers = {}
+        if data is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            resp, body = await guard(self._download(http, url, headers, public_only))
+        except (ThumbnailFetchError, ClientDisconnected, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"[ERROR] Fetching image {url} failed: {e}")
+            raise ThumbnailFetchError(502, "Failed to fetch image")
+
+        if resp.status_code == 304 and data is not None:
+            self.stats["revalidated"] += 1
+            meta["fetched_at"] = now
+            await asyncio.to_thread(self._touch, url, meta)
+            return data
+        if resp.status_code == 404:
+            raise ThumbnailFetchError(404, "Image not found")
+        if resp.status_code != 200:
+            print(f"[ERROR] Image fetch from {url} returned {resp.status_code}")
+            raise ThumbnailFetchError(502, "Failed to fetch image")
+
+        self.stats["downloads"] += 1
+        await asyncio.to_thread(self._store, url, body, {
+            "url": url,
+            "etag": resp.headers.get("etag"),
+            "last_modified": resp.headers.get("last-modified"),
+            "content_type": resp.headers.get("content-type", ""),
+            "fetched_at": now,
+        })
+        return body
+
+    async def _download(self, http, url: str, headers: dict, public_only: bool):
+        """
+        GET url, following redirects by hand so every hop can be checked.
+        Returns (final response, body); the body is only read for 200 image
+        responses and never beyond MAX_IMAGE_BYTES.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            target, hop_headers, extensions = url, headers, {}
+            if public_only:
+                address = await ensure_public_url(url)
+                target, pinned_headers, extensions = _pinned(url, address)
+                hop_headers = {**headers, **pinned_headers}
+            else:
+                _parse_image_url(url)
+            async with http.stream("GET", target, headers=hop_headers, extensions=extensions,
+                                   timeout=upstream_timeout(FETCH_TIMEOUT)) as resp:
+                location = resp.headers.get("location")
+                if resp.status_code in _REDIRECT_CODES and location:
+                    url = urljoin(url, location)
+                    continue
+                if resp.status_code != 200:
+                    return resp, b""
+                if not resp.headers.get("content-type", "").startswith("image/"):
+                    raise ThumbnailFetchError(400, "URL did not return an image")
+                declared = resp.headers.get("content-length", "")
+                if declared.isdigit() and int(declared) > MAX_IMAGE_BYTES:
+                    raise ThumbnailFetchError(400, "Image is too large")
+                chunks, size = [], 0
+                async for chunk in resp.aiter_bytes():
+                    size += len(chunk)
+                    if size > MAX_IMAGE_BYTES:
+                        raise ThumbnailFetchError(400, "Image is too large")
+                    chunks.append(chunk)
+                return resp, b"".join(chunks)
+        raise ThumbnailFetchError(502, "Too many redirects fetching image")
+
+    async def fetch_url(self, http, url: str) -> bytes:
+        """Fetch a caller-supplied image URL; only public hosts are reachable."""
+        return await self.fetch(http, _parse_image_url(url).geturl(), public_only=True)
+
+    async def fetch_video_thumbnail(self, http, video: str) -> Tuple[bytes, str]:
+        """Fetch the best available thumbnail for a video; returns (bytes, url used)."""
+        video_id = parse_video_id(video)
+        for url in thumbnail_urls(video_id):
+            if time.time() - self._missing.get(url, 0) < THUMBNAIL_FRESH_TTL:
+                continue
+            try:
+                return await self.fetch(http, url), url
+            except ThumbnailFetchError as e:
+                if e.status_code != 404:
+                    raise
+                if len(self._missing) > 10000:
+                    self._missing.clear()
+                self._missing[url] = time.time()
+        raise ThumbnailFetchError(404, f"No thumbnail found for video {video_id}")
+
+
+def thumbnail_urls(video_id: str) -> List[str]:
+    return [f"{YOUTUBE_THUMBNAIL_BASE}/{video_id}/{variant}.jpg" for variant in THUMBNAIL_VARIANTS]
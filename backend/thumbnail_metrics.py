@@ -0,0 +1,138 @@
+"""
+Local, model-free quality metrics for batches of thumbnails.
+
+Images are decoded in a small worker pool, resized to a common shape and
+stacked into a single (N, H, W, 3) float32 array so every metric is computed
+for the whole batch in one vectorized pass.
+"""
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# 16:9 like a YouTube thumbnail, small enough to keep the batch cheap
+COMPARE_SIZE = (320, 180)
+MAX_COMPARE_IMAGES = int(os.getenv("THUMBNAIL_COMPARE_MAX_IMAGES", "20"))
+
+# Relative weight of each normalized metric in the overall score
+SCORE_WEIGHTS = {
+    "exposure": 0.20,
+    "contrast": 0.25,
+    "colorfulness": 0.25,
+    "sharpness": 0.20,
+    "edge_density": 0.10,
+}
+
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+
+def _get_decode_pool() -> ThreadPoolExecutor:
+    """Decode pool, created on first use (decode_batch runs in worker threads, hence the lock)."""
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 4),
+                thread_name_prefix="thumb-decode",
+            )
+        return _decode_pool
+
+
+def decode_image(data: bytes, size: Tuple[int, int] = COMPARE_SIZE) -> np.ndarray:
+    """Decode raw image bytes into an (H, W, 3) float32 array in [0, 1]."""
+    img = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder downscale while decoding when it can
+    img.draft("RGB", size)
+    img = img.convert("RGB").resize(size, Image.BILINEAR)
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def decode_batch(blobs: List[bytes], size: Tuple[int, int] = COMPARE_SIZE) -> Tuple[np.ndarray, Dict[int, str]]:
+    """
+    Decode all blobs in the worker pool and stack them into one batch.
+    Returns (batch, errors) where errors maps input index -> error message;
+    failed images are left out of the batch.
+    """
+    def _safe_decode(blob):
+        try:
+            return decode_image(blob, size), None
+        except Exception as e:
+            return None, str(e)
+
+    decoded = list(_get_decode_pool().map(_safe_decode, blobs))
+    errors = {i: err for i, (_, err) in enumerate(decoded) if err is not None}
+    arrays = [arr for arr, err in decoded if err is None]
+    if not arrays:
+        return np.empty((0, size[1], size[0], 3), dtype=np.float32), errors
+    return np.stack(arrays), errors
+
+
+def compute_batch_metrics(batch: np.ndarray) -> Dict[str, np.ndarray]:
+    """Compute per-image metrics for an (N, H, W, 3) batch; every value is shape (N,)."""
+    r, g, b = batch[..., 0], batch[..., 1], batch[..., 2]
+    luma = 0.299 * r + 0.587 * g + 0.114 * b
+
+    brightness = luma.mean(axis=(1, 2))
+    contrast = luma.std(axis=(1, 2))
+
+    # Hasler & Suesstrunk colorfulness on the opponent color space
+    rg = r - g
+    yb = 0.5 * (r + g) - b
+    colorfulness = (
+        np.sqrt(rg.std(axis=(1, 2)) ** 2 + yb.std(axis=(1, 2)) ** 2)
+        + 0.3 * np.sqrt(rg.mean(axis=(1, 2)) ** 2 + yb.mean(axis=(1, 2)) ** 2)
+    )
+
+    # Variance of the 4-neighbour Laplacian as a focus/sharpness measure
+    laplacian = (
+        4 * luma[:, 1:-1, 1:-1]
+        - luma[:, :-2, 1:-1] - luma[:, 2:, 1:-1]
+        - luma[:, 1:-1, :-2] - luma[:, 1:-1, 2:]
+    )
+    sharpness = laplacian.var(axis=(1, 2))
+
+    gx = np.abs(np.diff(luma, axis=2))[:, :-1, :]
+    gy = np.abs(np.diff(luma, axis=1))[:, :, :-1]
+    edge_density = ((gx + gy) > 0.1).mean(axis=(1, 2))
+
+    return {
+        "brightness": brightness,
+        "contrast": contrast,
+        "colorfulness": colorfulness,
+        "sharpness": sharpness,
+        "edge_density": edge_density,
+    }
+
+
+def score_batch(metrics: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Combine raw metrics into a 0-100 score per image. Normalization uses fixed
+    reference ranges (not batch-relative) so scores are comparable across calls.
+    """
+    normalized = {
+        # Penalize both under- and over-exposed thumbnails
+        "exposure": 1.0 - np.abs(metrics["brightness"] - 0.55) / 0.55,
+        "contrast": metrics["contrast"] / 0.30,
+        "colorfulness": metrics["colorfulness"] / 0.45,
+        "sharpness": metrics["sharpness"] / 0.02,
+        "edge_density": metrics["edge_density"] / 0.25,
+    }
+    score = sum(
+        weight * np.clip(normalized[name], 0.0, 1.0)
+        for name, weight in SCORE_WEIGHTS.items()
+    )
+    return score * 100.0
+
+
+def rank_batch(batch: np.ndarray) -> Tuple[np.ndarray, Dict[str, np.ndarray], np.ndarray]:
+    """Return (order, metrics, scores) where order lists batch rows best-first."""
+    metrics = compute_batch_metrics(batch)
+    scores = score_batch(metrics)
+    # Stable sort so ties keep upload order
+    order = np.argsort(-scores, kind="stable")
+    return order, metrics, scores
@@ -0,0 +1,220 @@
+"""
+Trending-keyword digest refreshed in the background.
+
+A scheduler task started from the app lifespan periodically pulls Google's
+trending searches and the related queries for a configurable seed list, and
+publishes the result as an immutable, versioned snapshot. Readers (the
+/trending endpoint, the analyze_keyword fallback) only ever look at the
+current snapshot, so they never wait on Trends.
+
+With several workers only one of them refreshes per interval (elected through
+the shared state backend); the others pick the published snapshot up from
+there. The digest uses its own TrendReq (pytrends clients are not thread
+safe), but its requests share the app's Google Trends pacing and circuit
+breaker.
+"""
+import asyncio
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+TRENDING_SEEDS = [
+    s.strip() for s in os.getenv(
+        "TRENDING_SEEDS", "gaming,music,tech review,cooking,fitness,travel vlog,tutorial,minecraft"
+    ).split(",") if s.strip()
+]
+TRENDING_REGION = os.getenv("TRENDING_REGION", "united_states")
+TRENDING_REFRESH_INTERVAL = int(os.getenv("TRENDING_REFRESH_INTERVAL", "3600"))
+# Pause between seed lookups so the refresh doesn't trip Google's rate limiting
+TRENDING_SEED_DELAY = float(os.getenv("TRENDING_SEED_DELAY", "2"))
+TRENDING_MAX_ITEMS = 25
+# How often non-refreshing workers look for a newer published snapshot
+POLL_INTERVAL = 60
+# Wait before retrying after a failed refresh
+FAILURE_BACKOFF = 300
+
+# Words that say nothing about a query's topic; sharing only these is not a match
+STOP_WORDS = frozenset({
+    "a", "an", "and", "are", "at", "be", "best", "by", "can", "do", "does", "for", "from", "get", "how",
+    "i", "in", "is", "it", "make", "my", "new", "of", "on", "or", "the", "this", "to", "top", "video",
+    "videos", "vs", "what", "when", "where", "which", "who", "why", "with", "you", "your",
+})
+
+_SNAPSHOT_KEY = "trending:snapshot"
+_LOCK_KEY = "trending:refresh"
+
+
+def _empty_snapshot() -> dict:
+    return {"version": 0, "refreshed_at": None, "region": TRENDING_REGION, "trending": [], "related": {}}
+
+
+def _tokens(text: str) -> set:
+    """Topic words of text: lowercased, without stop-words and single characters."""
+    return {w for w in re.findall(r"\w+", (text or "").lower()) if len(w) > 1 and w not in STOP_WORDS}
+
+
+class TrendsUnavailable(Exception):
+    pass
+
+
+class TrendingDigest:
+    def __init__(self, state_getter: Callable, pytrends_factory: Callable, store_getter: Callable,
+                 breaker_getter: Callable, pace: Callable, seeds: Optional[List[str]] = None):
+        """
+        pytrends_factory builds the digest's own TrendReq; breaker_getter returns
+        the shared Google Trends circuit breaker and pace blocks until the next
+        Trends request may go out.
+        """
+        self._state_getter = state_getter
+        self._pytrends_factory = pytrends_factory
+        self._store_getter = store_getter
+        self._breaker_getter = breaker_getter
+        self._pace = pace
+        self._pytrends = None
+        self.seeds = list(seeds if seeds is not None else TRENDING_SEEDS)
+        # Replaced wholesale on every refresh, never mutated in place
+        self.snapshot: dict = _empty_snapshot()
+        self.stats = {"refreshes": 0, "failures": 0, "adopted": 0, "last_error": None}
+        self._retry_at = 0.0
+
+    # ---------------- reads ----------------
+    def related_for(self, query: str) -> List[str]:
+        return self.snapshot["related"].get((query or "").strip().lower(), [])
+
+    def keywords_for(self, query: str, count: int) -> List[dict]:
+        """
+        Keywords for query from the current snapshot: the related queries of the
+        seed the query is about (every topic word of the seed appears in it),
+        else trending searches sharing a topic word with the query.
+        """
+        words = _tokens(query)
+        related = self.related_for(query)
+        if not related and words:
+            for seed, terms in self.snapshot["related"].items():
+                seed_words = _tokens(seed)
+                if seed_words and seed_words <= words:
+                    related = terms
+                    break
+        if not related and words:
+            related = [term for term in self.snapshot["trending"] if words & _tokens(term)]
+        return [{"keyword": kw, "source": "trending_digest"} for kw in related[:count]]
+
+    # ---------------- refresh ----------------
+    def _call(self, fn: Callable, *args, **kwargs):
+        """One Trends request, paced and guarded like the app's other Trends calls."""
+        breaker = self._breaker_getter()
+        if not breaker.allow():
+            raise TrendsUnavailable("Google Trends circuit open")
+        self._pace()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return result
+
+    def _fetch(self) -> dict:
+        """Build a new snapshot from Trends. Blocking; run it off the event loop."""
+        if self._pytrends is None:
+            self._pytrends = self._pytrends_factory()
+        pytrends = self._pytrends
+        store = self._store_getter()
+        trending = []
+        try:
+            df = self._call(pytrends.trending_searches, pn=TRENDING_REGION)
+            if df is not None and not df.empty:
+                trending = [str(term) for term in df[0].head(TRENDING_MAX_ITEMS).tolist()]
+        except Exception as e:
+            print(f"[WARNING] Trending searches refresh failed: {e}")
+
+        related: Dict[str, List[str]] = {}
+        queried = circuit_open = False
+        for seed in self.seeds:
+            # The store keeps related queries for a day; the digest wants them once per refresh
+            stored = store.load_related(seed, max_age=TRENDING_REFRESH_INTERVAL / 2)
+            if stored and stored.get("top"):
+                related[seed.lower()] = stored["top"][:TRENDING_MAX_ITEMS]
+                continue
+            if circuit_open:
+                # Trends is failing; keep the previous data for the remaining seeds
+                if seed.lower() in self.snapshot["related"]:
+                    related[seed.lower()] = self.snapshot["related"][seed.lower()]
+                continue
+            if queried:
+                time.sleep(TRENDING_SEED_DELAY)
+            queried = True
+            try:
+                self._call(pytrends.build_payload, [seed], cat=0, timeframe="now 7-d", geo="", gprop="youtube")
+                top = (self._call(pytrends.related_queries).get(seed) or {}).get("top")
+                if top is not None and not top.empty:
+                    terms = top["query"].tolist()
+                    store.save_related(seed, "now 7-d", terms)
+                    related[seed.lower()] = terms[:TRENDING_MAX_ITEMS]
+            except TrendsUnavailable:
+                circuit_open = True
+            except Exception as e:
+                print(f"[WARNING] Related queries refresh failed for seed '{seed}': {e}")
+            # Keep the previous data for seeds that failed this round
+            if seed.lower() not in related and seed.lower() in self.snapshot["related"]:
+                related[seed.lower()] = self.snapshot["related"][seed.lower()]
+
+        if not trending and not related:
+            raise RuntimeError("Trends returned no trending or related data")
+        return {
+            "version": self.snapshot["version"] + 1,
+            "refreshed_at": time.time(),
+            "region": TRENDING_REGION,
+            "trending": trending or self.snapshot["trending"],
+            "related": related,
+        }
+
+    async def _adopt_published(self) -> bool:
+        published = await asyncio.to_thread(self._state_getter().get, _SNAPSHOT_KEY)
+        if published and published.get("version", 0) > self.snapshot["version"]:
+            self.snapshot = published
+            self.stats["adopted"] += 1
+            return True
+        return False
+
+    async def refresh(self) -> bool:
+        """Refresh if no other worker has this interval; returns True when a new snapshot is live."""
+        state = self._state_getter()
+        window = int(time.time() // TRENDING_REFRESH_INTERVAL)
+        elected = await asyncio.to_thread(state.incr, f"{_LOCK_KEY}:{window}", 1, TRENDING_REFRESH_INTERVAL * 2)
+        if elected != 1:
+            return await self._adopt_published()
+        try:
+            snapshot = await asyncio.to_thread(self._fetch)
+        except Exception as e:
+            self.stats["failures"] += 1
+            self.stats["last_error"] = str(e)
+            print(f"[WARNING] Trending digest refresh failed: {e}")
+            self._retry_at = time.time() + FAILURE_BACKOFF
+            # Let another worker (or the next poll) try again this interval
+            await asyncio.to_thread(state.delete, f"{_LOCK_KEY}:{window}")
+            return False
+        published = await asyncio.to_thread(state.get, _SNAPSHOT_KEY)
+        if published:
+            snapshot["version"] = max(snapshot["version"], published.get("version", 0) + 1)
+        self.snapshot = snapshot
+        await asyncio.to_thread(state.set, _SNAPSHOT_KEY, snapshot)
+        self.stats["refreshes"] += 1
+        print(f"[INFO] Trending digest v{snapshot['version']}: {len(snapshot['trending'])} trending, "
+              f"{len(snapshot['related'])} seeds")
+        return True
+
+    async def run(self) -> None:
+        """Scheduler loop; cancel the task to stop it."""
+        await self._adopt_published()
+        while True:
+            age = time.time() - (self.snapshot["refreshed_at"] or 0)
+            if age >= TRENDING_REFRESH_INTERVAL and time.time() >= self._retry_at:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    print(f"[WARNING] Trending scheduler error: {e}")
+            else:
+                await self._adopt_published()
+            await asyncio.sleep(POLL_INTERVAL)
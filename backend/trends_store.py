@@ -0,0 +1,258 @@
+"""
+Local columnar store for Google Trends data.
+
+Each keyword's daily ``interest_over_time`` series is kept as one NumPy file
+(a structured array of ``day``/``value`` columns, memory-mapped on read) plus
+a small JSON sidecar with refresh metadata and the last ``related_queries``
+result. Refreshes only ask Google for the days that are missing, and summary
+metrics are computed vectorized over the stored series so repeat lookups never
+touch the network.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+TRENDS_STORE_DIR = os.getenv(
+    "TRENDS_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "trends")
+)
+# How far back a first fetch goes (matches the old 'today 3-m' window)
+HISTORY_DAYS = int(os.getenv("TRENDS_HISTORY_DAYS", "90"))
+# Days re-fetched on each refresh so the new window can be rescaled onto the stored one
+OVERLAP_DAYS = 7
+# Google publishes daily values with a lag, so don't re-check a series more often than this
+REFRESH_INTERVAL = int(os.getenv("TRENDS_REFRESH_INTERVAL", str(6 * 3600)))
+RELATED_QUERIES_TTL = int(os.getenv("TRENDS_RELATED_TTL", str(24 * 3600)))
+
+SERIES_DTYPE = np.dtype([("day", "<i8"), ("value", "<f4")])
+_EPOCH = date(1970, 1, 1)
+
+
+def day_number(d: date) -> int:
+    return (d - _EPOCH).days
+
+
+def day_to_date(n: int) -> date:
+    return _EPOCH + timedelta(days=int(n))
+
+
+def _tmp_name(path: str, suffix: str) -> str:
+    """Temporary file next to path, unique per process and thread."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}{suffix}"
+
+
+def frame_to_series(frame, column: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert a pytrends ``interest_over_time`` DataFrame into (days, values) arrays.
+    Rows Google flags as partial (the still-incomplete latest day) are dropped so
+    they are fetched again once final.
+    """
+    if frame is None or frame.empty or column not in frame:
+        return np.empty(0, dtype="<i8"), np.empty(0, dtype="<f4")
+    if "isPartial" in frame:
+        frame = frame[~frame["isPartial"].astype(bool)]
+    days = frame.index.values.astype("datetime64[D]").astype("<i8")
+    values = frame[column].values.astype("<f4")
+    return days, values
+
+
+class TrendsStore:
+    def __init__(self, root: str = TRENDS_STORE_DIR, gprop: str = "youtube", geo: str = ""):
+        self.root = root
+        self.gprop = gprop
+        self.geo = geo
+        os.makedirs(self.root, exist_ok=True)
+
+    # ---------------- paths & metadata ----------------
+    def _slug(self, keyword: str) -> str:
+        key = f"{keyword.strip().lower()}|{self.gprop}|{self.geo}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+    def _series_path(self, keyword: str) -> str:
+        return os.path.join(self.root, f"{self._slug(keyword)}.npy")
+
+    def _meta_path(self, keyword: str) -> str:
+        return os.path.join(self.root, f"{self._slug(keyword)}.json")
+
+    def _load_meta(self, keyword: str) -> dict:
+        try:
+            with open(self._meta_path(keyword), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, keyword: str, meta: dict) -> None:
+        meta["keyword"] = keyword
+        path = self._meta_path(keyword)
+        tmp = _tmp_name(path, ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+
+    # ---------------- interest over time ----------------
+    def load_series(self, keyword: str) -> np.ndarray:
+        """Return the stored series as a read-only structured array (empty if none)."""
+        try:
+            return np.load(self._series_path(keyword), mmap_mode="r")
+        except (OSError, ValueError):
+            return np.empty(0, dtype=SERIES_DTYPE)
+
+    def save_series(self, keyword: str, series: np.ndarray) -> None:
+        path = self._series_path(keyword)
+        tmp = _tmp_name(path, ".tmp.npy")
+        np.save(tmp, np.ascontiguousarray(series, dtype=SERIES_DTYPE))
+        os.replace(tmp, path)
+
+    def missing_range(self, keyword: str, today: Optional[date] = None) -> Optional[Tuple[date, date]]:
+        """
+        Return the (start, end) window that still has to be fetched for this
+        keyword, or None if the stored series is fresh enough to serve as is.
+        """
+        today = today or date.today()
+        meta = self._load_meta(keyword)
+        series = self.load_series(keyword)
+        if len(series) and time.time() - meta.get("checked_at", 0) < REFRESH_INTERVAL:
+            return None
+        history_start = today - timedelta(days=HISTORY_DAYS)
+        if not len(series):
+            return history_start, today
+        last_day = day_to_date(series["day"][-1])
+        if last_day >= today - timedelta(days=1):
+            return None
+        start = max(last_day - timedelta(days=OVERLAP_DAYS), history_start)
+        return start, today
+
+    def merge(self, keyword: str, days: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """
+        Merge a freshly fetched window into the stored series and persist it.
+        Google scales every request to its own 0-100 range, so the new window is
+        rescaled onto the stored one using the median ratio over overlapping days.
+        """
+        old = np.array(self.load_series(keyword))
+        new = np.empty(len(days), dtype=SERIES_DTYPE)
+        new["day"] = days
+        new["value"] = values
+        if len(old) and len(new):
+            _, old_idx, new_idx = np.intersect1d(old["day"], new["day"], return_indices=True)
+            a, b = old["value"][old_idx], new["value"][new_idx]
+            usable = (a > 0) & (b > 0)
+            if usable.any():
+                new["value"] = new["value"] * np.median(a[usable] / b[usable])
+            # Stored days win for the overlap; only genuinely new days are appended
+            new = new[~np.isin(new["day"], old["day"])]
+        merged = np.concatenate([old, new]) if len(old) else new
+        merged = merged[np.argsort(merged["day"], kind="stable")]
+        if len(merged):
+            cutoff = merged["day"][-1] - HISTORY_DAYS * 4
+            merged = merged[merged["day"] >= cutoff]
+        self.save_series(keyword, merged)
+        meta = self._load_meta(keyword)
+        meta["checked_at"] = time.time()
+        self._save_meta(keyword, meta)
+        return merged
+
+    def mark_checked(self, keyword: str) -> None:
+        """Record a refresh attempt that returned no new days."""
+        meta = self._load_meta(keyword)
+        meta["checked_at"] = time.time()
+        self._save_meta(keyword, meta)
+
+    def summary(self, keyword: str, window_days: int = HISTORY_DAYS) -> Optional[dict]:
+        """Average interest and trend direction over the last window_days of the stored series."""
+        return self.summarize_many([keyword], window_days).get(keyword)
+
+    def summarize_many(self, keywords: List[str], window_days: int = HISTORY_DAYS) -> Dict[str, dict]:
+        """
+        Vectorized summary for several keywords at once: all windows are packed
+        into one zero-padded matrix and the mean and least-squares slope are
+        computed for every row in a single pass.
+        """
+        windows = []
+        for kw in keywords:
+            series = self.load_series(kw)
+            if len(series):
+                cutoff = series["day"][-1] - window_days
+                windows.append((kw, np.asarray(series["value"][series["day"] > cutoff], dtype=np.float64)))
+        if not windows:
+            return {}
+
+        width = max(len(v) for _, v in windows)
+        matrix = np.zeros((len(windows), width))
+        mask = np.zeros((len(windows), width), dtype=bool)
+        for row, (_, values) in enumerate(windows):
+            matrix[row, :len(values)] = values
+            mask[row, :len(values)] = True
+
+        counts = mask.sum(axis=1)
+        means = matrix.sum(axis=1) / counts
+        x = np.where(mask, np.arange(width), 0.0)
+        x_mean = x.sum(axis=1) / counts
+        dx = np.where(mask, x - x_mean[:, None], 0.0)
+        dy = np.where(mask, matrix - means[:, None], 0.0)
+        denom = (dx * dx).sum(axis=1)
+        slope = np.divide((dx * dy).sum(axis=1), denom, out=np.zeros_like(denom), where=denom > 0)
+        # Relative change across the window implied by the fitted line
+        change = np.divide(slope * (counts - 1), means, out=np.zeros_like(means), where=means > 0)
+
+        out = {}
+        for row, (kw, _) in enumerate(windows):
+            trend = 'up' if change[row] > 0.1 else 'down' if change[row] < -0.1 else 'stable'
+            out[kw] = {
+                'avg_interest': int(round(means[row])),
+                'trend': trend,
+                'timeframe': f'last {window_days} days',
+                'cached': True,
+            }
+        return out
+
+    # ---------------- anchor-normalized batches ----------------
+    def anchor_ratio(self, keyword: str, anchor: str) -> Optional[float]:
+        """Return the keyword's stored interest relative to the anchor term if it is still fresh."""
+        entry = self._load_meta(keyword).get("anchor")
+        if (
+            entry
+            and entry.get("term") == anchor
+            and time.time() - entry.get("checked_at", 0) < REFRESH_INTERVAL
+        ):
+            return entry.get("ratio")
+        return None
+
+    def merge_anchored(self, keyword: str, anchor: str, days: np.ndarray, values: np.ndarray,
+                       anchor_values: np.ndarray) -> Optional[float]:
+        """
+        Store a keyword series fetched in the same payload as the anchor term.
+        The keyword/anchor ratio of means is kept so keywords fetched in different
+        payloads can be compared; the series itself is stored rescaled to its own
+        0-100 range, the same scale a single-keyword request returns.
+        """
+        ratio = None
+        anchor_mean = float(np.mean(anchor_values)) if len(anchor_values) else 0.0
+        if anchor_mean > 0 and len(values):
+            ratio = float(np.mean(values)) / anchor_mean
+        peak = float(np.max(values)) if len(values) else 0.0
+        if peak > 0:
+            self.merge(keyword, days, values * (100.0 / peak))
+        else:
+            self.mark_checked(keyword)
+        meta = self._load_meta(keyword)
+        meta["anchor"] = {"term": anchor, "ratio": ratio, "checked_at": time.time()}
+        self._save_meta(keyword, meta)
+        return ratio
+
+    # ---------------- related queries ----------------
+    def load_related(self, keyword: str, max_age: float = RELATED_QUERIES_TTL) -> Optional[dict]:
+        """Return the stored related_queries result if it is younger than max_age seconds."""
+        related = self._load_meta(keyword).get("related")
+        if related and time.time() - related.get("fetched_at", 0) < max_age:
+            return related
+        return None
+
+    def save_related(self, keyword: str, timeframe: str, top: List[str]) -> None:
+        meta = self._load_meta(keyword)
+        meta["related"] = {"fetched_at": time.time(), "timeframe": timeframe, "top": list(top)}
+        self._save_meta(keyword, meta)
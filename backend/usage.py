@@ -0,0 +1,218 @@
+"""
+Token and cost accounting for upstream completions.
+
+Every Groq/OpenRouter completion is recorded with its prompt/completion/total
+tokens (from the response ``usage`` block), latency, model, route and user.
+Records are aggregated in memory for /admin/usage and flushed in batches to a
+local SQLite file by a background task, so the request path only appends to a
+buffer.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+USAGE_DB_PATH = os.getenv(
+    "USAGE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "usage.sqlite3")
+)
+FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", "200"))
+# Records kept in memory if the flusher falls behind; the oldest are dropped beyond this
+MAX_PENDING = FLUSH_BATCH * 50
+THROUGHPUT_WINDOW = 60.0  # seconds used for the tokens/sec figure
+
+# USD per 1M tokens as (prompt, completion); override with USAGE_PRICES_JSON
+DEFAULT_PRICES = {
+    "llama3-8b-8192": (0.05, 0.08),
+    "llama3-70b-8192": (0.59, 0.79),
+    "meta-llama/llama-4-scout-17b-16e-instruct": (0.11, 0.34),
+    "mistralai/mistral-nemo:free": (0.0, 0.0),
+}
+
+
+def _load_prices() -> Dict[str, tuple]:
+    prices = dict(DEFAULT_PRICES)
+    raw = os.getenv("USAGE_PRICES_JSON")
+    if raw:
+        try:
+            prices.update({model: tuple(p) for model, p in json.loads(raw).items()})
+        except Exception as e:
+            print(f"[WARNING] Ignoring invalid USAGE_PRICES_JSON: {e}")
+    return prices
+
+
+def _new_bucket():
+    return {
+        "calls": 0,
+        "errors": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "cost_usd": 0.0,
+        "latency_ms": 0.0,
+        "max_completion_tokens": 0,
+    }
+
+
+class UsageTracker:
+    def __init__(self, db_path: str = USAGE_DB_PATH):
+        self.db_path = db_path
+        self.prices = _load_prices()
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._pending = deque(maxlen=MAX_PENDING)
+        self._recent = deque()  # (ts, total_tokens) within THROUGHPUT_WINDOW
+        self.by_route = defaultdict(_new_bucket)
+        self.by_model = defaultdict(_new_bucket)
+        self.by_user = defaultdict(_new_bucket)
+        self._db_ready = False
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def record(self, route: str, model: str, user: Optional[str], usage: Optional[dict],
+               latency_ms: float, ok: bool = True) -> dict:
+        usage = usage or {}
+        prompt = int(usage.get("prompt_tokens") or 0)
+        completion = int(usage.get("completion_tokens") or 0)
+        total = int(usage.get("total_tokens") or prompt + completion)
+        record = {
+            "ts": time.time(),
+            "route": route or "unknown",
+            "model": model or "unknown",
+            "user": user or "anonymous",
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": total,
+            "cost_usd": self.cost(model, prompt, completion),
+            "latency_ms": latency_ms,
+            "ok": ok,
+        }
+        with self._lock:
+            for bucket in (self.by_route[record["route"]], self.by_model[record["model"]], self.by_user[record["user"]]):
+                bucket["calls"] += 1
+                bucket["errors"] += 0 if ok else 1
+                bucket["prompt_tokens"] += prompt
+                bucket["completion_tokens"] += completion
+                bucket["total_tokens"] += total
+                bucket["cost_usd"] += record["cost_usd"]
+                bucket["latency_ms"] += latency_ms
+                bucket["max_completion_tokens"] = max(bucket["max_completion_tokens"], completion)
+            self._recent.append((record["ts"], total))
+            self._pending.append(record)
+        return record
+
+    # ---------------- persistence ----------------
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        if not self._db_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                " ts REAL, route TEXT, model TEXT, user TEXT,"
+                " prompt_tokens INTEGER, completion_tokens INTEGER, total_tokens INTEGER,"
+                " cost_usd REAL, latency_ms REAL, ok INTEGER)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+            self._db_ready = True
+        return conn
+
+    def flush(self) -> int:
+        """
+        Write pending records to SQLite, FLUSH_BATCH per transaction; returns
+        how many were written. A failed batch goes back to the front of the queue.
+        """
+        written = 0
+        conn = None
+        try:
+            while True:
+                with self._lock:
+                    batch = [self._pending.popleft() for _ in range(min(FLUSH_BATCH, len(self._pending)))]
+                if not batch:
+                    return written
+                try:
+                    if conn is None:
+                        conn = self._connect()
+                    with conn:
+                        conn.executemany(
+                            "INSERT INTO usage VALUES (:ts, :route, :model, :user, :prompt_tokens, :completion_tokens,"
+                            " :total_tokens, :cost_usd, :latency_ms, :ok)",
+                            batch,
+                        )
+                except Exception as e:
+                    print(f"[ERROR] Failed to flush {len(batch)} usage records: {e}")
+                    with self._lock:
+                        self._pending.extendleft(reversed(batch))
+                    return written
+                written += len(batch)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def persisted_by_route(self, since: Optional[float] = None) -> Dict[str, dict]:
+        """Totals per route from the local store (all workers), optionally since a timestamp."""
+        try:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT route, COUNT(*), SUM(total_tokens), SUM(cost_usd), AVG(latency_ms)"
+                " FROM usage WHERE ts >= ? GROUP BY route",
+                (since or 0,),
+            ).fetchall()
+            conn.close()
+        except Exception as e:
+            print(f"[ERROR] Failed to read usage store: {e}")
+            return {}
+        return {
+            route: {
+                "calls": calls,
+                "total_tokens": tokens or 0,
+                "cost_usd": round(cost or 0.0, 6),
+                "avg_latency_ms": round(latency or 0.0, 1),
+            }
+            for route, calls, tokens, cost, latency in rows
+        }
+
+    # ---------------- reporting ----------------
+    def tokens_per_second(self) -> float:
+        cutoff = time.time() - THROUGHPUT_WINDOW
+        with self._lock:
+            while self._recent and self._recent[0][0] < cutoff:
+                self._recent.popleft()
+            tokens = sum(t for _, t in self._recent)
+        return tokens / THROUGHPUT_WINDOW
+
+    @staticmethod
+    def _finish(bucket: dict) -> dict:
+        out = dict(bucket)
+        calls = max(1, bucket["calls"])
+        out["cost_usd"] = round(bucket["cost_usd"], 6)
+        out["avg_latency_ms"] = round(bucket["latency_ms"] / calls, 1)
+        out["avg_completion_tokens"] = round(bucket["completion_tokens"] / calls, 1)
+        # Generation throughput while waiting on the model
+        out["completion_tokens_per_second"] = (
+            round(1000 * bucket["completion_tokens"] / bucket["latency_ms"], 1) if bucket["latency_ms"] else 0.0
+        )
+        del out["latency_ms"]
+        return out
+
+    def report(self, top_users: int = 10) -> dict:
+        with self._lock:
+            routes = {name: self._finish(b) for name, b in self.by_route.items()}
+            models = {name: self._finish(b) for name, b in self.by_model.items()}
+            users = sorted(self.by_user.items(), key=lambda item: item[1]["total_tokens"], reverse=True)
+            heaviest = [dict(user=name, **self._finish(b)) for name, b in users[:top_users]]
+            pending = len(self._pending)
+        return {
+            "since": self.started_at,
+            "tokens_per_second": round(self.tokens_per_second(), 2),
+            "throughput_window_seconds": THROUGHPUT_WINDOW,
+            "routes": routes,
+            "models": models,
+            "top_users": heaviest,
+            "pending_flush": pending,
+        }
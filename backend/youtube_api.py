@@ -0,0 +1,212 @@
+"""
+Server-side YouTube Data API client used by /youtube/search.
+
+Does the same search -> videos -> channels fan-out as
+src/services/youtubeService.ts, but:
+  - reuses the app's pooled httpx client,
+  - looks up video and channel ids in batches of up to 50 per call, coalescing
+    ids requested by concurrent searches into the same batch,
+  - caches responses and revalidates them with ETag / If-None-Match.
+
+The API root is configurable (YOUTUBE_API_BASE) so the whole path can run
+against a local stand-in server.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlencode
+
+YOUTUBE_API_BASE = os.getenv("YOUTUBE_API_BASE", "https://www.googleapis.com/youtube/v3").rstrip("/")
+MAX_IDS_PER_CALL = 50
+# Responses younger than this are served without contacting the API at all
+SEARCH_FRESH_TTL = int(os.getenv("YOUTUBE_SEARCH_TTL", "300"))
+VIDEO_TTL = int(os.getenv("YOUTUBE_VIDEO_TTL", "600"))
+CHANNEL_TTL = int(os.getenv("YOUTUBE_CHANNEL_TTL", "3600"))
+RESPONSE_CACHE_SIZE = 512
+ID_CACHE_SIZE = 5000
+# How long a batch waits for ids from other concurrent requests before it is sent
+BATCH_WINDOW = 0.005
+
+
+class YouTubeAPIError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def format_number(value) -> str:
+    """Same compact formatting as formatNumber in youtubeService.ts."""
+    try:
+        n = int(value)
+    except (TypeError, ValueError):
+        return ""
+    if n >= 1_000_000_000:
+        return f"{n / 1_000_000_000:.1f}B"
+    if n >= 1_000_000:
+        return f"{n / 1_000_000:.1f}M"
+    if n >= 1_000:
+        return f"{n / 1_000:.1f}K"
+    return str(n)
+
+
+class _BatchLoader:
+    """
+    Coalesces id lookups from concurrent requests into batched API calls of at
+    most MAX_IDS_PER_CALL ids. Ids already being fetched are awaited instead of
+    being requested again, and results are cached per id for ttl seconds.
+    """
+
+    def __init__(self, fetch_batch: Callable[[List[str]], Awaitable[Dict[str, dict]]], ttl: int):
+        self._fetch_batch = fetch_batch
+        self._ttl = ttl
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def load_many(self, ids: List[str]) -> Dict[str, Optional[dict]]:
+        now = time.time()
+        out, waits = {}, {}
+        loop = asyncio.get_running_loop()
+        for item_id in dict.fromkeys(i for i in ids if i):
+            hit = self._cache.get(item_id)
+            if hit and now - hit[1] < self._ttl:
+                out[item_id] = hit[0]
+                continue
+            future = self._inflight.get(item_id)
+            if future is None:
+                future = loop.create_future()
+                self._inflight[item_id] = future
+                self._pending.append(item_id)
+            waits[item_id] = future
+        if self._pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        for item_id, future in waits.items():
+            out[item_id] = await asyncio.shield(future)
+        return out
+
+    async def _flush(self):
+        await asyncio.sleep(BATCH_WINDOW)
+        pending, self._pending = self._pending, []
+        self._flush_task = None
+        chunks = [pending[i:i + MAX_IDS_PER_CALL] for i in range(0, len(pending), MAX_IDS_PER_CALL)]
+        results = await asyncio.gather(*(self._fetch_batch(chunk) for chunk in chunks), return_exceptions=True)
+        now = time.time()
+        for chunk, result in zip(chunks, results):
+            for item_id in chunk:
+                future = self._inflight.pop(item_id)
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                    # Waiters that went away must not trigger "exception never retrieved"
+                    future.add_done_callback(lambda f: f.exception())
+                    continue
+                item = result.get(item_id)
+                if item is not None:
+                    self._cache[item_id] = (item, now)
+                    self._cache.move_to_end(item_id)
+                future.set_result(item)
+        while len(self._cache) > ID_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+
+class YouTubeClient:
+    def __init__(self, http, api_key: Optional[str] = None, base_url: str = YOUTUBE_API_BASE):
+        self.http = http
+        self.api_key = api_key or os.getenv("YOUTUBE_API_KEY") or os.getenv("VITE_YOUTUBE_API_KEY")
+        self.base_url = base_url
+        self._responses: "OrderedDict[str, dict]" = OrderedDict()
+        self.stats = {"fresh_hits": 0, "revalidated": 0, "misses": 0, "upstream_calls": 0}
+        self.videos = _BatchLoader(self._fetch_videos, VIDEO_TTL)
+        self.channels = _BatchLoader(self._fetch_channels, CHANNEL_TTL)
+
+    async def _get(self, path: str, params: dict, fresh_ttl: int) -> dict:
+        """GET an API resource through the response cache, revalidating stale entries by ETag."""
+        if not self.api_key:
+            raise YouTubeAPIError(500, "YOUTUBE_API_KEY not set")
+        cache_key = f"{path}?{urlencode(sorted(params.items()))}"
+        entry = self._responses.get(cache_key)
+        now = time.time()
+        if entry and now - entry["ts"] < fresh_ttl:
+            self.stats["fresh_hits"] += 1
+            return entry["data"]
+        headers = {"If-None-Match": entry["etag"]} if entry and entry.get("etag") else {}
+        self.stats["upstream_calls"] += 1
+        try:
+            resp = await self.http.get(
+                f"{self.base_url}/{path}",
+                params={**params, "key": self.api_key},
+                headers=headers,
+                timeout=15.0,
+            )
+        except Exception as e:
+            # Timeouts and connection errors surface as a bad gateway like other upstream failures
+            print(f"[YOUTUBE ERROR] {path} request failed: {e!r}")
+            raise YouTubeAPIError(502, f"YouTube API {path} request failed")
+        if resp.status_code == 304 and entry:
+            self.stats["revalidated"] += 1
+            entry["ts"] = now
+            self._responses.move_to_end(cache_key)
+            return entry["data"]
+        if resp.status_code != 200:
+            raise YouTubeAPIError(resp.status_code, f"YouTube API {path} failed: {resp.text[:300]}")
+        self.stats["misses"] += 1
+        data = resp.json()
+        self._responses[cache_key] = {"etag": resp.headers.get("etag") or data.get("etag"), "data": data, "ts": now}
+        self._responses.move_to_end(cache_key)
+        while len(self._responses) > RESPONSE_CACHE_SIZE:
+            self._responses.popitem(last=False)
+        return data
+
+    async def _fetch_videos(self, ids: List[str]) -> Dict[str, dict]:
+        data = await self._get(
+            "videos", {"part": "snippet,statistics,contentDetails", "id": ",".join(sorted(ids))}, VIDEO_TTL
+        )
+        return {item["id"]: item for item in data.get("items", [])}
+
+    async def _fetch_channels(self, ids: List[str]) -> Dict[str, dict]:
+        data = await self._get("channels", {"part": "statistics", "id": ",".join(sorted(ids))}, CHANNEL_TTL)
+        return {item["id"]: item for item in data.get("items", [])}
+
+    async def search_videos(self, query: str, max_results: int = 12) -> List[dict]:
+        search = await self._get(
+            "search", {"part": "snippet", "q": query, "type": "video", "maxResults": max_results}, SEARCH_FRESH_TTL
+        )
+        items = [item for item in search.get("items", []) if item.get("id", {}).get("videoId")]
+        video_ids = [item["id"]["videoId"] for item in items]
+        channel_ids = [item["snippet"].get("channelId") for item in items]
+        details, channels = await asyncio.gather(
+            self.videos.load_many(video_ids),
+            self.channels.load_many(channel_ids),
+        )
+
+        current_year = datetime.now().year
+        videos = []
+        for item in items:
+            video_id = item["id"]["videoId"]
+            snippet = item["snippet"]
+            detail = details.get(video_id) or {}
+            stats = detail.get("statistics", {})
+            channel = channels.get(snippet.get("channelId")) or {}
+            published_at = snippet.get("publishedAt")
+            videos.append({
+                "id": video_id,
+                "title": snippet.get("title", ""),
+                "description": snippet.get("description", ""),
+                "thumbnail": snippet.get("thumbnails", {}).get("high", {}).get("url", ""),
+                "publishedAt": published_at,
+                "channel": snippet.get("channelTitle", ""),
+                "views": format_number(stats.get("viewCount")),
+                "likes": format_number(stats.get("likeCount")),
+                "comments": format_number(stats.get("commentCount")),
+                "url": f"https://www.youtube.com/watch?v={video_id}",
+                "duration": detail.get("contentDetails", {}).get("duration"),
+                "category": "",
+                "tags": detail.get("snippet", {}).get("tags", []),
+                "channelImage": "",
+                "subscriberCount": format_number(channel.get("statistics", {}).get("subscriberCount")),
+                "isCurrentYear": bool(published_at) and published_at[:4] == str(current_year),
+            })
+        return videos
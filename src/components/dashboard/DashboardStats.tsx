@@ -1,6 +1,7 @@
 import { useEffect, useState } from "react";
 import { Card, CardContent } from "@/components/ui/card";
 import { Upload, Sparkles, LineChart } from "lucide-react";
+import { authHeaders } from "@/lib/backendAuth";
 
 const statsConfig = [
   {
@@ -29,8 +30,12 @@ export default function DashboardStats() {
   });
 
   useEffect(() => {
-    // Example: fetch stats from API here and update state
-    // fetch('/api/stats').then(res => res.json()).then(setStats);
+    const apiBase = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
+    authHeaders()
+      .then((headers) => fetch(`${apiBase}/api/stats`, { headers }))
+      .then((res) => (res.ok ? res.json() : Promise.reject(res.status)))
+      .then((data) => setStats({ thumbnails: data.thumbnails, scripts: data.scripts, keywords: data.keywords }))
+      .catch((err) => console.error("Failed to load dashboard stats:", err));
   }, []);
 
   return (
@@ -6,6 +6,7 @@ import { Loader2, LayoutGrid } from "lucide-react";
 import { Alert, AlertTitle, AlertDescription } from "@/components/ui/alert";
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogFooter, DialogDescription } from "@/components/ui/dialog";
 import { useLocation } from "react-router-dom";
+import { authHeaders } from "@/lib/backendAuth";
 
 // KeywordMatrix component
 const KeywordMatrix: React.FC = () => {
@@ -29,7 +30,9 @@ const KeywordMatrix: React.FC = () => {
       try {
         // Always use suggest=5
         const apiBase = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
-        const res = await fetch(`${apiBase}/analyze_keyword?query=${encodeURIComponent(term)}&suggest=5`);
+        const res = await fetch(`${apiBase}/analyze_keyword?query=${encodeURIComponent(term)}&suggest=5`, {
+          headers: await authHeaders(),
+        });
         if (!res.ok) {
           throw new Error('Failed to fetch keyword data from backend');
         }
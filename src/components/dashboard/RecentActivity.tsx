@@ -1,5 +1,6 @@
 import { useEffect, useState } from "react";
 import { Upload, Sparkles, LineChart } from "lucide-react";
+import { authHeaders } from "@/lib/backendAuth";
 
 // Type for activity items
 interface ActivityItem {
@@ -35,7 +36,12 @@ export default function RecentActivity() {
   ]);
 
   useEffect(() => {
-    // Example: fetch('/api/activity').then(res => res.json()).then(setActivities);
+    const apiBase = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
+    authHeaders()
+      .then((headers) => fetch(`${apiBase}/api/activity?limit=10`, { headers }))
+      .then((res) => (res.ok ? res.json() : Promise.reject(res.status)))
+      .then((items: ActivityItem[]) => setActivities(items))
+      .catch((err) => console.error("Failed to load recent activity:", err));
   }, []);
 
   return (
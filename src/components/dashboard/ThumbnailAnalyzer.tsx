@@ -3,6 +3,7 @@ import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Alert, AlertDescription } from "@/components/ui/alert";
 import { Camera, Loader2, MessageSquare, Upload, AlertCircle } from "lucide-react";
 import { useAuth } from "@/contexts/AuthContext";
+import { authHeaders } from "@/lib/backendAuth";
 import { Textarea } from "@/components/ui/textarea";
 import { Button } from "@/components/ui/button";
 import { useTrial } from "@/contexts/TrialContext";
@@ -181,6 +182,7 @@ export function ThumbnailAnalyzer() {
       formData.append('query', queryText);
       const response = await fetch(`${apiBase}/upload_and_query`, {
         method: 'POST',
+        headers: await authHeaders(),
         body: formData,
       });
       const text = await response.text();
@@ -7,6 +7,7 @@ import { Loader2, Twitter, Instagram, Upload, AlertCircle, Sparkles } from "luci
 import { Alert, AlertDescription } from "@/components/ui/alert";
 import { ResultSlides } from "./ResultSlides";
 import { Helmet } from "react-helmet";
+import { authHeaders } from "@/lib/backendAuth";
 
 const TweetGenerator: React.FC = () => {
   const [topic, setTopic] = useState("");
@@ -104,6 +105,7 @@ const TweetGenerator: React.FC = () => {
 
       const resp = await fetch(`${apiBase}/generate_tweet`, {
         method: "POST",
+        headers: await authHeaders(),
         body: formData
       });
 
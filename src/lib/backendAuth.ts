@@ -0,0 +1,9 @@
+import { supabase } from "@/lib/supabase";
+
+// The backend identifies the caller (and their plan) from the Supabase session
+// token, so every request to it carries the current access token when signed in.
+export async function authHeaders(): Promise<Record<string, string>> {
+  const { data } = await supabase.auth.getSession();
+  const token = data.session?.access_token;
+  return token ? { Authorization: `Bearer ${token}` } : {};
+}
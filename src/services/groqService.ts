@@ -1,9 +1,9 @@
 // src/services/groqService.ts
 import axios from 'axios';
+import { authHeaders } from '@/lib/backendAuth';
 
 // If VITE_GROQ_API_URL is set, use it. Otherwise, default to VITE_BACKEND_URL + '/ideas'
 const GROQ_API_URL = import.meta.env.VITE_GROQ_API_URL || (import.meta.env.VITE_BACKEND_URL + '/ideas');
-const GROQ_API_KEY = import.meta.env.VITE_GROQ_API_KEY || '';
 
 
 export interface VideoIdea {
@@ -23,7 +23,7 @@ export async function generateVideoIdeas(videoTitle: string, videoDescription: s
       },
       {
         headers: {
-          'Authorization': `Bearer ${GROQ_API_KEY}`,
+          ...(await authHeaders()),
           'Content-Type': 'application/json',
         },
       }